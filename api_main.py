@@ -2,7 +2,13 @@
 """
 TG Pansou Bot HTTP API 入口
 """
+import argparse
+import os
+import signal
+import socket
 import sys
+import time
+import traceback
 from pathlib import Path
 
 from aiohttp import web
@@ -12,17 +18,154 @@ sys.path.insert(0, str(Path(__file__).parent / "src"))
 
 from config import settings
 from http_api import create_app
+from logger import setup_logging, stop_logging
+from pansou_client import pansou_client
+from rate_limit import api_token_limiter
+from shared_cache import SharedTokenUsage
+
+# 滚动重启时新 worker 的预热时间，之后再让旧 worker 优雅退出
+WORKER_WARMUP_SECONDS = 1.0
+SUPERVISOR_POLL_SECONDS = 0.5
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="TG Pansou Bot HTTP API")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.http_api_workers,
+        help="worker 进程数，大于 1 时通过 SO_REUSEPORT 共享监听端口",
+    )
+    return parser.parse_args()
+
+
+def _create_reuseport_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def _run_worker(index: int) -> None:
+    """worker 进程：打开自己的共享缓存连接和监听 socket，SIGTERM 时由 aiohttp 优雅退出。"""
+    # 日志后台线程不会随 fork 复制，每个 worker 启动自己的
+    setup_logging()
+    pansou_client.enable_shared_cache(settings.shared_cache_path)
+    api_token_limiter.enable_shared_state(settings.shared_cache_path)
+    sock = _create_reuseport_socket(settings.http_api_host, settings.http_api_port)
+    print(f"✅ HTTP API worker {index} 已启动 (pid={os.getpid()})")
+    web.run_app(create_app(), sock=sock, print=None)
+
+
+def _spawn_worker(index: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # SIGHUP 只由主进程处理；SIGTERM/SIGINT 交给 aiohttp 优雅退出
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        exit_code = 0
+        try:
+            _run_worker(index)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            # os._exit 不会执行 atexit，先写完队列中的日志
+            stop_logging()
+            os._exit(exit_code)
+    return pid
+
+
+def _run_supervisor(worker_count: int) -> None:
+    """主进程只负责拉起、回收和重启 worker：SIGHUP 滚动重启，SIGTERM/SIGINT 全部优雅退出。"""
+    workers: dict[int, int] = {}
+    retiring: set[int] = set()
+    state = {"stopping": False, "restart": False}
+
+    def _handle_stop(signum, _frame):
+        state["stopping"] = True
+
+    def _handle_restart(signum, _frame):
+        state["restart"] = True
+
+    signal.signal(signal.SIGTERM, _handle_stop)
+    signal.signal(signal.SIGINT, _handle_stop)
+    signal.signal(signal.SIGHUP, _handle_restart)
+
+    # 上次运行残留的并发占用全部作废；速率和每日计数保留，重启不会清零配额
+    token_usage = SharedTokenUsage(settings.shared_cache_path)
+    token_usage.clear_active()
+
+    for index in range(worker_count):
+        workers[_spawn_worker(index)] = index
+    print(f"✅ HTTP API 已启动 {worker_count} 个 worker，监听 {settings.http_api_host}:{settings.http_api_port}")
+
+    while workers:
+        if state["stopping"]:
+            for pid in workers:
+                _terminate(pid)
+            state["stopping"] = False
+            state["restart"] = False
+            retiring.update(workers)
+
+        if state["restart"]:
+            state["restart"] = False
+            for pid, index in list(workers.items()):
+                if pid in retiring:
+                    continue
+                workers[_spawn_worker(index)] = index
+                time.sleep(WORKER_WARMUP_SECONDS)
+                retiring.add(pid)
+                _terminate(pid)
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(SUPERVISOR_POLL_SECONDS)
+            continue
+
+        # worker 被强杀时来不及释放并发占用，由主进程回收
+        token_usage.clear_active(str(pid))
+        index = workers.pop(pid, None)
+        if index is None:
+            continue
+        if pid in retiring:
+            retiring.discard(pid)
+            continue
+        # 意外退出的 worker 自动补位
+        print(f"⚠️ HTTP API worker {index} 异常退出 (pid={pid}, status={status})，正在重启")
+        time.sleep(SUPERVISOR_POLL_SECONDS)
+        workers[_spawn_worker(index)] = index
+
+
+def _terminate(pid: int) -> None:
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
 
 
 if __name__ == "__main__":
-    if settings.require_http_api_token and not settings.http_api_token:
+    if settings.require_http_api_token and not settings.get_api_tokens():
         raise SystemExit(
-            "HTTP API 已启用安全模式：请先配置 HTTP_API_TOKEN，"
+            "HTTP API 已启用安全模式：请先配置 HTTP_API_TOKEN 或 HTTP_API_TOKENS，"
             "或显式设置 REQUIRE_HTTP_API_TOKEN=false 后再启动。"
         )
 
-    web.run_app(
-        create_app(),
-        host=settings.http_api_host,
-        port=settings.http_api_port,
-    )
+    args = _parse_args()
+    if args.workers <= 1:
+        setup_logging()
+        web.run_app(
+            create_app(),
+            host=settings.http_api_host,
+            port=settings.http_api_port,
+        )
+    elif not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        raise SystemExit("当前平台不支持 SO_REUSEPORT / fork，无法使用 --workers")
+    else:
+        _run_supervisor(args.workers)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+TG Pansou Bot 单进程入口 - 在同一个事件循环里同时运行 Bot 和 HTTP API
+
+两者共用 PansouClient（连接池、结果缓存、健康检查缓存）、限流器和运行指标，
+同一关键词从 Telegram 和网站发起时只请求一次上游。
+"""
+import asyncio
+import signal
+import sys
+from pathlib import Path
+
+from aiohttp import web
+
+# 添加 src 到路径
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from bot import start_bot, stop_bot
+from config import settings
+from http_api import create_app
+from logger import setup_logging
+
+
+async def run() -> None:
+    setup_logging()
+    application = await start_bot()
+
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.http_api_host, port=settings.http_api_port)
+    await site.start()
+    print(f"✅ HTTP API 已启动: http://{settings.http_api_host}:{settings.http_api_port}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows 不支持，交给 KeyboardInterrupt 处理
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        # 先停止接收 Telegram 更新，再让 HTTP API 处理完进行中的请求并关闭共享客户端
+        await stop_bot(application)
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    if settings.require_http_api_token and not settings.get_api_tokens():
+        raise SystemExit(
+            "HTTP API 已启用安全模式：请先配置 HTTP_API_TOKEN 或 HTTP_API_TOKENS，"
+            "或显式设置 REQUIRE_HTTP_API_TOKEN=false 后再启动。"
+        )
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    print("\n👋 已停止")
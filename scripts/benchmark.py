@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""PansouClient 热点路径微基准。
+
+用合成的 pansou 响应（10 ~ 10000 条链接）或录制的真实响应测量归一化、过滤、
+格式化、按钮生成、HTTP API 扁平化和缓存键生成的耗时，结果输出为 JSON，
+可与保存的基线对比：
+
+    python scripts/benchmark.py --output bench.json
+    python scripts/benchmark.py --baseline bench.json --threshold 0.2
+    python scripts/benchmark.py --payload recorded.json --sizes 100,1000
+
+不需要真实 TG token，也不会请求上游。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+os.environ.setdefault("TG_BOT_TOKEN", "BENCHMARK_TOKEN_PLACEHOLDER")
+os.environ.setdefault("HTTP_API_TOKEN", "benchmark-token")
+
+from http_api import _flatten_results  # noqa: E402
+from pansou_client import pansou_client  # noqa: E402
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+# 合成数据里各网盘类型的占比，大致参照线上结果分布
+CLOUD_TYPE_WEIGHTS = {
+    "baidu": 30,
+    "quark": 25,
+    "aliyun": 15,
+    "xunlei": 8,
+    "uc": 6,
+    "tianyi": 5,
+    "115": 4,
+    "123": 3,
+    "magnet": 3,
+    "others": 1,
+}
+NOTE_WORDS = ["4K", "1080P", "HDR", "合集", "全集", "国语", "中字", "蓝光", "无损", "更新至", "完结", "预告"]
+FILTER_CONFIG = {"include": ["1080p", "4k"], "exclude": ["预告"]}
+
+
+def build_synthetic_payload(size: int, seed: int = 42) -> dict[str, Any]:
+    """生成与 pansou res=merge 响应结构一致的合成数据。"""
+    rng = random.Random(seed + size)
+    cloud_types = list(CLOUD_TYPE_WEIGHTS)
+    weights = list(CLOUD_TYPE_WEIGHTS.values())
+    merged_by_type: dict[str, list[dict[str, Any]]] = {}
+    for index in range(size):
+        cloud_type = rng.choices(cloud_types, weights)[0]
+        words = " ".join(rng.sample(NOTE_WORDS, 3))
+        merged_by_type.setdefault(cloud_type, []).append(
+            {
+                "url": f"https://pan.example.com/{cloud_type}/s/{index:06d}{rng.randrange(16**6):06x}",
+                "password": f"{rng.randrange(10000):04d}" if rng.random() < 0.4 else "",
+                "note": f"示例资源 {index} <{words}> & 第{rng.randrange(1, 40)}集",
+                "datetime": f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T12:00:00Z",
+                "source": f"tg:channel_{rng.randrange(50)}",
+            }
+        )
+    return {"code": 0, "message": "success", "data": {"total": size, "merged_by_type": merged_by_type}}
+
+
+def load_recorded_payloads(paths: list[str]) -> list[tuple[str, dict[str, Any]]]:
+    payloads = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            payloads.append((Path(path).stem, json.load(f)))
+    return payloads
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> dict[str, float]:
+    """先校准循环次数使单轮不少于 min_time 秒，再重复 repeat 轮，返回单次调用耗时（微秒）。"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - started) / loops * 1_000_000)
+
+    return {
+        "loops": loops,
+        "min_us": round(min(samples), 3),
+        "median_us": round(statistics.median(samples), 3),
+        "stdev_us": round(statistics.stdev(samples), 3) if len(samples) > 1 else 0.0,
+    }
+
+
+def build_cases(raw: dict[str, Any]) -> dict[str, Callable[[], Any]]:
+    normalized = pansou_client._normalize_search_result(raw)
+    merged_by_type = normalized["merged_by_type"]
+    largest_type = max(merged_by_type, key=lambda key: len(merged_by_type[key]))
+    keyword = "示例资源"
+
+    return {
+        "normalize_search_result": lambda: pansou_client._normalize_search_result(raw),
+        "apply_filter": lambda: pansou_client._apply_filter(merged_by_type, FILTER_CONFIG),
+        "format_overview": lambda: pansou_client.format_overview(normalized, keyword),
+        "format_type_results": lambda: pansou_client.format_type_results(normalized, keyword, largest_type),
+        "format_results": lambda: pansou_client.format_results(normalized, keyword),
+        "get_type_buttons": lambda: pansou_client.get_type_buttons(normalized),
+        "flatten_results": lambda: _flatten_results(normalized),
+        "search_cache_key": lambda: pansou_client.search_cache_key(
+            keyword,
+            channels=["channel_b", "channel_a"],
+            plugins=["plugin_a"],
+            cloud_types=["quark", "baidu"],
+            filter_config=FILTER_CONFIG,
+            limit=20,
+        ),
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    payloads = [(f"synthetic-{size}", build_synthetic_payload(size)) for size in args.sizes]
+    payloads.extend(load_recorded_payloads(args.payload))
+    selected = set(args.only) if args.only else None
+
+    results = []
+    for payload_name, raw in payloads:
+        links = sum(len(v) for v in pansou_client._normalize_search_result(raw)["merged_by_type"].values())
+        for case_name, func in build_cases(raw).items():
+            if selected and case_name not in selected:
+                continue
+            stats = measure(func, args.repeat, args.min_time)
+            results.append({"case": case_name, "payload": payload_name, "links": links, **stats})
+            print(f"{case_name:<26} {payload_name:<18} {stats['min_us']:>12.1f} us", file=sys.stderr)
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    """按 (case, payload) 对比最小耗时（受调度噪声影响最小），返回超过阈值的退化项。"""
+    previous = {(item["case"], item["payload"]): item for item in baseline.get("results", [])}
+    regressions = []
+    print(f"\n{'case':<26} {'payload':<18} {'baseline':>12} {'current':>12} {'change':>8}", file=sys.stderr)
+    for item in report["results"]:
+        old = previous.get((item["case"], item["payload"]))
+        if not old or not old["min_us"]:
+            continue
+        change = item["min_us"] / old["min_us"] - 1
+        item["baseline_min_us"] = old["min_us"]
+        item["change"] = round(change, 4)
+        flag = " !" if change > threshold else ""
+        print(
+            f"{item['case']:<26} {item['payload']:<18} {old['min_us']:>12.1f} "
+            f"{item['min_us']:>12.1f} {change:>+7.1%}{flag}",
+            file=sys.stderr,
+        )
+        if change > threshold:
+            regressions.append(f"{item['case']} / {item['payload']}: {change:+.1%}")
+    return regressions
+
+
+def _parse_sizes(value: str) -> list[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="PansouClient 热点路径微基准")
+    parser.add_argument("--sizes", type=_parse_sizes, default=list(DEFAULT_SIZES), help="合成数据链接数，逗号分隔")
+    parser.add_argument("--payload", action="append", default=[], help="录制的 pansou 原始响应 JSON，可重复指定")
+    parser.add_argument("--only", action="append", default=[], help="只运行指定用例，可重复指定")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例重复轮数")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮最少运行秒数")
+    parser.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    parser.add_argument("--baseline", help="对比用的基线 JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="最小耗时变慢超过该比例视为退化")
+    args = parser.parse_args()
+
+    report = run(args)
+
+    regressions: list[str] = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+    if regressions:
+        print("\n性能退化：", file=sys.stderr)
+        for line in regressions:
+            print(f"  - {line}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""Bot 端到端场景压测。
+
+在本进程内启动 fake_telegram，子进程启动 fake_pansou 和真实 Bot（main.py），
+按目标速率注入私聊搜索更新，并按概率点击结果里的网盘类型按钮，覆盖
+handle_private_message → perform_search → _run_search_flow → 编辑 → 回调 的完整链路。
+结束后输出每秒处理更新数、每次搜索的 Bot API 调用数、429 次数和端到端延迟：
+
+    python scripts/bot_scenario.py --users 50 --searches 200 --rate 20
+    python scripts/bot_scenario.py --rate 50 --tg-rate-limit-rate 0.02 --bot-env TG_GLOBAL_RATE_PER_SECOND=1000
+
+Bot 出站流控（TG_GLOBAL_RATE_PER_SECOND 等）保持默认时，吞吐会被限制在真实 Telegram 的配额附近。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import html
+import json
+import os
+import random
+import re
+import shlex
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Optional
+
+import aiohttp
+from aiohttp import web
+
+from fake_pansou import parse_latency
+from fake_telegram import POLLING_METHODS, FakeTelegram, FakeTelegramConfig, create_app
+from load_test import free_port, percentile_ms, upstream_searches, wait_until_up
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKE_PANSOU = Path(__file__).resolve().parent / "fake_pansou.py"
+SEARCHING_PREFIX = "🔍 正在搜索"
+SEARCHING_PATTERN = re.compile(r"正在搜索：<b>(.*?)</b>")
+# 场景用户 ID 起点，避开替身 Bot 自身的 ID
+USER_ID_BASE = 200000
+
+
+def _latency_summary(values: list[float]) -> dict[str, Optional[float]]:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile_ms(values, 50),
+        "p95": percentile_ms(values, 95),
+        "p99": percentile_ms(values, 99),
+        "max": percentile_ms(values, 100),
+        "mean": round(statistics.fmean(values) * 1000, 1) if values else None,
+    }
+
+
+class ScenarioTracker:
+    """监听替身记录的 Bot API 调用，把占位消息、结果编辑和回调应答对应回每次搜索。"""
+
+    def __init__(self, fake: FakeTelegram, click_rate: float, seed: int):
+        self.fake = fake
+        self.click_rate = click_rate
+        self.rng = random.Random(seed)
+        self.searches: list[dict[str, Any]] = []
+        self.pending: dict[tuple[int, str], deque] = {}
+        self.by_message: dict[tuple[int, int], dict[str, Any]] = {}
+        self.by_callback: dict[str, dict[str, Any]] = {}
+        self.done = asyncio.Event()
+
+    def start_search(self, user_id: int, keyword: str) -> None:
+        update_id = self.fake.push_update(self.fake.text_update(user_id, keyword))
+        record = {"update_id": update_id, "chat_id": user_id, "keyword": keyword, "outcome": None}
+        self.searches.append(record)
+        self.pending.setdefault((user_id, keyword), deque()).append(record)
+        self.done.clear()
+
+    def _click(self, record: dict[str, Any], reply_markup: Any) -> None:
+        buttons = [
+            button.get("callback_data", "")
+            for row in (reply_markup or {}).get("inline_keyboard", [])
+            for button in row
+        ]
+        type_buttons = [data for data in buttons if data.startswith("type:")]
+        if not type_buttons or self.rng.random() >= self.click_rate:
+            return
+        update = self.fake.callback_update(record["chat_id"], record["chat_id"], record["message_id"], type_buttons[0])
+        record["click_update_id"] = self.fake.push_update(update)
+        record["click_id"] = update["callback_query"]["id"]
+        record["click_done"] = False
+        self.by_callback[record["click_id"]] = record
+
+    def on_call(self, call: dict[str, Any]) -> None:
+        if call["status"] != 200:
+            return
+        method = call["method"]
+        text = str(call.get("text") or "")
+
+        if method == "sendMessage" and text.startswith(SEARCHING_PREFIX):
+            match = SEARCHING_PATTERN.search(text)
+            queue = self.pending.get((int(call["chat_id"]), html.unescape(match.group(1)) if match else ""))
+            if queue:
+                record = queue.popleft()
+                record["message_id"] = call["result_message_id"]
+                record["placeholder_at"] = call["at"]
+                self.by_message[(record["chat_id"], record["message_id"])] = record
+            return
+
+        if method == "answerCallbackQuery":
+            record = self.by_callback.get(str(call.get("callback_query_id")))
+            if record is not None:
+                record.setdefault("click_answered_at", call["at"])
+            return
+
+        if method != "editMessageText" or call.get("message_id") is None:
+            return
+        record = self.by_message.get((int(call["chat_id"]), int(call["message_id"])))
+        if record is None:
+            return
+        if record["outcome"] is None:
+            if text.startswith(SEARCHING_PREFIX):
+                return
+            record["completed_at"] = call["at"]
+            record["outcome"] = "error" if text.startswith("❌") else ("empty" if "未找到" in text else "ok")
+            if record["outcome"] == "ok":
+                self._click(record, call.get("reply_markup"))
+        elif record.get("click_done") is False:
+            record["click_done"] = True
+            record["click_completed_at"] = call["at"]
+        self._check_done()
+
+    def _check_done(self) -> None:
+        if all(
+            record["outcome"] is not None and record.get("click_done") is not False
+            for record in self.searches
+        ):
+            self.done.set()
+
+    def report(self, calls: list[dict[str, Any]]) -> dict[str, Any]:
+        fake = self.fake
+        completed = [record for record in self.searches if record["outcome"] is not None]
+        clicks = [record for record in self.searches if "click_id" in record]
+        clicks_done = [record for record in clicks if record.get("click_done")]
+
+        started = min((fake.enqueued_at[r["update_id"]] for r in self.searches), default=0.0)
+        finished = max(
+            [r["completed_at"] for r in completed] + [r["click_completed_at"] for r in clicks_done],
+            default=started,
+        )
+        elapsed = finished - started
+        handled_updates = len(completed) + len(clicks_done)
+
+        bot_calls = [call for call in calls if call["method"] not in POLLING_METHODS]
+        methods = Counter(call["method"] for call in bot_calls)
+        statuses = Counter(str(call["status"]) for call in bot_calls)
+
+        return {
+            "searches": len(self.searches),
+            "completed": len(completed),
+            "outcomes": dict(Counter(r["outcome"] or "timeout" for r in self.searches)),
+            "clicks": len(clicks),
+            "clicks_completed": len(clicks_done),
+            "elapsed_seconds": round(elapsed, 2),
+            "updates_per_second": round(handled_updates / elapsed, 1) if elapsed > 0 else None,
+            "telegram_calls": dict(methods),
+            "telegram_call_statuses": dict(statuses),
+            "telegram_calls_per_search": round(len(bot_calls) / len(completed), 2) if completed else None,
+            "latency_ms": {
+                "delivery": _latency_summary([
+                    fake.delivered_at[r["update_id"]] - fake.enqueued_at[r["update_id"]]
+                    for r in self.searches
+                    if r["update_id"] in fake.delivered_at
+                ]),
+                "first_response": _latency_summary([
+                    r["placeholder_at"] - fake.enqueued_at[r["update_id"]]
+                    for r in self.searches
+                    if "placeholder_at" in r
+                ]),
+                "search_e2e": _latency_summary([
+                    r["completed_at"] - fake.enqueued_at[r["update_id"]] for r in completed
+                ]),
+                "callback_answer": _latency_summary([
+                    r["click_answered_at"] - fake.enqueued_at[r["click_update_id"]]
+                    for r in clicks
+                    if "click_answered_at" in r
+                ]),
+                "callback_e2e": _latency_summary([
+                    r["click_completed_at"] - fake.enqueued_at[r["click_update_id"]] for r in clicks_done
+                ]),
+            },
+        }
+
+
+def _bot_env(args: argparse.Namespace, telegram_url: str, upstream: str, data_dir: str) -> dict[str, str]:
+    env = os.environ.copy()
+    env.update(
+        {
+            "TG_BOT_TOKEN": "123456:FAKE-SCENARIO-TOKEN",
+            "TG_API_BASE_URL": telegram_url,
+            "PANSOU_API_URL": upstream,
+            "DATA_DIR": data_dir,
+            "LOG_LEVEL": "WARNING",
+            # 放宽搜索限流，压测的是处理链路而不是限流本身
+            "RATE_LIMIT_PER_MINUTE": "1000000",
+            "CHAT_RATE_LIMIT_PER_MINUTE": "1000000",
+            "GLOBAL_RATE_LIMIT_PER_MINUTE": "1000000",
+            "NO_PROXY": "127.0.0.1,localhost",
+        }
+    )
+    env.pop("BOT_METRICS_PORT", None)
+    for item in args.bot_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    work_dir = tempfile.mkdtemp(prefix="bot-scenario-")
+    pansou_port = free_port()
+    upstream = f"http://127.0.0.1:{pansou_port}"
+    pansou_process = await asyncio.create_subprocess_exec(
+        sys.executable, str(FAKE_PANSOU), "--port", str(pansou_port), *shlex.split(args.upstream_args),
+        stdout=asyncio.subprocess.DEVNULL,
+    )
+
+    telegram_app = create_app(
+        FakeTelegramConfig(
+            latency=args.tg_latency,
+            rate_limit_rate=args.tg_rate_limit_rate,
+            retry_after=args.tg_retry_after,
+            seed=args.seed,
+        )
+    )
+    fake: FakeTelegram = telegram_app["fake_telegram"]
+    telegram_runner = web.AppRunner(telegram_app, access_log=None)
+    await telegram_runner.setup()
+    telegram_port = free_port()
+    await web.TCPSite(telegram_runner, host="127.0.0.1", port=telegram_port).start()
+
+    session = aiohttp.ClientSession()
+    bot_process = None
+    log_path = Path(work_dir) / "bot.log"
+    try:
+        await wait_until_up(session, f"{upstream}/healthz")
+        with open(log_path, "wb") as log_file:
+            bot_process = await asyncio.create_subprocess_exec(
+                sys.executable, str(ROOT / "main.py"),
+                cwd=str(ROOT),
+                env=_bot_env(args, f"http://127.0.0.1:{telegram_port}", upstream, str(Path(work_dir) / "data")),
+                stdout=log_file,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        try:
+            await asyncio.wait_for(fake.polling.wait(), args.startup_timeout)
+        except asyncio.TimeoutError:
+            raise SystemExit(f"Bot 未在 {args.startup_timeout} 秒内开始轮询，日志见 {log_path}")
+
+        tracker = ScenarioTracker(fake, args.click_rate, args.seed)
+        fake.listeners.append(tracker.on_call)
+        calls_before = len(fake.calls)
+        upstream_before = await upstream_searches(session, upstream)
+
+        rng = random.Random(args.seed)
+        keywords = [f"关键词{index}" for index in range(args.keywords)]
+        started = time.monotonic()
+        for index in range(args.searches):
+            delay = started + index / args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tracker.start_search(USER_ID_BASE + index % args.users, rng.choice(keywords))
+
+        try:
+            await asyncio.wait_for(tracker.done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        report = tracker.report(fake.calls[calls_before:])
+        upstream_after = await upstream_searches(session, upstream)
+        report.update(
+            {
+                "target_rate": args.rate,
+                "users": args.users,
+                "keywords": args.keywords,
+                "upstream_calls": (
+                    upstream_after - upstream_before
+                    if upstream_before is not None and upstream_after is not None
+                    else None
+                ),
+                "bot_log": str(log_path),
+            }
+        )
+        return report
+    finally:
+        if bot_process is not None and bot_process.returncode is None:
+            # SIGINT 走 KeyboardInterrupt，让 Bot 正常停止轮询并刷写设置
+            bot_process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot_process.wait(), 15)
+            except asyncio.TimeoutError:
+                bot_process.kill()
+                await bot_process.wait()
+        await session.close()
+        await telegram_runner.cleanup()
+        pansou_process.terminate()
+        await pansou_process.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bot 端到端场景压测")
+    parser.add_argument("--searches", type=int, default=100, help="私聊搜索总数")
+    parser.add_argument("--users", type=int, default=50, help="参与的用户数，搜索按轮询分配")
+    parser.add_argument("--rate", type=float, default=10, help="每秒注入的搜索更新数")
+    parser.add_argument("--keywords", type=int, default=20, help="不同关键词数量")
+    parser.add_argument("--click-rate", type=float, default=0.5, help="搜索完成后点击网盘类型按钮的概率")
+    parser.add_argument("--tg-latency", type=parse_latency, default=parse_latency("fixed:0"),
+                        help="Bot API 调用延迟分布（毫秒），格式同 fake_pansou.py")
+    parser.add_argument("--tg-rate-limit-rate", type=float, default=0.0, help="Bot API 返回 429 的概率")
+    parser.add_argument("--tg-retry-after", type=int, default=1, help="429 响应中的 retry_after 秒数")
+    parser.add_argument("--upstream-args", default="--latency lognormal:80:0.5 --links 100",
+                        help="传给 fake_pansou.py 的参数")
+    parser.add_argument("--bot-env", action="append", default=[], help="额外传给 Bot 的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="等待 Bot 开始轮询的秒数")
+    parser.add_argument("--timeout", type=float, default=60, help="注入结束后等待全部完成的秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""本地 pansou 替身服务，用于压测和故障演练。
+
+提供 /api/search、/api/health 和 /healthz，可配置延迟分布、结果条数、
+响应结构（覆盖 _normalize_search_result 兼容的各种形态）以及错误、超时、
+连接重置注入；/__stats 返回请求计数，便于核对单飞和缓存是否生效：
+
+    python scripts/fake_pansou.py --port 8888 --latency lognormal:80:0.6 --links 50:500
+    python scripts/fake_pansou.py --shape mixed --error-rate 0.05 --reset-rate 0.01
+
+相同关键词总是返回相同内容。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import random
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from aiohttp import web
+
+SHAPES = ("merged", "results_dict", "items", "results_links", "unwrapped", "list")
+CLOUD_TYPES = ["baidu", "quark", "aliyun", "xunlei", "uc", "tianyi", "115", "123", "magnet", "others"]
+# 上游插件常见的别名写法，用于覆盖类型归一化
+CLOUD_TYPE_VARIANTS = {"aliyun": ["aliyun", "ali", "alipan"], "123": ["123", "123pan"]}
+NOTE_WORDS = ["4K", "1080P", "HDR", "合集", "全集", "国语", "中字", "蓝光", "无损", "更新至", "完结"]
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """解析延迟分布（毫秒），返回以秒为单位的采样函数。
+
+    支持 fixed:MS、uniform:MIN:MAX、lognormal:MEDIAN:SIGMA、exp:MEAN。
+    """
+    kind, _, rest = spec.partition(":")
+    values = [float(part) for part in rest.split(":") if part]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(max(values[0], 0.001))
+        return lambda rng: rng.lognormvariate(mu, values[1]) / 1000
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / max(values[0], 0.001)) / 1000
+    raise argparse.ArgumentTypeError(f"无法解析延迟分布: {spec}")
+
+
+def parse_range(spec: str) -> tuple[int, int]:
+    low, _, high = spec.partition(":")
+    return int(low), int(high or low)
+
+
+@dataclass
+class FakePansouConfig:
+    latency: Callable[[random.Random], float] = field(default_factory=lambda: parse_latency("fixed:0"))
+    links: tuple[int, int] = (50, 50)
+    shape: str = "merged"
+    error_rate: float = 0.0
+    error_status: int = 502
+    code_error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    hang_seconds: float = 60.0
+    reset_rate: float = 0.0
+    unhealthy: bool = False
+    seed: int = 0
+
+
+class FakePansou:
+    """pansou 替身：按配置生成响应并注入故障，同时统计请求次数。"""
+
+    def __init__(self, config: FakePansouConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.started_at = time.monotonic()
+        self.counters: Counter[str] = Counter()
+        self.keywords: Counter[str] = Counter()
+        self.shape_index = 0
+
+    def _link(self, rng: random.Random, keyword: str, cloud_type: str, index: int) -> dict[str, str]:
+        words = " ".join(rng.sample(NOTE_WORDS, 2))
+        return {
+            "url": f"https://pan.example.com/{cloud_type}/s/{zlib.crc32(keyword.encode()):08x}{index:05d}",
+            "password": f"{rng.randrange(10000):04d}" if rng.random() < 0.4 else "",
+            "note": f"{keyword} {words} 第{index + 1}集",
+            "datetime": "2024-01-01T00:00:00Z",
+            "source": f"tg:channel_{rng.randrange(20)}",
+        }
+
+    def build_results(self, keyword: str, limit_types: Optional[list[str]] = None) -> dict[str, list[dict[str, str]]]:
+        """按关键词确定性地生成 merged_by_type 结构。"""
+        rng = random.Random(zlib.crc32(keyword.encode("utf-8")) ^ self.config.seed)
+        count = rng.randint(*self.config.links)
+        cloud_types = limit_types or CLOUD_TYPES
+        merged: dict[str, list[dict[str, str]]] = {}
+        for index in range(count):
+            cloud_type = rng.choice(cloud_types)
+            variant = rng.choice(CLOUD_TYPE_VARIANTS.get(cloud_type, [cloud_type]))
+            merged.setdefault(variant, []).append(self._link(rng, keyword, cloud_type, index))
+        return merged
+
+    def _next_shape(self) -> str:
+        if self.config.shape != "mixed":
+            return self.config.shape
+        shape = SHAPES[self.shape_index % len(SHAPES)]
+        self.shape_index += 1
+        return shape
+
+    def render(self, merged: dict[str, list[dict[str, str]]], shape: str) -> Any:
+        """把 merged_by_type 转成指定的上游响应形态。"""
+        total = sum(len(links) for links in merged.values())
+        if shape == "merged":
+            return {"code": 0, "message": "success", "data": {"total": total, "merged_by_type": merged}}
+        if shape == "results_dict":
+            return {"code": 0, "data": {"count": total, "results": merged}}
+        if shape == "items":
+            # 使用备选字段名，覆盖 _normalize_link_item 的字段兼容
+            items = [
+                {
+                    "link": link["url"],
+                    "pwd": link["password"],
+                    "title": link["note"],
+                    "channel": link["source"],
+                    "type": cloud_type,
+                }
+                for cloud_type, links in merged.items()
+                for link in links
+            ]
+            return {"code": 0, "data": {"items": items}}
+        if shape == "results_links":
+            results = [
+                {
+                    "title": link["note"],
+                    "channel": link["source"],
+                    "links": [{"url": link["url"], "password": link["password"], "type": cloud_type}],
+                }
+                for cloud_type, links in merged.items()
+                for link in links
+            ]
+            return {"code": 0, "data": {"total": total, "results": results}}
+        if shape == "unwrapped":
+            return {"total": total, "merged_by_type": merged}
+        if shape == "list":
+            return {
+                "code": 0,
+                "data": [
+                    {**link, "cloud_type": cloud_type}
+                    for cloud_type, links in merged.items()
+                    for link in links
+                ],
+            }
+        raise ValueError(f"未知响应结构: {shape}")
+
+    async def _inject_faults(self, request: web.Request) -> Optional[web.StreamResponse]:
+        """按概率注入延迟和故障；返回非 None 时直接作为响应。"""
+        config = self.config
+        await asyncio.sleep(config.latency(self.rng))
+
+        roll = self.rng.random()
+        if roll < config.reset_rate:
+            self.counters["reset"] += 1
+            if request.transport is not None:
+                request.transport.abort()
+            raise asyncio.CancelledError()
+        roll -= config.reset_rate
+        if roll < config.timeout_rate:
+            self.counters["timeout"] += 1
+            await asyncio.sleep(config.hang_seconds)
+            return web.json_response({"code": 0, "data": {}})
+        roll -= config.timeout_rate
+        if roll < config.error_rate:
+            self.counters["http_error"] += 1
+            return web.json_response({"code": 1, "message": "injected error"}, status=config.error_status)
+        roll -= config.error_rate
+        if roll < config.code_error_rate:
+            self.counters["code_error"] += 1
+            return web.json_response({"code": 1, "message": "injected upstream failure"})
+        return None
+
+    async def search_handler(self, request: web.Request) -> web.StreamResponse:
+        if request.method == "POST":
+            try:
+                data = await request.json()
+            except ValueError:
+                data = {}
+        else:
+            data = dict(request.query)
+        keyword = str(data.get("kw") or "").strip()
+        self.counters["search"] += 1
+        self.keywords[keyword] += 1
+
+        faulted = await self._inject_faults(request)
+        if faulted is not None:
+            return faulted
+
+        cloud_types = data.get("cloud_types")
+        merged = self.build_results(keyword, cloud_types if isinstance(cloud_types, list) and cloud_types else None)
+        return web.json_response(self.render(merged, self._next_shape()))
+
+    async def health_handler(self, request: web.Request) -> web.Response:
+        self.counters["health"] += 1
+        if self.config.unhealthy:
+            return web.json_response({"status": "unavailable"}, status=503)
+        return web.json_response(
+            {
+                "status": "ok",
+                "plugins_enabled": True,
+                "plugin_count": 2,
+                "plugins": ["fake_plugin_a", "fake_plugin_b"],
+                "channels": ["fake_channel"],
+            }
+        )
+
+    async def healthz_handler(self, request: web.Request) -> web.Response:
+        self.counters["healthz"] += 1
+        return web.Response(status=503 if self.config.unhealthy else 200, text="ok")
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "uptime_seconds": round(time.monotonic() - self.started_at, 1),
+                "counters": dict(self.counters),
+                "distinct_keywords": len(self.keywords),
+                "top_keywords": self.keywords.most_common(10),
+            }
+        )
+
+    async def reset_handler(self, request: web.Request) -> web.Response:
+        self.counters.clear()
+        self.keywords.clear()
+        return web.json_response({"ok": True})
+
+
+def create_app(config: FakePansouConfig) -> web.Application:
+    fake = FakePansou(config)
+    app = web.Application()
+    app["fake_pansou"] = fake
+    app.router.add_route("*", "/api/search", fake.search_handler)
+    app.router.add_get("/api/health", fake.health_handler)
+    app.router.add_route("*", "/healthz", fake.healthz_handler)
+    app.router.add_get("/__stats", fake.stats_handler)
+    app.router.add_post("/__reset", fake.reset_handler)
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="本地 pansou 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("fixed:0"),
+                        help="延迟分布（毫秒）：fixed:MS | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA | exp:MEAN")
+    parser.add_argument("--links", type=parse_range, default=(50, 50), help="每个关键词的链接数，N 或 MIN:MAX")
+    parser.add_argument("--shape", choices=SHAPES + ("mixed",), default="merged", help="响应结构，mixed 为轮换")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 HTTP 错误的概率")
+    parser.add_argument("--error-status", type=int, default=502, help="注入错误时的 HTTP 状态码")
+    parser.add_argument("--code-error-rate", type=float, default=0.0, help="HTTP 200 但 code != 0 的概率")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="长时间不响应的概率")
+    parser.add_argument("--hang-seconds", type=float, default=60.0, help="模拟超时时挂起的秒数")
+    parser.add_argument("--reset-rate", type=float, default=0.0, help="直接断开连接的概率")
+    parser.add_argument("--unhealthy", action="store_true", help="健康检查接口返回 503")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    return parser
+
+
+def config_from_args(args: argparse.Namespace) -> FakePansouConfig:
+    return FakePansouConfig(
+        latency=args.latency,
+        links=args.links,
+        shape=args.shape,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        code_error_rate=args.code_error_rate,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        reset_rate=args.reset_rate,
+        unhealthy=args.unhealthy,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    print(f"✅ pansou 替身已启动: http://{args.host}:{args.port}")
+    web.run_app(create_app(config_from_args(args)), host=args.host, port=args.port, print=None)
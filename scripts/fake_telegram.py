@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""本地 Telegram Bot API 替身，用于端到端压测 Bot。
+
+getUpdates 按长轮询语义下发脚本注入的更新；sendMessage、editMessageText、
+answerCallbackQuery、deleteMessage(s) 等调用全部记录下来，可按概率返回 429。
+把 TG_API_BASE_URL 指向它即可让 Bot 在本地跑完整链路：
+
+    python scripts/fake_telegram.py --port 8081 --rate-limit-rate 0.01
+    TG_API_BASE_URL=http://127.0.0.1:8081 TG_BOT_TOKEN=123456:FAKE python main.py
+
+独立运行时通过控制接口注入和查看：
+- POST /__updates  注入更新（Update 对象列表，update_id 可省略）
+- GET  /__calls    已记录的 Bot API 调用
+- GET  /__stats    按方法统计的调用次数
+- POST /__reset    清空记录
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from aiohttp import web
+
+from fake_pansou import parse_latency
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "FakePansouBot", "username": "fake_pansou_bot"}
+# 长轮询单次最多挂起的秒数，避免关闭时等待过久
+MAX_POLL_SECONDS = 5.0
+# 不计入"Bot 出站调用"的方法
+POLLING_METHODS = {"getUpdates", "getMe", "deleteWebhook", "setMyCommands", "getMyCommands", "close", "logOut"}
+
+
+@dataclass
+class FakeTelegramConfig:
+    latency: Callable[[random.Random], float] = field(default_factory=lambda: parse_latency("fixed:0"))
+    rate_limit_rate: float = 0.0
+    retry_after: int = 1
+    seed: int = 0
+
+
+def _parse_value(value: str) -> Any:
+    # PTB 对非字符串参数做 JSON 编码后以表单提交
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _user(user_id: int) -> dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _chat(chat_id: int) -> dict[str, Any]:
+    return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+
+
+class FakeTelegram:
+    """Bot API 替身：维护更新队列、消息存储和调用记录。"""
+
+    def __init__(self, config: FakeTelegramConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.updates: list[dict[str, Any]] = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.messages: dict[tuple[int, int], dict[str, Any]] = {}
+        self.calls: list[dict[str, Any]] = []
+        self.counters: Counter[str] = Counter()
+        self.enqueued_at: dict[int, float] = {}
+        self.delivered_at: dict[int, float] = {}
+        self.listeners: list[Callable[[dict[str, Any]], None]] = []
+        self.polling = asyncio.Event()
+        self._new_updates = asyncio.Event()
+
+    # ---- 更新注入 ----
+
+    def push_update(self, update: dict[str, Any]) -> int:
+        update_id = update.setdefault("update_id", next(self.update_ids))
+        self.updates.append(update)
+        self.enqueued_at[update_id] = time.monotonic()
+        self._new_updates.set()
+        return update_id
+
+    def text_update(self, user_id: int, text: str, chat_id: Optional[int] = None) -> dict[str, Any]:
+        chat_id = chat_id if chat_id is not None else user_id
+        return {
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": _chat(chat_id),
+                "from": _user(user_id),
+                "text": text,
+            }
+        }
+
+    def callback_update(self, user_id: int, chat_id: int, message_id: int, data: str) -> dict[str, Any]:
+        message = self.messages.get((chat_id, message_id)) or self._message(chat_id, message_id, "")
+        return {
+            "callback_query": {
+                "id": str(next(self.callback_ids)),
+                "from": _user(user_id),
+                "chat_instance": str(chat_id),
+                "message": message,
+                "data": data,
+            }
+        }
+
+    # ---- Bot API ----
+
+    def _message(self, chat_id: int, message_id: int, text: str, reply_markup: Any = None) -> dict[str, Any]:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "from": BOT_USER,
+            "text": text,
+        }
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    async def _get_updates(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        self.polling.set()
+
+        if not self.updates:
+            self._new_updates.clear()
+            timeout = min(float(params.get("timeout") or 0), MAX_POLL_SECONDS)
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+        batch = self.updates[: int(params.get("limit") or 100)]
+        now = time.monotonic()
+        for update in batch:
+            self.delivered_at.setdefault(update["update_id"], now)
+        return batch
+
+    def _send_message(self, params: dict[str, Any]) -> dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message = self._message(chat_id, next(self.message_ids), str(params.get("text", "")), params.get("reply_markup"))
+        self.messages[(chat_id, message["message_id"])] = message
+        return message
+
+    def _edit_message(self, params: dict[str, Any], text_changed: bool) -> Any:
+        if params.get("inline_message_id"):
+            return True
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        message = self.messages.get(key)
+        if message is None:
+            raise web.HTTPBadRequest(
+                text=json.dumps({"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}),
+                content_type="application/json",
+            )
+        text = str(params.get("text", "")) if text_changed else message["text"]
+        reply_markup = params.get("reply_markup")
+        if text == message["text"] and reply_markup == message.get("reply_markup"):
+            # 与真实 Bot API 一致：内容未变化的编辑返回 400
+            raise web.HTTPBadRequest(
+                text=json.dumps({
+                    "ok": False,
+                    "error_code": 400,
+                    "description": "Bad Request: message is not modified: specified new message content "
+                                   "and reply markup are exactly the same as a current content and reply markup of the message",
+                }),
+                content_type="application/json",
+            )
+        message = self._message(key[0], key[1], text, reply_markup)
+        self.messages[key] = message
+        return message
+
+    def _delete_messages(self, chat_id: int, message_ids: list[int]) -> bool:
+        for message_id in message_ids:
+            self.messages.pop((chat_id, int(message_id)), None)
+        return True
+
+    async def _dispatch(self, method: str, params: dict[str, Any]) -> Any:
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            return self._send_message(params)
+        if method == "editMessageText":
+            return self._edit_message(params, text_changed=True)
+        if method == "editMessageReplyMarkup":
+            return self._edit_message(params, text_changed=False)
+        if method == "deleteMessage":
+            return self._delete_messages(int(params["chat_id"]), [params["message_id"]])
+        if method == "deleteMessages":
+            return self._delete_messages(int(params["chat_id"]), list(params.get("message_ids") or []))
+        if method == "getMyCommands":
+            return []
+        # answerCallbackQuery、answerInlineQuery、setMyCommands、deleteWebhook 等只需返回 True
+        return True
+
+    def _record(self, method: str, params: dict[str, Any], status: int, result: Any = None) -> None:
+        call = {
+            "at": time.monotonic(),
+            "method": method,
+            "status": status,
+            "chat_id": params.get("chat_id"),
+            "message_id": params.get("message_id"),
+            "callback_query_id": params.get("callback_query_id"),
+            "text": params.get("text"),
+            "reply_markup": params.get("reply_markup"),
+            "result_message_id": result.get("message_id") if isinstance(result, dict) else None,
+        }
+        self.calls.append(call)
+        self.counters[f"{method}:{status}"] += 1
+        for listener in self.listeners:
+            listener(call)
+
+    async def api_handler(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {key: _parse_value(value) for key, value in (await request.post()).items() if isinstance(value, str)}
+
+        if method not in POLLING_METHODS:
+            await asyncio.sleep(self.config.latency(self.rng))
+            if self.rng.random() < self.config.rate_limit_rate:
+                self._record(method, params, 429)
+                return web.json_response(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.config.retry_after}",
+                        "parameters": {"retry_after": self.config.retry_after},
+                    },
+                    status=429,
+                )
+
+        try:
+            result = await self._dispatch(method, params)
+        except web.HTTPBadRequest as exc:
+            if method != "getUpdates":
+                self._record(method, params, 400)
+            return web.Response(status=400, text=exc.text, content_type="application/json")
+        if method != "getUpdates":
+            self._record(method, params, 200, result)
+        return web.json_response({"ok": True, "result": result})
+
+    # ---- 控制接口 ----
+
+    async def push_updates_handler(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        updates = data if isinstance(data, list) else [data]
+        return web.json_response({"ok": True, "update_ids": [self.push_update(update) for update in updates]})
+
+    async def calls_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "calls": dict(self.counters),
+                "pending_updates": len(self.updates),
+                "delivered_updates": len(self.delivered_at),
+                "messages": len(self.messages),
+            }
+        )
+
+    async def reset_handler(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        self.counters.clear()
+        return web.json_response({"ok": True})
+
+
+def create_app(config: FakeTelegramConfig) -> web.Application:
+    fake = FakeTelegram(config)
+    app = web.Application()
+    app["fake_telegram"] = fake
+    app.router.add_route("*", "/bot{token}/{method}", fake.api_handler)
+    app.router.add_post("/__updates", fake.push_updates_handler)
+    app.router.add_get("/__calls", fake.calls_handler)
+    app.router.add_get("/__stats", fake.stats_handler)
+    app.router.add_post("/__reset", fake.reset_handler)
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="本地 Telegram Bot API 替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("fixed:0"),
+                        help="Bot API 调用延迟分布（毫秒），格式同 fake_pansou.py")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 响应中的 retry_after 秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    return parser
+
+
+def config_from_args(args: argparse.Namespace) -> FakeTelegramConfig:
+    return FakeTelegramConfig(
+        latency=args.latency,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    print(f"✅ Telegram Bot API 替身已启动: http://{args.host}:{args.port}")
+    web.run_app(create_app(config_from_args(args)), host=args.host, port=args.port, print=None)
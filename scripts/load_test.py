@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""压测工具：按目标 RPS 驱动 PansouClient 或 HTTP API。
+
+默认会在子进程里拉起 scripts/fake_pansou.py 作为上游，压测结束后输出吞吐、
+p50/p95/p99 延迟、状态分布、上游实际请求次数（核对单飞与缓存）和内存占用：
+
+    # 进程内直接调用 PansouClient.search
+    python scripts/load_test.py --mode client --rps 200 --duration 10 --keywords 20
+
+    # 进程内启动 http_api 并通过真实 HTTP 请求压测
+    python scripts/load_test.py --mode api --rps 100 --upstream-args "--latency lognormal:80:0.6 --links 200"
+
+    # 压测已运行的 HTTP API（可配合 --target-pid 采样其内存）
+    python scripts/load_test.py --mode http --url http://127.0.0.1:8080 --token xxx \\
+        --upstream http://127.0.0.1:8888
+
+延迟从计划发送时刻开始计算，避免协调遗漏（coordinated omission）低估尾延迟。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shlex
+import socket
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+FAKE_PANSOU = Path(__file__).resolve().parent / "fake_pansou.py"
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """读取进程常驻内存（MB），非 Linux 平台只能读取本进程峰值。"""
+    path = Path(f"/proc/{pid or 'self'}/status")
+    try:
+        for line in path.read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return None
+
+
+def percentile_ms(sorted_values: list[float], percent: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values) + 0.5) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise SystemExit(f"等待 {url} 启动超时")
+        await asyncio.sleep(0.1)
+
+
+async def upstream_searches(session: aiohttp.ClientSession, upstream: str) -> Optional[int]:
+    """读取替身服务的搜索计数；真实 pansou 没有该接口时返回 None。"""
+    try:
+        async with session.get(f"{upstream}/__stats") as response:
+            if response.status != 200:
+                return None
+            data = await response.json()
+    except (aiohttp.ClientError, ValueError):
+        return None
+    return int(data.get("counters", {}).get("search", 0))
+
+
+class MemorySampler:
+    """压测期间每秒采样一次常驻内存。"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.samples: list[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            value = _rss_mb(self.pid)
+            if value is not None:
+                self.samples.append(value)
+            await asyncio.sleep(1.0)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict[str, Optional[float]]:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        final = _rss_mb(self.pid)
+        if final is not None:
+            self.samples.append(final)
+        if not self.samples:
+            return {"start_mb": None, "peak_mb": None, "end_mb": None}
+        return {"start_mb": self.samples[0], "peak_mb": max(self.samples), "end_mb": self.samples[-1]}
+
+
+def _keyword_picker(count: int, skew: float, seed: int) -> Callable[[], str]:
+    """按 Zipf 分布挑选关键词，skew 越大热点越集中。"""
+    rng = random.Random(seed)
+    keywords = [f"keyword-{index}" for index in range(count)]
+    weights = [1 / (index + 1) ** skew for index in range(count)]
+    return lambda: rng.choices(keywords, weights)[0]
+
+
+async def _drive(
+    send: Callable[[str], Awaitable[str]],
+    pick_keyword: Callable[[], str],
+    rps: float,
+    duration: float,
+    max_outstanding: int,
+) -> dict[str, Any]:
+    """开环发压：按固定间隔发出请求，不等待前一个请求完成。"""
+    latencies: list[float] = []
+    statuses: Counter[str] = Counter()
+    outstanding: set[asyncio.Task] = set()
+    skipped = 0
+
+    async def _one(keyword: str, scheduled: float) -> None:
+        try:
+            status = await send(keyword)
+        except Exception as exc:
+            status = type(exc).__name__
+        statuses[status] += 1
+        latencies.append(time.perf_counter() - scheduled)
+
+    total = int(rps * duration)
+    started = time.perf_counter()
+    for index in range(total):
+        scheduled = started + index / rps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(outstanding) >= max_outstanding:
+            skipped += 1
+            continue
+        task = asyncio.create_task(_one(pick_keyword(), scheduled))
+        outstanding.add(task)
+        task.add_done_callback(outstanding.discard)
+
+    if outstanding:
+        await asyncio.gather(*outstanding)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    completed = len(latencies)
+    return {
+        "planned": total,
+        "completed": completed,
+        "skipped": skipped,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(completed / elapsed, 1) if elapsed else 0.0,
+        "statuses": dict(statuses),
+        "latency_ms": {
+            "p50": percentile_ms(latencies, 50),
+            "p95": percentile_ms(latencies, 95),
+            "p99": percentile_ms(latencies, 99),
+            "max": percentile_ms(latencies, 100),
+            "mean": round(statistics.fmean(latencies) * 1000, 1) if latencies else None,
+        },
+    }
+
+
+def _prepare_in_process(upstream: str, token: str) -> None:
+    """进程内模式：指向替身上游，并放宽限流，避免压到本地配额而不是被测代码。"""
+    sys.path.insert(0, str(SRC))
+    os.environ["PANSOU_API_URL"] = upstream
+    os.environ.setdefault("TG_BOT_TOKEN", "LOAD_TEST_TOKEN_PLACEHOLDER")
+    os.environ["HTTP_API_TOKEN"] = token
+    os.environ.setdefault("HTTP_API_RATE_PER_MINUTE", "1000000")
+    os.environ.setdefault("HTTP_API_MAX_CONCURRENT", "100000")
+    os.environ.setdefault("HTTP_API_DAILY_QUOTA", "0")
+    os.environ.setdefault("GLOBAL_RATE_LIMIT_PER_MINUTE", "1000000")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    upstream_process = None
+    upstream = args.upstream
+    if upstream is None and args.mode != "http":
+        port = free_port()
+        upstream = f"http://127.0.0.1:{port}"
+        upstream_process = await asyncio.create_subprocess_exec(
+            sys.executable, str(FAKE_PANSOU), "--port", str(port), *shlex.split(args.upstream_args),
+        )
+
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.max_outstanding)
+    session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+    runner = None
+    client = None
+    try:
+        if upstream_process is not None:
+            await wait_until_up(session, f"{upstream}/healthz")
+
+        target = args.url
+        token = args.token or "load-test-token"
+        memory_pid = args.target_pid
+        if args.mode in ("client", "api"):
+            _prepare_in_process(upstream, token)
+            from logger import setup_logging
+            from pansou_client import pansou_client as client
+
+            setup_logging()
+
+            memory_pid = None
+
+        if args.mode == "api":
+            from aiohttp import web
+            from http_api import create_app
+
+            runner = web.AppRunner(create_app())
+            await runner.setup()
+            api_port = free_port()
+            await web.TCPSite(runner, host="127.0.0.1", port=api_port).start()
+            target = f"http://127.0.0.1:{api_port}"
+
+        if args.mode == "client":
+            async def send(keyword: str) -> str:
+                result = await client.search(keyword)
+                return "error" if "error" in result else "ok"
+        else:
+            if not target:
+                raise SystemExit("--mode http 需要指定 --url")
+            headers = {"Authorization": f"Bearer {token}"}
+            search_url = f"{target.rstrip('/')}/api/pansou/search"
+
+            async def send(keyword: str) -> str:
+                async with session.get(search_url, params={"keyword": keyword}, headers=headers) as response:
+                    await response.read()
+                    return str(response.status)
+
+        before = await upstream_searches(session, upstream) if upstream else None
+        sampler = MemorySampler(memory_pid)
+        sampler.start()
+        report = await _drive(
+            send,
+            _keyword_picker(args.keywords, args.skew, args.seed),
+            args.rps,
+            args.duration,
+            args.max_outstanding,
+        )
+        memory = await sampler.stop()
+        after = await upstream_searches(session, upstream) if upstream else None
+
+        upstream_calls = after - before if before is not None and after is not None else None
+        report.update(
+            {
+                "mode": args.mode,
+                "target_rps": args.rps,
+                "keywords": args.keywords,
+                "upstream_calls": upstream_calls,
+                "upstream_calls_per_request": (
+                    round(upstream_calls / report["completed"], 3)
+                    if upstream_calls is not None and report["completed"]
+                    else None
+                ),
+                "memory": {"pid": memory_pid or os.getpid(), **memory},
+            }
+        )
+        return report
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        elif client is not None:
+            await client.close()
+        await session.close()
+        if upstream_process is not None:
+            upstream_process.terminate()
+            await upstream_process.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="PansouClient / HTTP API 压测")
+    parser.add_argument("--mode", choices=("client", "api", "http"), default="client",
+                        help="client: 进程内调用 PansouClient；api: 进程内启动 http_api；http: 压测外部 HTTP API")
+    parser.add_argument("--rps", type=float, default=50, help="目标每秒请求数")
+    parser.add_argument("--duration", type=float, default=10, help="压测秒数")
+    parser.add_argument("--keywords", type=int, default=20, help="不同关键词数量")
+    parser.add_argument("--skew", type=float, default=1.0, help="关键词 Zipf 分布参数，0 为均匀分布")
+    parser.add_argument("--max-outstanding", type=int, default=1000, help="同时在途请求上限，超出的请求计为 skipped")
+    parser.add_argument("--timeout", type=float, default=30, help="单个 HTTP 请求超时秒数")
+    parser.add_argument("--url", help="http 模式下的 HTTP API 地址")
+    parser.add_argument("--token", help="HTTP API 令牌")
+    parser.add_argument("--target-pid", type=int, help="http 模式下采样内存的目标进程 PID")
+    parser.add_argument("--upstream", help="已运行的上游地址；不指定时自动拉起 fake_pansou.py")
+    parser.add_argument("--upstream-args", default="", help="传给 fake_pansou.py 的参数")
+    parser.add_argument("--seed", type=int, default=0, help="关键词随机种子")
+    parser.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
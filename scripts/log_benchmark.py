@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""日志开销基准：对比旧的同步日志配置与队列 + 后台线程输出下，每个 HTTP API 搜索请求的日志耗时。
+
+每个"请求"按线上 INFO 级别实际写出的日志模拟：http_api_search、
+http_api_search_completed（带分阶段计时字段）、aiohttp 访问日志和一条被级别过滤掉的
+search_cache_hit 调试日志。
+caller_us 是每个请求在调用方（事件循环）线程上的耗时（测量时暂停后台线程，排除其争抢 GIL 的影响）；
+saturated_us 是连续写入一批请求并等后台线程写完的平均耗时，即打满时每个请求的总日志成本。
+输出写到 /dev/null，不计终端开销：
+
+    python scripts/log_benchmark.py
+    python scripts/log_benchmark.py --format console --output log_bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+os.environ.setdefault("TG_BOT_TOKEN", "BENCHMARK_TOKEN_PLACEHOLDER")
+os.environ.setdefault("HTTP_API_TOKEN", "benchmark-token")
+
+import structlog  # noqa: E402
+
+from config import settings  # noqa: E402
+from logger import _renderer, log_queue_size, setup_logging, stop_logging  # noqa: E402
+from timing import StageTimer  # noqa: E402
+
+STAGES = ("parse", "response_cache", "rate_limit", "cache_lookup", "upstream_http", "json_decode",
+          "normalize", "filter", "build_payload", "serialize")
+
+
+def _request_logs(log: Any, access_log: logging.Logger, timer: StageTimer) -> None:
+    log.debug("search_cache_hit", keyword="流浪地球")
+    log.info(
+        "http_api_search",
+        keyword="流浪地球",
+        limit=10,
+        channels=[],
+        plugins=[],
+        cloud_types=["baidu", "quark"],
+        source_type="all",
+        remote="127.0.0.1",
+        request_id=timer.request_id,
+    )
+    log.info("http_api_search_completed", keyword="流浪地球", **timer.log_fields())
+    access_log.info('%s [%s] "%s" %s %s', "127.0.0.1", "18/Oct/2026:12:00:00 +0000",
+                    "GET /api/pansou/search?kw=... HTTP/1.1", 200, 5231)
+
+
+def _wait_drained(timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while log_queue_size() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def setup_legacy_logging(stream: Any, log_format: str) -> None:
+    """改造前的配置：标准库 logger + 调用方线程内渲染并同步写出。"""
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    structlog.reset_defaults()
+    structlog.configure(
+        processors=[
+            structlog.stdlib.filter_by_level,
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            _renderer(log_format),
+        ],
+        context_class=dict,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.stdlib.BoundLogger,
+        cache_logger_on_first_use=True,
+    )
+
+
+def measure_config(name: str, sample_rates: Optional[dict[str, float]], args: argparse.Namespace,
+                   stream: Any) -> dict[str, Any]:
+    """sample_rates 为 None 时测旧配置。"""
+    queued = sample_rates is not None
+
+    def configure() -> None:
+        if queued:
+            setup_logging(stream=stream, level="INFO", log_format=args.format, sample_rates=sample_rates)
+        else:
+            stop_logging()
+            setup_legacy_logging(stream, args.format)
+
+    configure()
+    # cache_logger_on_first_use：每种配置使用新的 logger，避免沿用上一种配置的处理链
+    log = structlog.get_logger("bench")
+    access_log = logging.getLogger("aiohttp.access")
+    timer = StageTimer("bench")
+    for stage_name in STAGES:
+        timer.stages[stage_name] = 0.0012
+
+    caller = []
+    for _ in range(args.repeat):
+        if queued:
+            stop_logging()
+        started = time.perf_counter()
+        for _ in range(args.batch):
+            _request_logs(log, access_log, timer)
+        caller.append((time.perf_counter() - started) / args.batch * 1_000_000)
+        if queued:
+            configure()
+            _wait_drained()
+
+    saturated = []
+    for _ in range(args.repeat):
+        _wait_drained()
+        started = time.perf_counter()
+        for _ in range(args.batch):
+            _request_logs(log, access_log, timer)
+        _wait_drained()
+        saturated.append((time.perf_counter() - started) / args.batch * 1_000_000)
+
+    result = {
+        "config": name,
+        "caller_us": round(min(caller), 2),
+        "caller_median_us": round(statistics.median(caller), 2),
+        "saturated_us": round(min(saturated), 2),
+    }
+    print(
+        f"{name:<16} caller {result['caller_us']:>8.2f} us   saturated {result['saturated_us']:>8.2f} us",
+        file=sys.stderr,
+    )
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="日志开销基准")
+    parser.add_argument("--format", choices=("json", "console"), default="json", help="日志渲染格式")
+    parser.add_argument("--batch", type=int, default=2000, help="每轮请求数（需小于队列容量的 1/4）")
+    parser.add_argument("--repeat", type=int, default=5, help="重复轮数")
+    parser.add_argument("--output", help="结果 JSON 输出路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    configs = [
+        ("legacy_sync", None),
+        ("queue", {}),
+        ("queue_sampled", settings.log_sample_rates),
+    ]
+    with open(os.devnull, "w", encoding="utf-8") as stream:
+        results = [measure_config(name, rates, args, stream) for name, rates in configs]
+        stop_logging()
+
+    report = {
+        "meta": {"format": args.format, "batch": args.batch, "repeat": args.repeat, "sample_rates": settings.log_sample_rates},
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,8 +21,17 @@ os.environ.setdefault("REQUIRE_HTTP_API_TOKEN", "true")
 
 MODULES = [
     "config",
+    "metrics",
+    "logger",
+    "timing",
+    "profiler",
+    "loop_watchdog",
+    "rate_limit",
+    "shared_cache",
+    "telegram_governor",
     "pansou_client",
     "user_settings",
+    "health",
     "http_api",
     "bot",
 ]
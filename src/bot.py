@@ -10,24 +10,57 @@ import sys
 import time
 from pathlib import Path
 from typing import Any, Optional
-from collections import OrderedDict, deque
-
-from telegram import BotCommand, Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from collections import OrderedDict
+
+from telegram import (
+    BotCommand,
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    LinkPreviewOptions,
+    Message,
+)
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters,
 )
 from structlog import get_logger
 
 from config import settings
+from http_api import response_cache
+from metrics import (
+    EVENT_LOOP_LAG,
+    INFLIGHT_JOINS,
+    RESULT_CACHE,
+    SEARCH_REQUESTS,
+    UPSTREAM_ERRORS,
+    UPSTREAM_LATENCY,
+    RollingCounter,
+    process_rss_bytes,
+    registry,
+    start_metrics_server,
+)
+from logger import setup_logging
+from loop_watchdog import monitor_event_loop_lag
 from pansou_client import pansou_client, CLOUD_TYPE_NAMES, CLOUD_TYPE_ICONS
-from user_settings import settings_manager, CLOUD_TYPE_NAMES as SETTINGS_CLOUD_NAMES
+from profiler import (
+    MAX_PROFILE_SECONDS,
+    is_running as profiler_running,
+    parse_profile_seconds,
+    profile_event_loop,
+)
+from rate_limit import search_rate_limiter
+from timing import StageTimer
+from user_settings import UserSettings, settings_manager, CLOUD_TYPE_NAMES as SETTINGS_CLOUD_NAMES
 
 logger = get_logger()
 
@@ -42,21 +75,32 @@ MAX_LIST_MESSAGE_LENGTH = 3300
 class LRUCache:
     """带 TTL 的 LRU 缓存"""
     
-    def __init__(self, max_size: int = 100, ttl: int = 300):
+    def __init__(self, max_size: int = 100, ttl: int = 300, track_recent: bool = False):
         self.max_size = max_size
         self.ttl = ttl
         self._cache: OrderedDict = OrderedDict()
         self._timestamps: dict = {}
+        self.stats = {"hit": 0, "miss": 0, "eviction": 0}
+        # 最近命中 / 未命中次数（/stats 滚动窗口用）
+        self.recent = {"hit": RollingCounter(), "miss": RollingCounter()} if track_recent else None
     
     def get(self, key: str):
         """获取缓存值"""
         if key not in self._cache:
+            self._count("miss")
             return None
         if time.monotonic() - self._timestamps.get(key, 0) > self.ttl:
             self._remove(key)
+            self._count("miss")
             return None
         self._cache.move_to_end(key)
+        self._count("hit")
         return self._cache[key]
+
+    def _count(self, event: str):
+        self.stats[event] += 1
+        if self.recent is not None:
+            self.recent[event].inc()
     
     def set(self, key: str, value):
         """设置缓存值"""
@@ -65,6 +109,7 @@ class LRUCache:
         elif len(self._cache) >= self.max_size:
             oldest_key, _ = self._cache.popitem(last=False)
             self._timestamps.pop(oldest_key, None)
+            self.stats["eviction"] += 1
         self._cache[key] = value
         self._timestamps[key] = time.monotonic()
     
@@ -80,6 +125,11 @@ class LRUCache:
         for k in expired:
             self._remove(k)
 
+    def remove(self, key: str, value=None):
+        """移除缓存项；给出 value 时只有当前值就是它才移除。"""
+        if value is None or self._cache.get(key) is value:
+            self._remove(key)
+
     def clear(self) -> int:
         """清空缓存并返回条目数。"""
         count = len(self._cache)
@@ -87,50 +137,16 @@ class LRUCache:
         self._timestamps.clear()
         return count
 
+    def __len__(self) -> int:
+        """当前条目数（含尚未清理的过期条目）。"""
+        return len(self._cache)
 
-class SearchRateLimiter:
-    """按用户做滑动窗口限流，保护上游搜索服务。"""
-
-    def __init__(self, limit: int, window_seconds: int = 60, max_users: int = 2048):
-        self.limit = limit
-        self.window_seconds = window_seconds
-        self.max_users = max_users
-        self._records: OrderedDict[int, deque[float]] = OrderedDict()
-
-    def check(self, user_id: int) -> tuple[bool, int]:
-        """检查用户是否超过搜索频率限制。"""
-        now = time.monotonic()
-        records = self._records.get(user_id)
-        if records is None:
-            records = deque()
-            self._records[user_id] = records
-        else:
-            self._records.move_to_end(user_id)
-
-        cutoff = now - self.window_seconds
-        while records and records[0] <= cutoff:
-            records.popleft()
-
-        if len(records) >= self.limit:
-            retry_after = max(1, int(self.window_seconds - (now - records[0])) + 1)
-            return False, retry_after
 
-        records.append(now)
-
-        while len(self._records) > self.max_users:
-            self._records.popitem(last=False)
-
-        return True, 0
-
-    def clear(self) -> int:
-        """清空限流记录。"""
-        count = len(self._records)
-        self._records.clear()
-        return count
-
-
-search_cache = LRUCache(max_size=50, ttl=300)
-search_rate_limiter = SearchRateLimiter(limit=settings.rate_limit_per_minute)
+search_cache = LRUCache(max_size=50, ttl=300, track_recent=True)
+# 群组相同搜索合并：合并键 -> 首个搜索的 Future，成功展示后结果为 {"message_id", "cache_key"}，否则为 None
+coalesced_searches = LRUCache(max_size=256, ttl=settings.search_coalesce_seconds)
+# 结果消息缓存键 -> 被合并进来、允许操作该消息按钮的用户
+search_operators = LRUCache(max_size=512, ttl=search_cache.ttl)
 
 # Bot 应用实例（在 main() 中设置）
 bot_application = None
@@ -138,6 +154,10 @@ bot_application = None
 # 自动删除时间（秒）
 AUTO_DELETE_DELAY = 180  # 3分钟
 
+# 内联模式：每页结果数，以及每个用户当前等待防抖/上游的查询任务
+INLINE_PAGE_SIZE = 20
+_inline_tasks: dict[int, asyncio.Task] = {}
+
 # 后台任务队列 - 使用字典优化查找速度
 _deletion_tasks = {}
 _cleanup_task = None
@@ -155,8 +175,13 @@ BOT_COMMANDS = [
     BotCommand("reset", "重置搜索设置"),
     BotCommand("status", "检查服务状态"),
     BotCommand("refresh", "刷新运行时缓存"),
+    BotCommand("stats", "查看运行统计"),
+    BotCommand("profile", "采样分析事件循环"),
 ]
 
+# /stats 展示的滚动窗口（秒）
+STATS_WINDOWS = (60, 900, 3600)
+
 async def _cleanup_worker():
     """后台清理工作器，批量处理消息删除"""
     global _cleanup_task
@@ -184,6 +209,35 @@ async def _cleanup_worker():
         _cleanup_task = None
 
 
+def _register_bot_metrics() -> None:
+    """把 Bot 进程内已有的统计挂到指标注册表上，采集时再读取。"""
+    registry.register_callback(
+        "bot_search_cache_total",
+        "Bot 搜索结果缓存事件",
+        lambda: dict(search_cache.stats),
+        ("event",),
+        type_name="counter",
+    )
+    registry.register_callback("bot_search_cache_size", "Bot 搜索结果缓存条目数", lambda: len(search_cache))
+    registry.register_callback("bot_deletion_queue_depth", "等待自动删除的消息数", lambda: len(_deletion_tasks))
+
+    def _governor_stats() -> dict:
+        request = bot_application.bot.request if bot_application else None
+        return request.get_stats() if hasattr(request, "get_stats") else {}
+
+    registry.register_callback(
+        "telegram_governor_queue_depth",
+        "Telegram 出站调用排队数",
+        lambda: _governor_stats().get("queue_depth", 0),
+    )
+    registry.register_callback(
+        "telegram_retry_after_total",
+        "Telegram 返回 429 的次数",
+        lambda: _governor_stats().get("retry_after", 0),
+        type_name="counter",
+    )
+
+
 def _ensure_cleanup_worker():
     """确保清理工作器在运行"""
     global _cleanup_task
@@ -227,9 +281,10 @@ def add_auto_delete_notice(text: str, parse_mode: Optional[str] = None) -> str:
         return f"{text}\n\n⏰ 此消息将在 3 分钟后自动删除"
 
 
-def check_search_rate_limit(user_id: int) -> tuple[bool, int]:
-    """检查用户搜索频率。"""
-    return search_rate_limiter.check(user_id)
+def check_search_rate_limit(user_id: int, chat_id: Optional[int] = None, inline: bool = False) -> tuple[bool, int]:
+    """检查用户、群组和全局搜索频率；私聊只按用户计数，内联查询使用独立的用户级预算。"""
+    chat_key = chat_id if chat_id is not None and chat_id < 0 else None
+    return search_rate_limiter.check(user_id, chat_key, inline=inline)
 
 
 def _build_search_cache_key(chat_id: int, user_id: int, message_id: int) -> str:
@@ -237,6 +292,63 @@ def _build_search_cache_key(chat_id: int, user_id: int, message_id: int) -> str:
     return f"{chat_id}:{user_id}:{message_id}"
 
 
+def _resolve_search_options(
+    user_settings: UserSettings,
+    limit: Optional[int] = None,
+    cloud_types: Optional[list] = None,
+    source_type: Optional[str] = None,
+    plugins: Optional[list] = None,
+    channels: Optional[list] = None,
+) -> dict[str, Any]:
+    """合并命令参数与用户设置，返回实际传给 pansou_client.search 的参数。"""
+    if limit is None:
+        limit = user_settings.result_limit
+    return {
+        "limit": max(1, min(limit, settings.max_result_limit)),
+        "cloud_types": cloud_types if cloud_types is not None else user_settings.cloud_types,
+        "source_type": source_type if source_type is not None else user_settings.source_type,
+        "plugins": plugins if plugins is not None else (user_settings.plugins or None),
+        "channels": channels if channels is not None else (user_settings.channels or None),
+        "filter_config": user_settings.get_filter_config(),
+    }
+
+
+def _build_coalesce_key(chat_id: int, keyword: str, options: dict[str, Any]) -> tuple[int, str]:
+    """为群组内相同关键词和实际搜索参数（含用户设置）的搜索生成合并键，参数归一化与结果缓存键一致。"""
+    return chat_id, pansou_client.search_cache_key(keyword, **options)
+
+
+def _cache_owner_id(cache_key: str) -> Optional[int]:
+    """从结果缓存键中解析发起搜索的用户ID。"""
+    try:
+        return int(cache_key.split(":")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+async def _join_coalesced_search(update: Update, existing: dict[str, Any], keyword: str) -> None:
+    """把重复搜索指向已有结果消息，并授权该用户操作结果按钮。"""
+    cache_key = existing["cache_key"]
+    operators = search_operators.get(cache_key) or set()
+    operators.add(update.effective_user.id)
+    search_operators.set(cache_key, operators)
+
+    await reply_with_auto_delete(
+        update,
+        f"👆 「{html.escape(keyword)}」刚刚已有人搜索，结果见上方消息，你也可以直接点击其中的按钮",
+        parse_mode=ParseMode.HTML,
+        reply_to_message_id=existing["message_id"],
+        allow_sending_without_reply=True,
+    )
+    logger.info(
+        "search_coalesced",
+        keyword=keyword,
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id,
+        message_id=existing["message_id"],
+    )
+
+
 def _truncate_output(text: str, limit: int = MAX_COMMAND_OUTPUT) -> str:
     """截断命令输出，避免消息过长。"""
     cleaned = text.strip()
@@ -329,6 +441,8 @@ async def _run_git_command(
 async def _restart_process(delay_seconds: float = 1.0) -> None:
     """延迟重启当前进程，让 Telegram 消息先发出去。"""
     await asyncio.sleep(delay_seconds)
+    # execv 不会执行正常退出流程，先写完尚未落盘的用户设置
+    await settings_manager.aflush()
     os.chdir(str(REPO_ROOT))
     os.execv(sys.executable, [sys.executable, str(ENTRYPOINT)])
 
@@ -516,6 +630,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 /reset - 重置搜索设置
 /status - 检查服务状态
 /refresh - 刷新运行时状态
+/stats - 查看运行统计
+/profile - 采样分析事件循环
 /update - 拉取最新代码并重启
 /help - 查看详细帮助
 
@@ -581,6 +697,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 • <code>/channels</code> - 查看启用频道
 • <code>/reset</code> - 重置搜索设置
 • <code>/refresh</code> - 刷新缓存和连接状态
+• <code>/stats</code> - 查看最近 1 分钟 / 15 分钟 / 1 小时运行统计
+• <code>/profile [秒数]</code> - 采样分析事件循环，返回热点函数和火焰图数据
 • <code>/update</code> - 拉取最新代码并重启
 
 <b>📁 支持的网盘</b>
@@ -867,6 +985,8 @@ async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     
     action = args[0].lower()
+    if action in ("clear", "add", "remove"):
+        user_settings = settings_manager.get_settings_for_update(user_id)
     
     if action == "clear":
         user_settings.filter_include = []
@@ -971,16 +1091,19 @@ async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     cleared_search_cache = search_cache.clear()
     cleared_rate_limiters = search_rate_limiter.clear()
+    settings_stats = settings_manager.get_stats()
     cleared_settings_cache = settings_manager.clear_cache()
     pansou_client.clear_runtime_cache()
+    # 与 HTTP API 同进程运行时，已渲染的响应和 ETag 也要随结果缓存一起失效
+    cleared_responses = response_cache.clear()
     is_healthy = await pansou_client.health_check(force_refresh=True)
 
     status_icon = "✅" if is_healthy else "⚠️"
     status_text = f"""{status_icon} <b>运行时状态已更新</b>
 
 🧹 搜索缓存已清理: {cleared_search_cache} 条
-🚦 限流记录已清理: {cleared_rate_limiters} 个用户
-⚙️ 设置缓存已清理: {cleared_settings_cache} 个用户
+🚦 限流记录已清理: {cleared_rate_limiters} 个用户/群组
+⚙️ 设置缓存已清理: {cleared_settings_cache} 个用户（命中率 {settings_stats["hit_ratio"]:.0%}）
 🔍 Pansou API: {"正常" if is_healthy else "无法连接"}"""
 
     status_text = add_auto_delete_notice(status_text, ParseMode.HTML)
@@ -991,11 +1114,117 @@ async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         cleared_search_cache=cleared_search_cache,
         cleared_rate_limiters=cleared_rate_limiters,
         cleared_settings_cache=cleared_settings_cache,
+        cleared_responses=cleared_responses,
         pansou_healthy=is_healthy,
         user_id=update.effective_user.id,
     )
 
 
+def _format_ratio(numerator: float, denominator: float) -> str:
+    return f"{numerator / denominator:.0%}" if denominator else "-"
+
+
+def _format_ms(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+
+
+def _build_stats_text() -> str:
+    """按 STATS_WINDOWS 汇总滚动窗口指标，每行依次为 1 分钟 / 15 分钟 / 1 小时。"""
+    rows: dict[str, list[str]] = {
+        "searches": [], "result_cache": [], "search_cache": [], "joins": [],
+        "p50": [], "p95": [], "errors": [], "rejections": [], "loop_lag": [],
+    }
+    upstream = UPSTREAM_LATENCY.window
+    loop_lag = EVENT_LOOP_LAG.window
+    for window in STATS_WINDOWS:
+        rows["searches"].append(f"{SEARCH_REQUESTS.window_total(window) / (window / 60):.2f}")
+
+        hits = RESULT_CACHE.window_sum(window, "hit")
+        lookups = hits + RESULT_CACHE.window_sum(window, "miss") + RESULT_CACHE.window_sum(window, "expired")
+        rows["result_cache"].append(_format_ratio(hits, lookups))
+
+        bot_hits = search_cache.recent["hit"].sum(window)
+        rows["search_cache"].append(_format_ratio(bot_hits, bot_hits + search_cache.recent["miss"].sum(window)))
+
+        rows["joins"].append(f"{INFLIGHT_JOINS.window_total(window):.0f}")
+        rows["p50"].append(_format_ms(upstream.quantile(0.5, window)))
+        rows["p95"].append(_format_ms(upstream.quantile(0.95, window)))
+        # 非 HTTP 类异常不计入耗时直方图，错误率封顶 100%
+        upstream_calls = upstream.count(window)
+        errors = UPSTREAM_ERRORS.window_total(window)
+        rows["errors"].append(_format_ratio(min(errors, upstream_calls), upstream_calls) if upstream_calls else "-")
+        rows["rejections"].append(f"{search_rate_limiter.recent_rejections.sum(window):.0f}")
+        rows["loop_lag"].append(_format_ms(loop_lag.quantile(0.95, window)))
+
+    def line(key: str) -> str:
+        return " / ".join(rows[key])
+
+    settings_stats = settings_manager.get_stats()
+    rss = process_rss_bytes()
+    return f"""📈 <b>运行统计</b>（1分钟 / 15分钟 / 1小时）
+
+🔍 搜索: {line("searches")} 次/分钟
+💾 结果缓存命中率: {line("result_cache")}
+🗂 Bot 搜索缓存命中率: {line("search_cache")}
+🔗 合并进行中请求: {line("joins")} 次
+⏱ 上游 p50: {line("p50")}
+⏱ 上游 p95: {line("p95")}
+❌ 上游错误率: {line("errors")}
+🚦 限流拒绝: {line("rejections")} 次
+🐢 事件循环延迟 p95: {line("loop_lag")}
+
+<b>当前</b>
+🔄 进行中上游搜索: {pansou_client.inflight_count}
+🗑 待删除消息: {len(_deletion_tasks)}
+⚙️ 设置缓存: {settings_stats["cache_entries"]}/{settings_stats["cache_capacity"]} 个用户
+🧠 内存 RSS: {f"{rss / 1024 / 1024:.1f} MB" if rss is not None else "未知"}"""
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """处理 /stats 命令 - 查看滚动窗口运行统计"""
+    if not check_admin_permission(update):
+        await reply_with_auto_delete(update, "⛔️ 该命令仅限管理员使用")
+        return
+
+    await reply_with_auto_delete(update, _build_stats_text(), parse_mode=ParseMode.HTML)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """处理 /profile 命令 - 对事件循环采样分析，返回热点函数和 collapsed stack 文件"""
+    if not check_admin_permission(update):
+        await reply_with_auto_delete(update, "⛔️ 该命令仅限管理员使用")
+        return
+
+    seconds = parse_profile_seconds(context.args[0] if context.args else None)
+    if seconds is None:
+        await reply_with_auto_delete(update, f"❌ 采样时长需为 1~{MAX_PROFILE_SECONDS} 秒\n\n用法: /profile [秒数]")
+        return
+    if profiler_running():
+        await reply_with_auto_delete(update, "⏳ 已有采样在进行中，请稍后再试")
+        return
+
+    message = await update.message.reply_text(f"🔬 正在采样事件循环 {seconds:g} 秒...")
+    auto_delete_message(message)
+    try:
+        result = await profile_event_loop(seconds)
+    except RuntimeError:
+        await message.edit_text("⏳ 已有采样在进行中，请稍后再试")
+        return
+
+    status_text = f"🔬 <b>事件循环采样结果</b>\n\n<pre>{html.escape(result.format_text())}</pre>"
+    if len(status_text) > 3800:
+        status_text = f"🔬 <b>事件循环采样结果</b>\n\n<pre>{html.escape(result.format_text(limit=8))}</pre>"
+    await message.edit_text(add_auto_delete_notice(status_text, ParseMode.HTML), parse_mode=ParseMode.HTML)
+
+    if result.stacks:
+        await update.message.reply_document(
+            document=result.collapsed().encode("utf-8"),
+            filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed.txt",
+            caption="collapsed stack，可用 flamegraph.pl 或 speedscope 生成火焰图",
+        )
+    logger.info("profile_command_completed", user_id=update.effective_user.id, samples=result.samples)
+
+
 async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理 /update 命令 - 拉取最新代码并重启"""
     if not check_admin_permission(update):
@@ -1301,47 +1530,48 @@ async def _run_search_flow(
     plugins: Optional[list] = None,
     channels: Optional[list] = None,
     force_refresh: bool = False,
+    timer: Optional[StageTimer] = None,
+    coalesce_future: Optional[asyncio.Future] = None,
 ) -> None:
-    """统一处理普通搜索与回调触发的重新搜索。"""
-    user_settings = settings_manager.get_settings(user_id)
-
-    if limit is None:
-        limit = user_settings.result_limit
-    limit = max(1, min(limit, settings.max_result_limit))
-
-    if cloud_types is None:
-        cloud_types = user_settings.cloud_types
-
-    if source_type is None:
-        source_type = user_settings.source_type
-
-    filter_config = user_settings.get_filter_config()
+    """统一处理普通搜索与回调触发的重新搜索；结果成功展示后把结果消息交给 coalesce_future 的等待者。"""
+    timer = timer or StageTimer("bot")
+    with timer.stage("settings_load"):
+        search_options = _resolve_search_options(
+            settings_manager.get_settings(user_id),
+            limit=limit,
+            cloud_types=cloud_types,
+            source_type=source_type,
+            plugins=plugins,
+            channels=channels,
+        )
+    limit = search_options["limit"]
+    cloud_types = search_options["cloud_types"]
+    source_type = search_options["source_type"]
     safe_keyword = html.escape(keyword)
 
-    await _safe_edit_message(
-        edit_message,
-        f"🔍 正在搜索：<b>{safe_keyword}</b>...",
-        parse_mode=ParseMode.HTML,
-    )
+    with timer.stage("searching_edit"):
+        await _safe_edit_message(
+            edit_message,
+            f"🔍 正在搜索：<b>{safe_keyword}</b>...",
+            parse_mode=ParseMode.HTML,
+        )
     schedule_message_deletion(chat_id, message_id)
 
     try:
-        results = await pansou_client.search(
-            keyword=keyword,
-            channels=channels if channels is not None else (user_settings.channels if user_settings.channels else None),
-            plugins=plugins if plugins is not None else (user_settings.plugins if user_settings.plugins else None),
-            cloud_types=cloud_types,
-            source_type=source_type,
-            filter_config=filter_config,
-            limit=limit,
-            force_refresh=force_refresh,
-        )
+        with timer.active(), timer.stage("search"):
+            results = await pansou_client.search(
+                keyword=keyword,
+                force_refresh=force_refresh,
+                **search_options,
+            )
 
         if "error" in results:
             safe_error = html.escape(str(results["error"]))
             error_text = add_auto_delete_notice(f"❌ {safe_error}", ParseMode.HTML)
-            await _safe_edit_message(edit_message, error_text, parse_mode=ParseMode.HTML)
+            with timer.stage("result_edit"):
+                await _safe_edit_message(edit_message, error_text, parse_mode=ParseMode.HTML)
             schedule_message_deletion(chat_id, message_id)
+            logger.warning("search_upstream_error", keyword=keyword, error=results["error"], **timer.log_fields())
             return
 
         merged_by_type = results.get("merged_by_type", {})
@@ -1349,8 +1579,10 @@ async def _run_search_flow(
 
         if not merged_by_type or total == 0:
             empty_text = add_auto_delete_notice(f"🔍 未找到与「{safe_keyword}」相关的资源", ParseMode.HTML)
-            await _safe_edit_message(edit_message, empty_text, parse_mode=ParseMode.HTML)
+            with timer.stage("result_edit"):
+                await _safe_edit_message(edit_message, empty_text, parse_mode=ParseMode.HTML)
             schedule_message_deletion(chat_id, message_id)
+            logger.info("search_completed", keyword=keyword, user_id=user_id, total=0, **timer.log_fields())
             return
 
         cache_key = _build_search_cache_key(chat_id, user_id, message_id)
@@ -1367,18 +1599,22 @@ async def _run_search_flow(
             },
         })
 
-        overview_text = pansou_client.format_overview(results, keyword)
-        overview_text = add_auto_delete_notice(overview_text, ParseMode.HTML)
-        type_buttons = pansou_client.get_type_buttons(results)
-        keyboard = create_type_keyboard(type_buttons, cache_key)
-
-        await _safe_edit_message(
-            edit_message,
-            overview_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.HTML,
-        )
+        with timer.stage("format"):
+            overview_text = pansou_client.format_overview(results, keyword)
+            overview_text = add_auto_delete_notice(overview_text, ParseMode.HTML)
+            type_buttons = pansou_client.get_type_buttons(results)
+            keyboard = create_type_keyboard(type_buttons, cache_key)
+
+        with timer.stage("result_edit"):
+            await _safe_edit_message(
+                edit_message,
+                overview_text,
+                reply_markup=keyboard,
+                parse_mode=ParseMode.HTML,
+            )
         schedule_message_deletion(chat_id, message_id)
+        if coalesce_future is not None:
+            coalesce_future.set_result({"message_id": message_id, "cache_key": cache_key})
 
         logger.info(
             "search_completed",
@@ -1386,9 +1622,10 @@ async def _run_search_flow(
             user_id=user_id,
             total=total,
             types=list(merged_by_type.keys()),
+            **timer.log_fields(),
         )
     except Exception as e:
-        logger.error("search_error", error=str(e), keyword=keyword)
+        logger.error("search_error", error=str(e), keyword=keyword, request_id=timer.request_id)
         safe_error = html.escape(str(e))
         error_text = add_auto_delete_notice(
             f"❌ 搜索出错：{safe_error}\n\n请稍后重试或使用 /status 检查服务状态",
@@ -1412,32 +1649,78 @@ async def perform_search(
     """执行搜索并显示分类按钮"""
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    allowed, retry_after = check_search_rate_limit(user_id)
+
+    # 合并进已有结果的搜索同样计入限流，避免借合并绕过频率限制
+    timer = StageTimer("bot")
+    with timer.stage("rate_limit"):
+        allowed, retry_after = check_search_rate_limit(user_id, chat_id)
     if not allowed:
         await reply_with_auto_delete(update, f"⏳ 搜索太频繁了，请在 {retry_after} 秒后再试")
         return
 
-    search_message = await update.message.reply_text(
-        f"🔍 正在搜索：<b>{html.escape(keyword)}</b>...",
-        parse_mode=ParseMode.HTML,
-    )
+    coalesce_key = None
+    coalesce_future = None
+    if not force_refresh and settings.is_coalesce_chat(chat_id):
+        coalesce_key = _build_coalesce_key(
+            chat_id,
+            keyword,
+            _resolve_search_options(
+                settings_manager.get_settings(user_id),
+                limit=limit,
+                cloud_types=cloud_types,
+                source_type=source_type,
+                plugins=plugins,
+                channels=channels,
+            ),
+        )
+        pending = coalesced_searches.get(coalesce_key)
+        if pending is not None:
+            # 首个搜索仍在进行时等待它完成；shield：等待者被取消不影响首个搜索
+            with timer.stage("coalesce_wait"):
+                existing = await asyncio.shield(pending)
+            if existing:
+                await _join_coalesced_search(update, existing, keyword)
+                return
+            # 首个搜索出错或没有结果时按普通搜索处理
+        else:
+            # 在发送占位消息前登记，之后到达的相同搜索等待本次结果，不再各自发送占位消息
+            coalesce_future = asyncio.get_running_loop().create_future()
+            coalesced_searches.set(coalesce_key, coalesce_future)
 
-    async def _edit_message(text: str, **kwargs):
-        return await search_message.edit_text(text, **kwargs)
+    try:
+        with timer.stage("placeholder_send"):
+            search_message = await update.message.reply_text(
+                f"🔍 正在搜索：<b>{html.escape(keyword)}</b>...",
+                parse_mode=ParseMode.HTML,
+            )
 
-    await _run_search_flow(
-        keyword=keyword,
-        user_id=user_id,
-        chat_id=chat_id,
-        edit_message=_edit_message,
-        message_id=search_message.message_id,
-        limit=limit,
-        cloud_types=cloud_types,
-        source_type=source_type,
-        plugins=plugins,
-        channels=channels,
-        force_refresh=force_refresh,
-    )
+        async def _edit_message(text: str, **kwargs):
+            return await search_message.edit_text(text, **kwargs)
+
+        await _run_search_flow(
+            keyword=keyword,
+            user_id=user_id,
+            chat_id=chat_id,
+            edit_message=_edit_message,
+            message_id=search_message.message_id,
+            limit=limit,
+            cloud_types=cloud_types,
+            source_type=source_type,
+            plugins=plugins,
+            channels=channels,
+            force_refresh=force_refresh,
+            timer=timer,
+            coalesce_future=coalesce_future,
+        )
+    finally:
+        if coalesce_future is not None:
+            if not coalesce_future.done():
+                coalesce_future.set_result(None)
+            if coalesce_future.result() is None:
+                coalesced_searches.remove(coalesce_key, coalesce_future)
+            else:
+                # 合并窗口从结果展示后开始计算
+                coalesced_searches.set(coalesce_key, coalesce_future)
 
 
 async def perform_search_from_callback(
@@ -1536,11 +1819,12 @@ def _is_cache_owner(
             cached_chat_id, cached_user_id, cached_message_id = parts
             if message_id is None:
                 return False
-            return (
-                int(cached_chat_id) == chat_id
-                and int(cached_user_id) == user_id
-                and int(cached_message_id) == message_id
-            )
+            if int(cached_chat_id) != chat_id or int(cached_message_id) != message_id:
+                return False
+            if int(cached_user_id) == user_id:
+                return True
+            operators = search_operators.get(cache_key)
+            return bool(operators) and user_id in operators
 
         if len(parts) == 2:
             cached_chat_id, cached_user_id = parts
@@ -1631,7 +1915,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         keyword = cached["keyword"]
-        allowed, retry_after = check_search_rate_limit(user_id)
+        allowed, retry_after = check_search_rate_limit(user_id, chat_id)
         if not allowed:
             await query.answer(f"⏳ 搜索太频繁了，请在 {retry_after} 秒后再试", show_alert=True)
             return
@@ -1641,11 +1925,12 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # 执行新搜索 - 使用 query 直接编辑消息
         try:
             # 直接使用已存在的 search_message 进行搜索
+            # 以原发起人身份重搜，保持缓存键不变，合并进来的用户仍可继续操作
             await perform_search_from_callback(
                 query,
                 context,
                 keyword,
-                user_id,
+                _cache_owner_id(cache_key) or user_id,
                 chat_id,
                 **cached.get("options", {}),
             )
@@ -1793,6 +2078,115 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
 
+# ============ 内联模式 ============
+
+def _inline_search_kwargs(user_id: int) -> dict[str, Any]:
+    """按用户设置生成内联搜索参数，与私聊搜索共用同一结果缓存键。"""
+    return _resolve_search_options(settings_manager.get_settings(user_id))
+
+
+def _build_inline_results(
+    results: dict[str, Any],
+    keyword: str,
+    offset: int,
+) -> tuple[list[InlineQueryResultArticle], str]:
+    """把缓存结果的一页转换为内联结果，返回结果列表和 next_offset。"""
+    articles: list[InlineQueryResultArticle] = []
+    has_more = False
+    for index, (cloud_type, link) in enumerate(pansou_client.iter_links_by_count(results)):
+        if index < offset:
+            continue
+        if len(articles) >= INLINE_PAGE_SIZE:
+            has_more = True
+            break
+
+        icon = CLOUD_TYPE_ICONS.get(cloud_type, "📁")
+        cloud_name = CLOUD_TYPE_NAMES.get(cloud_type, cloud_type)
+        description = cloud_name
+        if link.get("password"):
+            description += f" · 密码 {link['password']}"
+        if link.get("source"):
+            description += f" · {link['source']}"
+
+        articles.append(
+            InlineQueryResultArticle(
+                id=str(index),
+                title=f"{icon} {link.get('note') or '无标题'}"[:128],
+                description=description[:256],
+                input_message_content=InputTextMessageContent(
+                    pansou_client.format_link_message(link, keyword, cloud_type),
+                    parse_mode=ParseMode.HTML,
+                    link_preview_options=LinkPreviewOptions(is_disabled=True),
+                ),
+            )
+        )
+
+    next_offset = str(offset + len(articles)) if has_more else ""
+    return articles, next_offset
+
+
+async def _settle_inline_query(user_id: int, keyword: str, search_kwargs: dict[str, Any]) -> Optional[dict]:
+    """防抖：输入停顿后才请求上游；被新输入取代时本任务会被取消。"""
+    await asyncio.sleep(settings.inline_debounce_seconds)
+    allowed, _ = check_search_rate_limit(user_id, inline=True)
+    if not allowed:
+        return None
+    return await pansou_client.search(keyword=keyword, **search_kwargs)
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """处理内联查询：缓存优先，未命中时防抖后再请求上游。"""
+    query = update.inline_query
+    keyword = query.query.strip()
+    user_id = query.from_user.id
+
+    previous = _inline_tasks.pop(user_id, None)
+    if previous and not previous.done():
+        previous.cancel()
+
+    if len(keyword) < 2:
+        return
+
+    try:
+        offset = max(0, int(query.offset or 0))
+    except ValueError:
+        offset = 0
+
+    search_kwargs = _inline_search_kwargs(user_id)
+    results = await pansou_client.get_cached_search(keyword=keyword, **search_kwargs)
+
+    if results is None:
+        task = asyncio.create_task(_settle_inline_query(user_id, keyword, search_kwargs))
+        _inline_tasks[user_id] = task
+        try:
+            results = await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            logger.debug("inline_query_superseded", user_id=user_id, keyword=keyword)
+            return
+        finally:
+            if _inline_tasks.get(user_id) is task:
+                _inline_tasks.pop(user_id, None)
+
+    if not results or "error" in results:
+        articles, next_offset, cache_time = [], "", 5
+    else:
+        articles, next_offset = _build_inline_results(results, keyword, offset)
+        cache_time = pansou_client.result_cache_ttl
+
+    try:
+        await query.answer(
+            articles,
+            cache_time=cache_time,
+            is_personal=True,
+            next_offset=next_offset,
+        )
+    except BadRequest as exc:
+        # 上游较慢时查询可能已过期，用户早已看不到这次结果
+        logger.debug("inline_answer_failed", error=str(exc), keyword=keyword)
+
+
 # ============ 错误处理 ============
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1804,7 +2198,24 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.debug("ignored_message_not_modified")
         return
 
-    logger.error("bot_error", error=error_text, update=update)
+    # 流控层已重试过仍被限流时，不再回复错误消息，避免继续加重限流。
+    if isinstance(context.error, RetryAfter):
+        logger.warning("telegram_flood_limited", retry_after=context.error.retry_after)
+        return
+
+    # 只记录定位所需的 ID，完整 Update 渲染成本高且包含用户消息内容
+    if isinstance(update, Update):
+        logger.error(
+            "bot_error",
+            error=error_text,
+            error_type=type(context.error).__name__,
+            update_id=update.update_id,
+            user_id=update.effective_user.id if update.effective_user else None,
+            chat_id=update.effective_chat.id if update.effective_chat else None,
+            exc_info=context.error,
+        )
+    else:
+        logger.error("bot_error", error=error_text, error_type=type(context.error).__name__, exc_info=context.error)
 
     if update and update.effective_message:
         try:
@@ -1834,14 +2245,17 @@ def create_application() -> Application:
     """创建并配置 Bot 应用"""
     from bot_config import create_optimized_request
     
-    application = (
+    builder = (
         Application.builder()
         .token(settings.tg_bot_token)
         .request(create_optimized_request())
         .post_init(_post_init)
         .concurrent_updates(True)
-        .build()
     )
+    if settings.tg_api_base_url:
+        base_url = settings.tg_api_base_url.rstrip("/")
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
     
     # 添加命令处理器
     application.add_handler(CommandHandler("start", start_command))
@@ -1855,6 +2269,8 @@ def create_application() -> Application:
     application.add_handler(CommandHandler("reset", reset_command))
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("refresh", refresh_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(CommandHandler("update", update_command))
     application.add_handler(CommandHandler("search", search_command))
     application.add_handler(CommandHandler("s", search_command, filters=filters.ChatType.GROUPS | filters.ChatType.SUPERGROUP))
@@ -1862,6 +2278,9 @@ def create_application() -> Application:
     # 添加回调处理器
     application.add_handler(CallbackQueryHandler(handle_callback))
     
+    # 添加内联查询处理器（需在 @BotFather 中 /setinline 开启）
+    application.add_handler(InlineQueryHandler(inline_query_handler))
+    
     # 添加私聊消息处理器
     application.add_handler(
         MessageHandler(
@@ -1884,30 +2303,13 @@ def create_application() -> Application:
     return application
 
 
-async def main() -> None:
-    """主入口"""
-    import structlog
-    structlog.configure(
-        processors=[
-            structlog.stdlib.filter_by_level,
-            structlog.stdlib.add_logger_name,
-            structlog.stdlib.add_log_level,
-            structlog.stdlib.PositionalArgumentsFormatter(),
-            structlog.processors.TimeStamper(fmt="iso"),
-            structlog.processors.StackInfoRenderer(),
-            structlog.processors.format_exc_info,
-            structlog.processors.UnicodeDecoder(),
-            structlog.dev.ConsoleRenderer()
-        ],
-        context_class=dict,
-        logger_factory=structlog.stdlib.LoggerFactory(),
-        wrapper_class=structlog.stdlib.BoundLogger,
-        cache_logger_on_first_use=True,
-    )
-    
+async def start_bot() -> Application:
+    """创建并启动 Bot 应用，开始轮询后返回，供独立运行或与 HTTP API 同进程运行。"""
     global bot_application
     
     logger.info("bot_starting", log_level=settings.log_level)
+    # 使用 SQLite 设置存储时，首次启动导入旧版 JSON 文件
+    await asyncio.get_running_loop().run_in_executor(None, settings_manager.migrate_from_json)
     
     application = create_application()
     bot_application = application
@@ -1934,8 +2336,39 @@ async def main() -> None:
     
     logger.info("bot_polling_started")
     print("✅ 机器人轮询已启动")
+
+    _register_bot_metrics()
+    return application
+
+
+async def stop_bot(application: Application) -> None:
+    """停止轮询并关闭 Bot 应用。"""
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+    await settings_manager.aflush()
+    logger.info("bot_stopped")
+
+
+async def main() -> None:
+    """主入口"""
+    setup_logging()
+    application = await start_bot()
+
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    metrics_runner = None
+    if settings.bot_metrics_port:
+        metrics_runner = await start_metrics_server(settings.bot_metrics_host, settings.bot_metrics_port)
     
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        lag_monitor.cancel()
+        await stop_bot(application)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -5,12 +5,20 @@ from telegram.request import HTTPXRequest
 
 import httpx
 
+from config import settings
+from telegram_governor import TelegramFloodGovernor
+
 def create_optimized_request():
-    """创建优化的 HTTP 请求配置（单例模式复用连接池）"""
-    return HTTPXRequest(
-        connection_pool_size=32,
-        connect_timeout=30.0,
-        read_timeout=60.0,
-        write_timeout=30.0,
-        pool_timeout=30.0,
+    """创建优化的 HTTP 请求配置（单例模式复用连接池，出站调用统一流控）"""
+    return TelegramFloodGovernor(
+        HTTPXRequest(
+            connection_pool_size=32,
+            connect_timeout=30.0,
+            read_timeout=60.0,
+            write_timeout=30.0,
+            pool_timeout=30.0,
+        ),
+        global_rate=settings.tg_global_rate_per_second,
+        group_rate_per_minute=settings.tg_group_rate_per_minute,
+        private_rate=settings.tg_private_rate_per_second,
     )
@@ -1,9 +1,20 @@
 """
 Bot 配置模块
 """
-from typing import Optional, List
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
-from pydantic import Field
+from pydantic import BaseModel, Field
+
+
+class ApiTokenConfig(BaseModel):
+    """HTTP API 命名令牌及其配额"""
+    
+    name: str = Field(..., description="令牌名称，用于日志和限流统计")
+    token: str = Field(..., description="令牌值")
+    rate_per_minute: int = Field(default=60, ge=1, description="每分钟请求上限")
+    max_concurrent: int = Field(default=4, ge=1, description="并发请求上限")
+    daily_quota: int = Field(default=0, ge=0, description="每日请求配额，0 表示不限")
+    allow_debug: bool = Field(default=False, description="是否允许调用 /api/debug/ 调试接口")
 
 
 class Settings(BaseSettings):
@@ -11,6 +22,10 @@ class Settings(BaseSettings):
     
     # Telegram Bot 配置
     tg_bot_token: str = Field(..., description="Telegram Bot Token")
+    tg_api_base_url: Optional[str] = Field(
+        default=None,
+        description="Bot API 地址，留空使用官方地址；可指向本地 Bot API 服务或压测替身",
+    )
     
     # Pansou API 配置
     pansou_api_url: str = Field(default="http://localhost:8888", description="Pansou API 地址")
@@ -24,12 +39,32 @@ class Settings(BaseSettings):
     default_result_limit: int = Field(default=10, ge=1, le=50, description="默认结果限制")
     max_result_limit: int = Field(default=20, ge=1, le=100, description="最大结果限制")
     search_timeout: int = Field(default=30, ge=5, le=60, description="搜索超时时间(秒)")
+    health_probe_interval: float = Field(default=10, ge=1, description="上游健康探测间隔(秒)")
+    health_probe_stale_seconds: float = Field(default=60, ge=1, description="超过该秒数没有成功探测即视为未就绪")
+    inline_debounce_seconds: float = Field(default=0.6, ge=0, le=5, description="内联查询防抖时间(秒)")
     
     # 日志配置
     log_level: str = Field(default="INFO", description="日志级别")
+    log_format: str = Field(default="auto", description="日志格式：json / console / auto（终端输出 console，否则 json）")
+    log_sample_rates: Dict[str, float] = Field(
+        default_factory=lambda: {"http_api_search": 0.1, "search_cache_hit": 0.01},
+        description="高频日志事件的采样比例(JSON)，未列出的事件全部保留",
+    )
     
     # 速率限制
     rate_limit_per_minute: int = Field(default=10, ge=1, description="每分钟速率限制")
+    inline_rate_limit_per_minute: int = Field(default=20, ge=1, description="单个用户每分钟内联查询上游搜索上限")
+    chat_rate_limit_per_minute: int = Field(default=30, ge=1, description="单个群组每分钟搜索上限")
+    global_rate_limit_per_minute: int = Field(default=300, ge=1, description="全局每分钟上游搜索上限")
+
+    # Telegram 出站流控
+    tg_global_rate_per_second: int = Field(default=30, ge=1, description="Bot API 全局每秒调用上限")
+    tg_group_rate_per_minute: int = Field(default=20, ge=1, description="单个群组每分钟调用上限")
+    tg_private_rate_per_second: int = Field(default=1, ge=1, description="单个私聊每秒调用上限")
+    
+    # 群组同搜索合并（可选）
+    coalesce_chat_ids: Optional[str] = Field(default=None, description="启用相同搜索合并的群组ID，逗号分隔")
+    search_coalesce_seconds: int = Field(default=30, ge=1, le=180, description="相同搜索合并窗口(秒)")
     
     # 默认搜索频道（可选）
     default_channels: Optional[str] = Field(default=None, description="默认搜索频道，逗号分隔")
@@ -43,8 +78,28 @@ class Settings(BaseSettings):
     # HTTP API 配置
     http_api_host: str = Field(default="127.0.0.1", description="HTTP API 监听地址")
     http_api_port: int = Field(default=8090, ge=1, le=65535, description="HTTP API 监听端口")
+    http_api_workers: int = Field(default=1, ge=1, le=64, description="HTTP API worker 进程数")
+    data_dir: str = Field(default="./data", description="数据目录")
+    settings_backend: str = Field(default="json", pattern="^(sqlite|json)$", description="用户设置存储后端：json 或 sqlite")
+    settings_db_path: Optional[str] = Field(default=None, description="SQLite 用户设置数据库路径，默认位于数据目录下")
+    settings_flush_delay: float = Field(default=0.5, ge=0, description="用户设置批量写入窗口(秒)")
+    settings_cache_size: int = Field(default=10000, ge=1, description="内存中最多缓存多少个用户设置")
+    settings_negative_cache_size: int = Field(default=100000, ge=0, description="记录多少个未自定义设置的用户，避免重复查询存储")
+    shared_cache_path: str = Field(default="./data/shared_cache.sqlite3", description="多 worker 共享结果缓存文件路径")
+    bot_metrics_host: str = Field(default="127.0.0.1", description="Bot 进程指标监听地址")
+    bot_metrics_port: Optional[int] = Field(default=None, ge=1, le=65535, description="Bot 进程指标监听端口，不设置则不启动")
+    loop_lag_threshold_ms: int = Field(default=100, ge=10, description="事件循环阻塞超过该毫秒数时记录调用栈")
+    loop_lag_report_interval: int = Field(default=60, ge=1, description="同一阻塞位置两次记录的最小间隔(秒)")
     http_api_token: Optional[str] = Field(default=None, description="HTTP API 访问令牌")
     require_http_api_token: bool = Field(default=True, description="HTTP API 是否强制要求访问令牌")
+    http_api_tokens: List[ApiTokenConfig] = Field(default_factory=list, description="HTTP API 命名令牌列表(JSON)")
+    http_api_rate_per_minute: int = Field(default=60, ge=1, description="默认令牌每分钟请求上限")
+    http_api_max_concurrent: int = Field(default=4, ge=1, description="默认令牌并发请求上限")
+    http_api_daily_quota: int = Field(default=0, ge=0, description="默认令牌每日请求配额，0 表示不限")
+    http_api_allow_debug: bool = Field(default=False, description="默认令牌是否允许调用调试接口")
+    http_api_batch_max_items: int = Field(default=20, ge=1, le=100, description="批量搜索单次最多关键词数")
+    http_api_compress_min_bytes: int = Field(default=1024, ge=0, description="HTTP API 响应压缩阈值(字节)")
+    http_api_batch_concurrency: int = Field(default=4, ge=1, le=20, description="批量搜索并发数")
 
     class Config:
         env_file = ".env"
@@ -78,6 +133,32 @@ class Settings(BaseSettings):
             return [int(id_str.strip()) for id_str in self.admin_ids.split(',') if id_str.strip()]
         return []
     
+    def get_coalesce_chat_ids(self) -> List[int]:
+        """获取启用相同搜索合并的群组ID列表"""
+        if self.coalesce_chat_ids:
+            return [int(id_str.strip()) for id_str in self.coalesce_chat_ids.split(',') if id_str.strip()]
+        return []
+    
+    def is_coalesce_chat(self, chat_id: int) -> bool:
+        """检查群组是否启用相同搜索合并"""
+        return chat_id in self.get_coalesce_chat_ids()
+    
+    def get_api_tokens(self) -> List[ApiTokenConfig]:
+        """获取 HTTP API 令牌列表（HTTP_API_TOKEN 作为名为 default 的令牌）"""
+        tokens = list(self.http_api_tokens)
+        if self.http_api_token:
+            tokens.append(
+                ApiTokenConfig(
+                    name="default",
+                    token=self.http_api_token,
+                    rate_per_minute=self.http_api_rate_per_minute,
+                    max_concurrent=self.http_api_max_concurrent,
+                    daily_quota=self.http_api_daily_quota,
+                    allow_debug=self.http_api_allow_debug,
+                )
+            )
+        return tokens
+    
     def is_admin(self, user_id: int) -> bool:
         """检查用户是否为管理员"""
         admins = self.get_admin_ids()
@@ -0,0 +1,125 @@
+"""
+上游健康探测
+
+后台任务按固定间隔探测 pansou，把结果保存在内存中；
+/livez、/readyz 和 /healthz 直接读取最近一次探测结果，不再同步请求上游。
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Optional
+
+from structlog import get_logger
+
+from config import settings
+from metrics import registry
+from pansou_client import pansou_client
+
+logger = get_logger()
+
+
+class UpstreamHealthProber:
+    """后台探测 pansou 健康状态，并记录延迟与最近一次成功时间。"""
+
+    def __init__(self, interval: float, stale_after: float):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.started_at = time.monotonic()
+        self.healthy: Optional[bool] = None
+        self.status = "unknown"
+        self.latency_ms: Optional[float] = None
+        self.last_probe_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self.consecutive_failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe_once(self) -> bool:
+        """探测一次并更新状态。"""
+        started = time.perf_counter()
+        try:
+            info = await pansou_client.get_service_info(force_refresh=True)
+        except Exception as exc:
+            logger.warning("health_probe_failed", error=str(exc))
+            info = {"healthy": False, "status": "error"}
+
+        self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.last_probe_at = time.monotonic()
+        self.healthy = bool(info.get("healthy"))
+        self.status = str(info.get("status") or ("ok" if self.healthy else "unavailable"))
+        if self.healthy:
+            if self.consecutive_failures:
+                logger.info("health_probe_recovered", failures=self.consecutive_failures)
+            self.last_success_at = self.last_probe_at
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            # 只在状态变化时记录，避免上游长时间不可用时刷屏
+            if self.consecutive_failures == 1:
+                logger.warning("health_probe_unhealthy", status=self.status)
+        return self.healthy
+
+    async def _run(self) -> None:
+        while True:
+            await self.probe_once()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def has_result(self) -> bool:
+        return self.last_probe_at is not None
+
+    def seconds_since_success(self) -> Optional[float]:
+        if self.last_success_at is None:
+            return None
+        return round(time.monotonic() - self.last_success_at, 1)
+
+    def is_ready(self) -> bool:
+        """最近一次成功探测在 stale_after 秒内才算就绪。"""
+        since_success = self.seconds_since_success()
+        return bool(self.healthy) and since_success is not None and since_success <= self.stale_after
+
+    def snapshot(self) -> dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "healthy": self.healthy,
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+            "seconds_since_probe": round(now - self.last_probe_at, 1) if self.last_probe_at else None,
+            "seconds_since_success": self.seconds_since_success(),
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+health_prober = UpstreamHealthProber(
+    interval=settings.health_probe_interval,
+    stale_after=settings.health_probe_stale_seconds,
+)
+
+registry.register_callback(
+    "pansou_upstream_up",
+    "最近一次上游健康探测是否成功",
+    lambda: 1 if health_prober.healthy else 0,
+)
+registry.register_callback(
+    "pansou_upstream_probe_latency_seconds",
+    "最近一次上游健康探测耗时",
+    lambda: (health_prober.latency_ms or 0) / 1000,
+)
+registry.register_callback(
+    "pansou_upstream_seconds_since_success",
+    "距离最近一次上游健康探测成功的秒数",
+    lambda: {} if health_prober.last_success_at is None else health_prober.seconds_since_success(),
+)
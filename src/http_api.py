@@ -5,24 +5,129 @@
 """
 from __future__ import annotations
 
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from itertools import islice
 from json import JSONDecodeError
 from typing import Any, Optional
 
 from aiohttp import web
 from structlog import get_logger
 
-from config import settings
-from pansou_client import pansou_client, CLOUD_TYPE_NAMES, CLOUD_TYPE_ICONS
+from config import ApiTokenConfig, settings
+from health import health_prober
+from loop_watchdog import monitor_event_loop_lag
+from metrics import metrics_handler
+from pansou_client import pansou_client, CLOUD_TYPE_ALIASES, CLOUD_TYPE_NAMES, CLOUD_TYPE_ICONS
+from profiler import (
+    MAX_PROFILE_SECONDS,
+    is_running as profiler_running,
+    parse_profile_seconds,
+    profile_event_loop,
+)
+from rate_limit import api_token_limiter, search_rate_limiter
+from timing import StageTimer, stage
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只提供 gzip
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖：未安装时只提供 gzip
+    zstandard = None
 
 logger = get_logger()
 
+COMPRESSORS = {
+    "gzip": lambda body: gzip.compress(body, compresslevel=6),
+}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=5)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = zstandard.ZstdCompressor(level=3).compress
+
+# q 值相同时的偏好顺序
+ENCODING_PREFERENCE = ("zstd", "br", "gzip")
+
+# 应用级与请求级存储的键
+API_TOKENS_KEY = web.AppKey("api_tokens", dict[str, ApiTokenConfig])
+LAG_MONITOR_KEY = web.AppKey("lag_monitor", asyncio.Task)
+REQUEST_ID_KEY = web.RequestKey("request_id", str)
+API_TOKEN_KEY = web.RequestKey("api_token", ApiTokenConfig)
+RATE_LIMIT_HEADERS_KEY = web.RequestKey("rate_limit_headers", dict[str, str])
+
+
+# 流式搜索每个事件最多携带的条目数，以及等待上游期间的心跳间隔
+STREAM_CHUNK_SIZE = 50
+STREAM_HEARTBEAT_SECONDS = 10
+
+
+class RenderedResponseCache:
+    """按归一化请求缓存最终序列化的响应字节，过期时间与 PansouClient 结果缓存一致。"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, dict[str, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry["expires_at"]:
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, body: bytes, expires_at: float) -> dict[str, Any]:
+        entry = {
+            "etag": f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+            "expires_at": expires_at,
+            "bodies": {"identity": body},
+        }
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
 
-def _json_response(payload: dict[str, Any], status: int = 200) -> web.Response:
-    """统一 JSON 响应并补充基础 CORS 头。"""
-    response = web.json_response(payload, status=status)
+    @staticmethod
+    def get_body(entry: dict[str, Any], encoding: str) -> bytes:
+        """取指定编码的响应体，压缩结果与原始字节一起缓存，热门关键词只压缩一次。"""
+        bodies = entry["bodies"]
+        body = bodies.get(encoding)
+        if body is None:
+            body = COMPRESSORS[encoding](bodies["identity"])
+            bodies[encoding] = body
+        return body
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+
+response_cache = RenderedResponseCache()
+
+
+def _apply_cors_headers(response: web.StreamResponse) -> None:
     response.headers["Access-Control-Allow-Origin"] = "*"
     response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type, X-API-Token"
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    response.headers["Access-Control-Expose-Headers"] = "ETag, Retry-After, X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Reset, X-RateLimit-Daily-Limit, X-RateLimit-Daily-Remaining, X-Request-ID"
+
+
+def _json_response(payload: dict[str, Any], status: int = 200) -> web.Response:
+    """统一 JSON 响应并补充基础 CORS 头。"""
+    response = web.json_response(payload, status=status)
+    _apply_cors_headers(response)
     return response
 
 
@@ -75,58 +180,145 @@ def _extract_filter_config(data: dict[str, Any]) -> Optional[dict[str, list[str]
     }
 
 
+def _summarize_type(cloud_type: str, links: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "cloud_type": cloud_type,
+        "cloud_name": CLOUD_TYPE_NAMES.get(cloud_type, cloud_type),
+        "icon": CLOUD_TYPE_ICONS.get(cloud_type, "📁"),
+        "count": len(links),
+    }
+
+
+def _serialize_link(type_summary: dict[str, Any], link: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "cloud_type": type_summary["cloud_type"],
+        "cloud_name": type_summary["cloud_name"],
+        "icon": type_summary["icon"],
+        "note": _normalize_string(link.get("note")),
+        "url": _normalize_string(link.get("url")),
+        "password": _normalize_string(link.get("password")),
+        "source": _normalize_string(link.get("source")),
+    }
+
+
 def _flatten_results(
     results: dict[str, Any],
     item_limit: Optional[int] = None,
+    offset: int = 0,
+    cloud_type: Optional[str] = None,
 ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
     summary: list[dict[str, Any]] = []
     items: list[dict[str, Any]] = []
 
+    remaining_offset = offset
     merged_by_type = results.get("merged_by_type", {})
-    for cloud_type, links in merged_by_type.items():
-        cloud_name = CLOUD_TYPE_NAMES.get(cloud_type, cloud_type)
-        icon = CLOUD_TYPE_ICONS.get(cloud_type, "📁")
-        count = len(links)
+    for link_type, links in merged_by_type.items():
+        type_summary = _summarize_type(link_type, links)
+        summary.append(type_summary)
 
-        summary.append(
+        if cloud_type and link_type != cloud_type:
+            continue
+        if remaining_offset >= len(links):
+            remaining_offset -= len(links)
+            continue
+
+        for link in islice(links, remaining_offset, None):
+            if item_limit is not None and len(items) >= item_limit:
+                break
+            items.append(_serialize_link(type_summary, link))
+        remaining_offset = 0
+
+    return summary, items
+
+
+def _encode_cursor(cursor: dict[str, Any]) -> str:
+    raw = json.dumps(cursor, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _decode_cursor(value: str) -> Optional[dict[str, Any]]:
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        cursor = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    required = {"k": str, "v": (int, float), "q": str, "o": int, "n": int}
+    if not isinstance(cursor, dict):
+        return None
+    if not all(isinstance(cursor.get(key), kind) for key, kind in required.items()):
+        return None
+    return cursor
+
+
+def _build_page_payload(
+    results: dict[str, Any],
+    *,
+    keyword: str,
+    limit: int,
+    offset: int,
+    cloud_type: Optional[str],
+    cache_key: str,
+    version: Optional[float],
+) -> dict[str, Any]:
+    """生成一页结果；还有剩余条目且结果仍在缓存中时附带 next_cursor。"""
+    summary, items = _flatten_results(results, item_limit=limit, offset=offset, cloud_type=cloud_type)
+    available = sum(
+        item["count"] for item in summary if not cloud_type or item["cloud_type"] == cloud_type
+    )
+    next_offset = offset + len(items)
+    next_cursor = None
+    if version is not None and next_offset < available:
+        next_cursor = _encode_cursor(
             {
-                "cloud_type": cloud_type,
-                "cloud_name": cloud_name,
-                "icon": icon,
-                "count": count,
+                "k": cache_key,
+                "v": version,
+                "q": keyword,
+                "o": next_offset,
+                "n": limit,
+                "t": cloud_type,
             }
         )
 
-        for link in links:
-            if item_limit is not None and len(items) >= item_limit:
-                continue
-
-            items.append(
-                {
-                    "cloud_type": cloud_type,
-                    "cloud_name": cloud_name,
-                    "icon": icon,
-                    "note": _normalize_string(link.get("note")),
-                    "url": _normalize_string(link.get("url")),
-                    "password": _normalize_string(link.get("password")),
-                    "source": _normalize_string(link.get("source")),
-                }
-            )
+    return {
+        "ok": True,
+        "keyword": keyword,
+        "limit": limit,
+        "offset": offset,
+        "cloud_type": cloud_type,
+        "total": results.get("total", 0),
+        "returned_items": len(items),
+        "summary": summary,
+        "items": items,
+        "next_cursor": next_cursor,
+    }
 
-    return summary, items
 
+def _build_token_index() -> dict[str, ApiTokenConfig]:
+    return {token.token: token for token in settings.get_api_tokens()}
 
-def _is_authorized(request: web.Request) -> bool:
-    expected_token = settings.http_api_token
-    if not expected_token:
-        return not settings.require_http_api_token
 
+def _extract_token(request: web.Request) -> str:
     auth_header = request.headers.get("Authorization", "")
     if auth_header.lower().startswith("bearer "):
-        return auth_header[7:].strip() == expected_token
+        return auth_header[7:].strip()
+    return request.headers.get("X-API-Token", "").strip()
 
-    token = request.headers.get("X-API-Token", "").strip()
-    return token == expected_token
+
+def _authenticate(request: web.Request) -> tuple[bool, Optional[ApiTokenConfig]]:
+    """校验令牌，返回 (是否通过, 令牌配置)；未配置令牌且不强制鉴权时匿名放行。"""
+    token_index = request.app[API_TOKENS_KEY]
+    if not token_index:
+        return not settings.require_http_api_token, None
+
+    token = token_index.get(_extract_token(request))
+    return token is not None, token
+
+
+def _search_rate_key(request: web.Request) -> Optional[str]:
+    """带令牌的请求已按令牌限流，只占用全局预算；匿名请求仍按来源 IP 限流。"""
+    if request.get(API_TOKEN_KEY) is not None:
+        return None
+    return f"http:{request.remote}"
 
 
 async def _read_request_data(request: web.Request) -> dict[str, Any]:
@@ -160,19 +352,75 @@ async def _cors_middleware(request: web.Request, handler):
     return await handler(request)
 
 
+@web.middleware
+async def _auth_middleware(request: web.Request, handler):
+    """/api/ 下的接口统一鉴权，并按令牌检查速率、并发和每日配额。"""
+    if not request.path.startswith("/api/"):
+        return await handler(request)
+
+    authorized, token = _authenticate(request)
+    if not authorized:
+        return _json_response({"ok": False, "error": "unauthorized"}, status=401)
+    if token is None:
+        return await handler(request)
+
+    allowed, retry_after, headers = await api_token_limiter.acquire(token)
+    request[API_TOKEN_KEY] = token
+    request[RATE_LIMIT_HEADERS_KEY] = headers
+    if not allowed:
+        logger.info("http_api_token_limited", token=token.name, retry_after=retry_after)
+        return _rate_limited_response(retry_after)
+
+    try:
+        return await handler(request)
+    finally:
+        api_token_limiter.release(token)
+
+
+async def _apply_rate_limit_headers(request: web.Request, response: web.StreamResponse) -> None:
+    headers = request.get(RATE_LIMIT_HEADERS_KEY)
+    if headers:
+        response.headers.update(headers)
+
+
+async def _apply_request_id_header(request: web.Request, response: web.StreamResponse) -> None:
+    request_id = request.get(REQUEST_ID_KEY)
+    if request_id:
+        response.headers["X-Request-ID"] = request_id
+
+
+def _request_timer(request: web.Request) -> StageTimer:
+    """沿用调用方传入的 X-Request-ID（仅限字母数字、-、_，最长 64），否则生成新的。"""
+    request_id = request.headers.get("X-Request-ID", "").strip()
+    if not (0 < len(request_id) <= 64 and request_id.replace("-", "").replace("_", "").isalnum()):
+        request_id = None
+    timer = StageTimer("http_api", request_id)
+    request[REQUEST_ID_KEY] = timer.request_id
+    return timer
+
+
 async def index_handler(_: web.Request) -> web.Response:
     return _json_response(
         {
             "ok": True,
             "service": "tg-pansou-bot-http-api",
             "search_endpoint": "/api/pansou/search",
+            "batch_search_endpoint": "/api/pansou/search/batch",
+            "stream_search_endpoint": "/api/pansou/search/stream",
             "health_endpoint": "/healthz",
+            "liveness_endpoint": "/livez",
+            "readiness_endpoint": "/readyz",
+            "metrics_endpoint": "/metrics",
         }
     )
 
 
 async def health_handler(_: web.Request) -> web.Response:
-    upstream_ok = await pansou_client.health_check()
+    # 后台探测已有结果时直接读内存，否则（如刚启动）同步检查一次
+    if health_prober.has_result:
+        upstream_ok = bool(health_prober.healthy)
+    else:
+        upstream_ok = await pansou_client.health_check()
     status = 200 if upstream_ok else 503
     return _json_response(
         {
@@ -181,83 +429,525 @@ async def health_handler(_: web.Request) -> web.Response:
             "upstream": {
                 "pansou_api": upstream_ok,
                 "url": settings.pansou_api_url,
+                **health_prober.snapshot(),
             },
         },
         status=status,
     )
 
 
-async def search_handler(request: web.Request) -> web.Response:
-    if not _is_authorized(request):
-        return _json_response({"ok": False, "error": "unauthorized"}, status=401)
+async def liveness_handler(_: web.Request) -> web.Response:
+    """存活检查：进程和事件循环能响应即可，不依赖上游。"""
+    return _json_response(
+        {
+            "ok": True,
+            "uptime_seconds": round(time.monotonic() - health_prober.started_at, 1),
+        }
+    )
 
-    data = await _read_request_data(request)
-    keyword = _normalize_string(data.get("kw") or data.get("keyword") or data.get("q"))
-    if not keyword:
-        return _json_response({"ok": False, "error": "keyword is required"}, status=400)
 
-    limit = _normalize_limit(data.get("limit"))
-    channels = _normalize_string_list(data.get("channels"))
-    plugins = _normalize_string_list(data.get("plugins"))
-    cloud_types = _normalize_string_list(data.get("cloud_types"))
-    source_type = _normalize_string(data.get("src") or data.get("source_type")) or None
-    filter_config = _extract_filter_config(data)
+async def readiness_handler(_: web.Request) -> web.Response:
+    """就绪检查：只读取后台探测结果，最近一次成功探测过旧或上游不可用时返回 503。"""
+    ready = health_prober.is_ready()
+    return _json_response(
+        {"ok": ready, "upstream": health_prober.snapshot()},
+        status=200 if ready else 503,
+    )
+
+
+def _parse_search_params(data: dict[str, Any]) -> dict[str, Any]:
+    """从请求参数中解析并归一化搜索参数。"""
+    return {
+        "keyword": _normalize_string(data.get("kw") or data.get("keyword") or data.get("q")),
+        "limit": _normalize_limit(data.get("limit")),
+        "channels": _normalize_string_list(data.get("channels")),
+        "plugins": _normalize_string_list(data.get("plugins")),
+        "cloud_types": _normalize_string_list(data.get("cloud_types")),
+        "source_type": _normalize_string(data.get("src") or data.get("source_type")) or None,
+        "filter_config": _extract_filter_config(data),
+    }
+
+
+def _rate_limited_response(retry_after: int) -> web.Response:
+    response = _json_response(
+        {"ok": False, "error": "rate limited", "retry_after": retry_after},
+        status=429,
+    )
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+async def _search_payload(
+    params: dict[str, Any],
+    cloud_type: Optional[str] = None,
+) -> tuple[int, dict[str, Any]]:
+    """执行一次搜索，返回 HTTP 状态码和响应体。"""
+    keyword = params["keyword"]
+    with stage("search"):
+        results = await pansou_client.search(**params)
+
+    if "error" in results:
+        return 502, {
+            "ok": False,
+            "keyword": keyword,
+            "error": results["error"],
+        }
+
+    cache_key = pansou_client.search_cache_key(**params)
+    with stage("build_payload"):
+        return 200, _build_page_payload(
+            results,
+            keyword=keyword,
+            limit=params["limit"],
+            offset=0,
+            cloud_type=cloud_type,
+            cache_key=cache_key,
+            version=pansou_client.cache_version(cache_key),
+        )
+
+
+async def _cursor_page_response(request: web.Request, cursor_value: str) -> web.Response:
+    """按游标翻页：只读取已缓存的归一化结果，不触发上游请求。"""
+    render_key = f"cursor:{cursor_value}"
+    entry = response_cache.get(render_key)
+    if entry is not None:
+        return _cached_json_response(request, entry)
+
+    cursor = _decode_cursor(cursor_value)
+    if cursor is None:
+        return _json_response({"ok": False, "error": "invalid cursor"}, status=400)
+
+    cache_key = cursor["k"]
+    results = await pansou_client.get_cached_by_key(cache_key)
+    expires_at = pansou_client.cache_expires_at(cache_key)
+    version = pansou_client.cache_version(cache_key)
+    # 版本不同说明结果已被重新搜索替换，继续翻页会混入另一份结果
+    if results is None or expires_at is None or version != cursor["v"]:
+        return _json_response(
+            {
+                "ok": False,
+                "error": "cursor expired",
+                "code": "cursor_expired",
+                "keyword": cursor["q"],
+            },
+            status=410,
+        )
+
+    payload = _build_page_payload(
+        results,
+        keyword=cursor["q"],
+        limit=_normalize_limit(cursor["n"]),
+        offset=max(0, cursor["o"]),
+        cloud_type=cursor.get("t") or None,
+        cache_key=cache_key,
+        version=version,
+    )
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return _cached_json_response(request, response_cache.set(render_key, body, expires_at))
+
+
+def _etag_matches(request: web.Request, etag: str) -> bool:
+    """判断 If-None-Match 是否命中当前 ETag。"""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    candidates = [item.strip() for item in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _negotiate_encoding(request: web.Request, body_size: int) -> str:
+    """按 Accept-Encoding 选择压缩算法，小于阈值的响应不压缩。"""
+    if body_size < settings.http_api_compress_min_bytes:
+        return "identity"
+
+    accepted: dict[str, float] = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+
+    best_encoding = "identity"
+    best_quality = 0.0
+    for encoding in ENCODING_PREFERENCE:
+        if encoding not in COMPRESSORS:
+            continue
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+    return best_encoding
+
+
+def _encoded_response(
+    request: web.Request,
+    body: bytes,
+    status: int = 200,
+    headers: Optional[dict[str, str]] = None,
+) -> web.Response:
+    """构造已按 Accept-Encoding 压缩的 JSON 响应。"""
+    encoding = _negotiate_encoding(request, len(body))
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        body = COMPRESSORS[encoding](body)
+        headers["Content-Encoding"] = encoding
+    response = web.Response(body=body, status=status, content_type="application/json", headers=headers)
+    _apply_cors_headers(response)
+    return response
+
+
+def _cached_json_response(request: web.Request, entry: dict[str, Any]) -> web.Response:
+    """用缓存的响应字节构造响应；条件请求命中时返回 304。"""
+    max_age = max(0, int(entry["expires_at"] - time.monotonic()))
+    encoding = _negotiate_encoding(request, len(entry["bodies"]["identity"]))
+    # 不同编码是不同表示，强 ETag 需要区分；条件请求对两种写法都认可
+    etag = entry["etag"] if encoding == "identity" else f'{entry["etag"][:-1]}-{encoding}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"max-age={max_age}",
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request, etag) or _etag_matches(request, entry["etag"]):
+        response = web.Response(status=304, headers=headers)
+    else:
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        response = web.Response(
+            body=RenderedResponseCache.get_body(entry, encoding),
+            content_type="application/json",
+            headers=headers,
+        )
+    _apply_cors_headers(response)
+    return response
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+async def search_handler(request: web.Request) -> web.Response:
+    timer = _request_timer(request)
+    with timer.stage("parse"):
+        data = await _read_request_data(request)
+    cursor_value = _normalize_string(data.get("cursor"))
+    if cursor_value:
+        return await _cursor_page_response(request, cursor_value)
+
+    params = _parse_search_params(data)
+    if not params["keyword"]:
+        return _json_response({"ok": False, "error": "keyword is required"}, status=400)
+    cloud_type = _normalize_string(data.get("cloud_type")).lower() or None
+    if cloud_type:
+        cloud_type = CLOUD_TYPE_ALIASES.get(cloud_type, cloud_type)
+
+    # 已渲染的响应直接返回字节，不占用上游限流配额
+    with timer.stage("response_cache"):
+        cache_key = pansou_client.search_cache_key(**params)
+        render_key = f"{cache_key}|{cloud_type}" if cloud_type else cache_key
+        entry = response_cache.get(render_key)
+    if entry is not None:
+        logger.debug("http_api_response_cache_hit", keyword=params["keyword"], request_id=timer.request_id)
+        return _cached_json_response(request, entry)
+
+    with timer.stage("rate_limit"):
+        allowed, retry_after = search_rate_limiter.check(_search_rate_key(request))
+    if not allowed:
+        return _rate_limited_response(retry_after)
 
     logger.info(
         "http_api_search",
-        keyword=keyword,
-        limit=limit,
-        channels=channels,
-        plugins=plugins,
-        cloud_types=cloud_types,
-        source_type=source_type,
+        keyword=params["keyword"],
+        limit=params["limit"],
+        channels=params["channels"],
+        plugins=params["plugins"],
+        cloud_types=params["cloud_types"],
+        source_type=params["source_type"],
         remote=request.remote,
+        request_id=timer.request_id,
     )
 
-    results = await pansou_client.search(
-        keyword=keyword,
-        channels=channels,
-        plugins=plugins,
-        cloud_types=cloud_types,
-        source_type=source_type,
-        filter_config=filter_config,
-        limit=limit,
+    with timer.active():
+        status, payload = await _search_payload(params, cloud_type=cloud_type)
+    if status != 200:
+        logger.warning("http_api_search_failed", keyword=params["keyword"], status=status, **timer.log_fields())
+        return _json_response(payload, status=status)
+
+    expires_at = pansou_client.cache_expires_at(cache_key)
+    if expires_at is None:
+        logger.info("http_api_search_completed", keyword=params["keyword"], **timer.log_fields())
+        return _json_response(payload, status=status)
+
+    with timer.stage("serialize"):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        entry = response_cache.set(render_key, body, expires_at)
+    logger.info("http_api_search_completed", keyword=params["keyword"], **timer.log_fields())
+    return _cached_json_response(request, entry)
+
+
+def _format_sse(event: str, payload: dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def stream_search_handler(request: web.Request) -> web.StreamResponse:
+    """SSE 流式搜索：先回 accepted，再回 summary，随后按网盘类型分块推送条目。"""
+    params = _parse_search_params(dict(request.query))
+    keyword = params["keyword"]
+    if not keyword:
+        return _json_response({"ok": False, "error": "keyword is required"}, status=400)
+
+    allowed, retry_after = search_rate_limiter.check(_search_rate_key(request))
+    if not allowed:
+        return _rate_limited_response(retry_after)
+
+    started = time.perf_counter()
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
     )
+    _apply_cors_headers(response)
+    await response.prepare(request)
 
-    if "error" in results:
-        return _json_response(
+    search_task: Optional[asyncio.Future] = None
+    try:
+        # 响应头和 accepted 在发起搜索之前写出，客户端不必等上游就能收到首个字节
+        await response.write(_format_sse("accepted", {"keyword": keyword, "limit": params["limit"]}))
+        search_task = asyncio.ensure_future(pansou_client.search(**params))
+
+        while True:
+            done, _ = await asyncio.wait({search_task}, timeout=STREAM_HEARTBEAT_SECONDS)
+            if done:
+                break
+            await response.write(b": ping\n\n")
+
+        results = search_task.result()
+        if "error" in results:
+            await response.write(_format_sse("error", {"keyword": keyword, "error": results["error"]}))
+        else:
+            returned_items = await _write_stream_results(response, results, keyword, params["limit"], started)
+            logger.info(
+                "http_api_stream_search",
+                keyword=keyword,
+                returned_items=returned_items,
+                elapsed_ms=_elapsed_ms(started),
+                remote=request.remote,
+            )
+    except (ConnectionResetError, asyncio.CancelledError) as exc:
+        # 客户端提前断开：上游请求在 PansouClient 中是共享且受保护的，会继续完成并写入缓存
+        if search_task is not None:
+            search_task.cancel()
+        logger.debug("http_api_stream_client_closed", keyword=keyword)
+        if isinstance(exc, asyncio.CancelledError):
+            raise
+        return response
+    except Exception as exc:
+        # 响应头已经发出，不能再返回 500，用 error 事件正常结束事件流
+        logger.error("http_api_stream_search_failed", keyword=keyword, error=str(exc), exc_info=exc)
+        try:
+            await response.write(_format_sse("error", {"keyword": keyword, "error": f"搜索出错: {exc}"}))
+        except ConnectionResetError:
+            return response
+
+    await response.write_eof()
+    return response
+
+
+async def _write_stream_results(
+    response: web.StreamResponse,
+    results: dict[str, Any],
+    keyword: str,
+    limit: int,
+    started: float,
+) -> int:
+    """写出 summary、按网盘类型分块的 items 和 done 事件，返回推送的条目数。
+
+    每块条目在写出前才序列化，写出即发送，不先把整份结果转换好。
+    """
+    merged_by_type = results.get("merged_by_type", {})
+    summary = [_summarize_type(cloud_type, links) for cloud_type, links in merged_by_type.items()]
+    await response.write(
+        _format_sse(
+            "summary",
             {
-                "ok": False,
                 "keyword": keyword,
-                "error": results["error"],
+                "total": results.get("total", 0),
+                "summary": summary,
+                "elapsed_ms": _elapsed_ms(started),
             },
-            status=502,
         )
+    )
 
-    summary, items = _flatten_results(results, item_limit=limit)
-    return _json_response(
-        {
-            "ok": True,
-            "keyword": keyword,
-            "limit": limit,
-            "total": results.get("total", 0),
-            "returned_items": len(items),
-            "summary": summary,
-            "items": items,
+    remaining = limit
+    for type_summary in summary:
+        if remaining <= 0:
+            break
+        links = merged_by_type[type_summary["cloud_type"]][:remaining]
+        remaining -= len(links)
+        for start in range(0, len(links), STREAM_CHUNK_SIZE):
+            chunk = [_serialize_link(type_summary, link) for link in links[start:start + STREAM_CHUNK_SIZE]]
+            await response.write(_format_sse("items", {"cloud_type": type_summary["cloud_type"], "items": chunk}))
+
+    returned_items = limit - remaining
+    await response.write(
+        _format_sse("done", {"returned_items": returned_items, "elapsed_ms": _elapsed_ms(started)})
+    )
+    return returned_items
+
+
+async def batch_search_handler(request: web.Request) -> web.Response:
+    """批量搜索：有界并发地逐项调用 PansouClient.search，一次返回各项结果或错误。"""
+    data = await _read_request_data(request)
+    raw_items = data.get("items")
+    if not isinstance(raw_items, list) or not raw_items:
+        return _json_response({"ok": False, "error": "items must be a non-empty list"}, status=400)
+
+    max_items = settings.http_api_batch_max_items
+    if len(raw_items) > max_items:
+        return _json_response(
+            {"ok": False, "error": "too many items", "max_items": max_items},
+            status=413,
+        )
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(settings.http_api_batch_concurrency)
+
+    async def _run_item(index: int, raw_item: Any) -> dict[str, Any]:
+        item_started = time.perf_counter()
+        if isinstance(raw_item, str):
+            raw_item = {"keyword": raw_item}
+        params = _parse_search_params(raw_item if isinstance(raw_item, dict) else {})
+
+        if not params["keyword"]:
+            status, payload = 400, {"ok": False, "error": "keyword is required"}
+        else:
+            allowed, retry_after = search_rate_limiter.check(_search_rate_key(request))
+            if not allowed:
+                status, payload = 429, {
+                    "ok": False,
+                    "keyword": params["keyword"],
+                    "error": "rate limited",
+                    "retry_after": retry_after,
+                }
+            else:
+                async with semaphore:
+                    status, payload = await _search_payload(params)
+
+        return {
+            "index": index,
+            "status": status,
+            **payload,
+            "elapsed_ms": _elapsed_ms(item_started),
         }
+
+    results = await asyncio.gather(*(_run_item(index, item) for index, item in enumerate(raw_items)))
+    succeeded = sum(1 for item in results if item["ok"])
+
+    logger.info(
+        "http_api_batch_search",
+        count=len(results),
+        succeeded=succeeded,
+        elapsed_ms=_elapsed_ms(started),
+        remote=request.remote,
     )
 
+    payload = {
+        "ok": True,
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_ms": _elapsed_ms(started),
+        "results": results,
+    }
+    return _encoded_response(request, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+
+async def _start_background_tasks(app: web.Application) -> None:
+    app[LAG_MONITOR_KEY] = asyncio.create_task(monitor_event_loop_lag())
+    health_prober.start()
+
 
 async def _close_client(app: web.Application) -> None:
+    lag_monitor = app.get(LAG_MONITOR_KEY)
+    if lag_monitor:
+        lag_monitor.cancel()
+    await health_prober.stop()
     await pansou_client.close()
 
 
+async def profile_handler(request: web.Request) -> web.Response:
+    """对事件循环采样 seconds 秒；format=json（默认）返回热点函数，collapsed 返回火焰图输入，text 返回纯文本。"""
+    token = request.get(API_TOKEN_KEY)
+    if token is None or not token.allow_debug:
+        return _json_response({"ok": False, "error": "forbidden"}, status=403)
+
+    seconds = parse_profile_seconds(request.query.get("seconds"))
+    if seconds is None:
+        return _json_response(
+            {"ok": False, "error": f"seconds 需为 1~{MAX_PROFILE_SECONDS}"}, status=400
+        )
+    output = request.query.get("format", "json")
+    if output not in ("json", "text", "collapsed"):
+        return _json_response({"ok": False, "error": "format 仅支持 json / text / collapsed"}, status=400)
+    if profiler_running():
+        return _json_response({"ok": False, "error": "profile_in_progress"}, status=409)
+
+    try:
+        result = await profile_event_loop(seconds)
+    except RuntimeError:
+        return _json_response({"ok": False, "error": "profile_in_progress"}, status=409)
+    logger.info("http_api_profile_completed", token=token.name, samples=result.samples)
+
+    if output == "collapsed":
+        response = web.Response(text=result.collapsed(), content_type="text/plain")
+        response.headers["Content-Disposition"] = (
+            f'attachment; filename="profile-{time.strftime("%Y%m%d-%H%M%S")}.collapsed.txt"'
+        )
+        return response
+    if output == "text":
+        return web.Response(text=result.format_text() + "\n", content_type="text/plain")
+    return _json_response(
+        {
+            "ok": True,
+            "seconds": round(result.seconds, 2),
+            "interval_ms": result.interval * 1000,
+            "samples": result.samples,
+            "busy_samples": result.busy_samples,
+            "top": [
+                {"function": label, "cumulative_samples": cumulative, "self_samples": own}
+                for label, cumulative, own in result.top_functions(30)
+            ],
+        }
+    )
+
+
 def create_app() -> web.Application:
-    app = web.Application(middlewares=[_cors_middleware])
+    app = web.Application(middlewares=[_cors_middleware, _auth_middleware])
+    app[API_TOKENS_KEY] = _build_token_index()
     app.router.add_get("/", index_handler)
     app.router.add_get("/healthz", health_handler)
+    app.router.add_get("/livez", liveness_handler)
+    app.router.add_get("/readyz", readiness_handler)
+    app.router.add_get("/metrics", metrics_handler)
     app.router.add_get("/api/pansou/search", search_handler)
     app.router.add_post("/api/pansou/search", search_handler)
     app.router.add_options("/api/pansou/search", search_handler)
+    app.router.add_get("/api/pansou/search/stream", stream_search_handler)
+    app.router.add_options("/api/pansou/search/stream", stream_search_handler)
+    app.router.add_post("/api/pansou/search/batch", batch_search_handler)
+    app.router.add_options("/api/pansou/search/batch", batch_search_handler)
+    app.router.add_get("/api/debug/profile", profile_handler)
+    app.on_response_prepare.append(_apply_rate_limit_headers)
+    app.on_response_prepare.append(_apply_request_id_header)
+    app.on_startup.append(_start_background_tasks)
     app.on_cleanup.append(_close_client)
     return app
@@ -1,42 +1,233 @@
 """
 日志配置模块
+
+Bot、HTTP API 和单进程入口共用同一套配置：
+- 调用方线程只做级别过滤、采样和加时间戳，把事件字典放进有界队列；
+  低于日志级别的调用直接返回，不构造任何记录；
+- 渲染（JSON / 控制台格式、异常堆栈）和写 stdout 都在后台线程完成，不阻塞事件循环；
+  第三方库的标准库日志经同一队列输出；
+- 高频事件按 LOG_SAMPLE_RATES 采样，保留的记录带 sample_rate 字段便于还原数量；
+- 队列满时直接丢弃并计入 log_records_dropped_total，而不是阻塞调用方。
 """
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Optional, TextIO
+
 import structlog
-from structlog.stdlib import LoggerFactory
-from structlog.processors import TimeStamper, add_log_level, JSONRenderer
+
 from config import settings
+from metrics import registry
 
+LOG_QUEUE_SIZE = 10000
+# 逐条输出 INFO 日志的第三方库：httpx 每次 Bot API 调用都会记录一行
+NOISY_LOGGERS = ("httpx", "httpcore")
 
-def setup_logging():
-    """配置结构化日志"""
-    
-    # 配置标准库日志
-    import logging
-    
-    logging.basicConfig(
-        format="%(message)s",
-        stream=sys.stdout,
-        level=getattr(logging, settings.log_level.upper()),
-    )
-    
-    # 配置 structlog
-    structlog.configure(
-        processors=[
-            add_log_level,
-            TimeStamper(fmt="iso"),
-            structlog.stdlib.filter_by_level,
+LOG_RECORDS_DROPPED = registry.counter("log_records_dropped_total", "日志队列已满被丢弃的记录数")
+
+# 进程内只有一个队列，重新配置时只替换后台线程，已缓存的 logger 仍然有效
+_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+_STOP = object()
+_writer: Optional["_LogWriter"] = None
+_writer_pid: Optional[int] = None
+
+
+def _enqueue(item: Any) -> None:
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        LOG_RECORDS_DROPPED.inc()
+
+
+class _QueueLogger:
+    """structlog 的输出端：处理链最后返回的事件字典原样放进队列。"""
+
+    def _put(self, **event_dict: Any) -> None:
+        _enqueue(event_dict)
+
+    debug = info = warning = warn = error = critical = exception = fatal = msg = _put
+
+
+def _queue_logger_factory(*_: Any) -> _QueueLogger:
+    return _QueueLogger()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """第三方库的标准库日志：不在调用方线程格式化，队列满时丢弃。"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        _enqueue(record)
+
+
+class _LogWriter(threading.Thread):
+    """后台线程：渲染队列中的事件，每批合并成一次写入。"""
+
+    def __init__(self, stream: TextIO, renderer: Any, formatter: logging.Formatter):
+        super().__init__(name="log-writer", daemon=True)
+        self.stream = stream
+        self.formatter = formatter
+        self.processors = (
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            renderer,
+        )
+
+    def _render(self, item: Any) -> str:
+        try:
+            if isinstance(item, logging.LogRecord):
+                return self.formatter.format(item)
+            for processor in self.processors:
+                item = processor(None, item.get("level", "info"), item)
+            return item
+        except Exception as exc:  # 单条渲染失败不影响其他日志
+            return f"log_render_failed: {exc!r}"
+
+    def run(self) -> None:
+        while True:
+            item = _queue.get()
+            lines = []
+            while item is not _STOP:
+                lines.append(self._render(item))
+                try:
+                    item = _queue.get_nowait()
+                except queue.Empty:
+                    break
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    pass
+            if item is _STOP:
+                return
+
+    def stop(self) -> None:
+        _queue.put(_STOP)
+        self.join(timeout=5)
+
+
+def _sampler(sample_rates: dict[str, float]):
+    def sample(_, __, event_dict: dict[str, Any]) -> dict[str, Any]:
+        rate = sample_rates.get(event_dict.get("event"))
+        if rate is None:
+            return event_dict
+        if random.random() >= rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
+    return sample
+
+
+def _resolve_exc_info(_, __, event_dict: dict[str, Any]) -> dict[str, Any]:
+    """exc_info=True 需要在调用方线程取出当前异常，后台线程里 sys.exc_info() 为空。"""
+    exc_info = event_dict.get("exc_info")
+    if exc_info is True:
+        event_dict["exc_info"] = sys.exc_info()
+    elif isinstance(exc_info, BaseException):
+        event_dict["exc_info"] = (type(exc_info), exc_info, exc_info.__traceback__)
+    return event_dict
+
+
+def _record_timestamp(_, __, event_dict: dict[str, Any]) -> dict[str, Any]:
+    """标准库日志使用记录创建时间，而不是后台线程渲染时间。"""
+    record = event_dict.get("_record")
+    if "timestamp" not in event_dict and record is not None:
+        event_dict["timestamp"] = datetime.fromtimestamp(record.created, timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+    return event_dict
+
+
+def _renderer(log_format: str):
+    if log_format == "auto":
+        log_format = "console" if sys.stdout.isatty() else "json"
+    if log_format == "json":
+        return structlog.processors.JSONRenderer(ensure_ascii=False)
+    return structlog.dev.ConsoleRenderer()
+
+
+def log_queue_size() -> int:
+    """等待后台线程写出的日志条数。"""
+    return _queue.qsize()
+
+
+registry.register_callback("log_queue_depth", "等待后台线程写出的日志条数", log_queue_size)
+
+
+def stop_logging() -> None:
+    """写完队列中剩余的日志并停止后台线程。"""
+    global _writer
+    # fork 出的子进程继承了 _writer，但线程只存在于父进程
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.stop()
+    _writer = None
+
+
+def setup_logging(
+    *,
+    stream: Optional[TextIO] = None,
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    sample_rates: Optional[dict[str, float]] = None,
+) -> None:
+    """配置结构化日志；重复调用会替换之前的配置，fork 出的 worker 需要重新调用以启动自己的后台线程。
+
+    已经缓存的 logger（首次使用后）沿用当时的级别和采样配置。
+    """
+    global _writer, _writer_pid
+    level_no = getattr(logging, (level or settings.log_level).upper())
+    sample_rates = settings.log_sample_rates if sample_rates is None else sample_rates
+    renderer = _renderer(log_format or settings.log_format)
+
+    formatter = structlog.stdlib.ProcessorFormatter(
+        foreign_pre_chain=[
             structlog.stdlib.add_logger_name,
             structlog.stdlib.add_log_level,
-            structlog.stdlib.PositionalArgumentsFormatter(),
-            structlog.processors.StackInfoRenderer(),
+            _record_timestamp,
+        ],
+        processors=[
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
             structlog.processors.format_exc_info,
             structlog.processors.UnicodeDecoder(),
-            JSONRenderer() if settings.log_level.upper() == "INFO" else structlog.dev.ConsoleRenderer(),
+            renderer,
+        ],
+    )
+
+    stop_logging()
+    _writer = _LogWriter(stream or sys.stdout, renderer, formatter)
+    _writer_pid = os.getpid()
+    _writer.start()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_NonBlockingQueueHandler(_queue))
+    root.setLevel(level_no)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, level_no))
+
+    structlog.reset_defaults()
+    structlog.configure(
+        processors=[
+            _sampler(sample_rates),
+            structlog.processors.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.StackInfoRenderer(),
+            _resolve_exc_info,
         ],
         context_class=dict,
-        logger_factory=LoggerFactory(),
-        wrapper_class=structlog.stdlib.BoundLogger,
+        logger_factory=_queue_logger_factory,
+        wrapper_class=structlog.make_filtering_bound_logger(level_no),
         cache_logger_on_first_use=True,
     )
 
@@ -44,3 +235,6 @@ def setup_logging():
 def get_logger(name: str):
     """获取日志记录器"""
     return structlog.get_logger(name)
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,159 @@
+"""
+事件循环阻塞监控
+
+事件循环侧每 interval 秒心跳一次并把调度延迟写入 event_loop_lag_seconds；
+后台线程发现心跳超时超过阈值时，立即抓取事件循环线程的调用栈，
+等循环恢复后把阻塞时长、阻塞位置和调用栈写入日志。
+同一阻塞位置在 report_interval 秒内只记录一次，其余计入 suppressed。
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Optional
+
+from structlog import get_logger
+
+from config import settings
+from metrics import EVENT_LOOP_LAG, registry
+from profiler import is_idle_frame
+
+logger = get_logger()
+
+HEARTBEAT_INTERVAL = 0.1
+MAX_STACK_FRAMES = 30
+# /metrics 中按最近一段时间估算的延迟分位数
+LAG_QUANTILES = (0.5, 0.95, 0.99)
+LAG_QUANTILE_WINDOW = 60
+
+_SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EVENT_LOOP_BLOCKED = registry.counter(
+    "event_loop_blocked_total", "事件循环阻塞超过阈值的次数", rolling=True
+)
+registry.register_callback(
+    "event_loop_lag_recent_seconds",
+    f"最近 {LAG_QUANTILE_WINDOW} 秒事件循环调度延迟分位数",
+    lambda: {
+        str(q): EVENT_LOOP_LAG.window.quantile(q, LAG_QUANTILE_WINDOW) or 0.0 for q in LAG_QUANTILES
+    },
+    ("quantile",),
+)
+
+
+def _is_loop_frame(filename: str) -> bool:
+    return filename.endswith((os.sep + "base_events.py", os.sep + "events.py")) and "asyncio" in filename
+
+
+def _extract_stack(frame: FrameType) -> traceback.StackSummary:
+    """只保留事件循环正在执行的回调以内的帧（从外到内）。"""
+    stack = traceback.StackSummary.extract(traceback.walk_stack(frame), lookup_lines=False)
+    stack.reverse()
+    start = 0
+    for index, summary in enumerate(stack):
+        if _is_loop_frame(summary.filename):
+            start = index + 1
+    frames = list(stack)[start:] or list(stack)[-1:]
+    return traceback.StackSummary.from_list(frames[-MAX_STACK_FRAMES:])
+
+
+def _call_site(stack: traceback.StackSummary) -> str:
+    """阻塞位置：调用栈中最内层的项目代码帧，没有则取最内层帧。"""
+    for summary in reversed(stack):
+        if summary.filename.startswith(_SRC_DIR):
+            break
+    else:
+        summary = stack[-1]
+    return f"{os.path.basename(summary.filename)}:{summary.lineno} {summary.name}"
+
+
+class LoopWatchdog:
+    """心跳 + 看门狗线程；stall 只在看门狗线程写、事件循环侧读后清空。"""
+
+    def __init__(
+        self,
+        threshold: float,
+        report_interval: float,
+        interval: float = HEARTBEAT_INTERVAL,
+    ):
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.interval = interval
+        self._deadline = 0.0
+        self._stall: Optional[tuple[float, traceback.StackSummary]] = None
+        self._reported: dict[str, tuple[float, int]] = {}
+        self._stop = threading.Event()
+
+    def _watch(self, loop_thread: int) -> None:
+        check_interval = min(self.threshold / 2, 0.05)
+        captured_deadline = 0.0
+        while not self._stop.wait(check_interval):
+            deadline = self._deadline
+            if deadline == captured_deadline or time.perf_counter() - deadline < self.threshold:
+                continue
+            captured_deadline = deadline
+            frame = sys._current_frames().get(loop_thread)
+            # 循环仍在 selector 上等待说明不是单个回调阻塞（例如大量短回调排队）
+            if frame is None or is_idle_frame(frame):
+                continue
+            try:
+                self._stall = (deadline, _extract_stack(frame))
+            finally:
+                del frame
+
+    def _report(self, lag: float, stack: Optional[traceback.StackSummary]) -> None:
+        EVENT_LOOP_BLOCKED.inc()
+        call_site = _call_site(stack) if stack else "unknown"
+        now = time.monotonic()
+        last_reported, suppressed = self._reported.get(call_site, (0.0, 0))
+        if now - last_reported < self.report_interval:
+            self._reported[call_site] = (last_reported, suppressed + 1)
+            return
+        self._reported[call_site] = (now, 0)
+        # 位置很多时丢弃早已过了限速窗口的记录，避免无限增长
+        if len(self._reported) > 256:
+            self._reported = {
+                site: state for site, state in self._reported.items() if now - state[0] < self.report_interval
+            }
+        logger.warning(
+            "event_loop_blocked",
+            lag_ms=round(lag * 1000, 1),
+            call_site=call_site,
+            suppressed=suppressed,
+            stack="".join(stack.format()) if stack else None,
+        )
+
+    async def run(self) -> None:
+        watcher = threading.Thread(
+            target=self._watch,
+            args=(threading.get_ident(),),
+            name="event-loop-watchdog",
+            daemon=True,
+        )
+        watcher.start()
+        try:
+            while True:
+                self._deadline = time.perf_counter() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.perf_counter() - self._deadline)
+                EVENT_LOOP_LAG.observe(lag)
+
+                stall, self._stall = self._stall, None
+                if lag >= self.threshold:
+                    stack = stall[1] if stall and stall[0] == self._deadline else None
+                    self._report(lag, stack)
+        finally:
+            self._stop.set()
+
+
+async def monitor_event_loop_lag() -> None:
+    """按配置启动事件循环阻塞监控，直到任务被取消。"""
+    await LoopWatchdog(
+        threshold=settings.loop_lag_threshold_ms / 1000,
+        report_interval=settings.loop_lag_report_interval,
+    ).run()
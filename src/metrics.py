@@ -0,0 +1,387 @@
+"""
+运行指标
+
+提供计数器、直方图和采集回调，按 Prometheus 文本格式输出，不依赖第三方库；
+安装了 prometheus_client 时会额外附带其默认注册表中的进程/GC 指标。
+热路径上的记录只是一次字典累加（直方图多一次二分查找）。
+声明 rolling=True 的指标还会按时间片滚动累加，供 /stats 查看最近 1 分钟 / 15 分钟 / 1 小时的数据。
+"""
+from __future__ import annotations
+
+import os
+import resource
+import sys
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable, Optional
+
+from aiohttp import web
+from structlog import get_logger
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover - 可选依赖
+    prometheus_client = None
+
+logger = get_logger()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# 滚动窗口：10 秒一个时间片，最多保留 1 小时
+WINDOW_SLOT_SECONDS = 10
+WINDOW_SPAN_SECONDS = 3600
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[Any, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class RollingCounter:
+    """按时间片滚动累加，只保留最近 span 秒，内存占用固定。"""
+
+    __slots__ = ("slot_seconds", "_slot_ids", "_values")
+
+    def __init__(self, span: float = WINDOW_SPAN_SECONDS, slot_seconds: float = WINDOW_SLOT_SECONDS):
+        size = max(1, int(span // slot_seconds))
+        self.slot_seconds = slot_seconds
+        self._slot_ids = [-1] * size
+        self._values = [0.0] * size
+
+    def inc(self, amount: float = 1, now: Optional[float] = None) -> None:
+        slot = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        index = slot % len(self._values)
+        if self._slot_ids[index] != slot:
+            self._slot_ids[index] = slot
+            self._values[index] = 0.0
+        self._values[index] += amount
+
+    def sum(self, window: float, now: Optional[float] = None) -> float:
+        """最近 window 秒（含当前未满的时间片）内的累计值。"""
+        current = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        oldest = current - max(1, int(window // self.slot_seconds)) + 1
+        return sum(
+            value for slot, value in zip(self._slot_ids, self._values) if oldest <= slot <= current
+        )
+
+
+class RollingHistogram:
+    """按时间片滚动的固定桶直方图，用于估算窗口内分位数。"""
+
+    __slots__ = ("buckets", "slot_seconds", "_slot_ids", "_states")
+
+    def __init__(
+        self,
+        buckets: tuple[float, ...],
+        span: float = WINDOW_SPAN_SECONDS,
+        slot_seconds: float = WINDOW_SLOT_SECONDS,
+    ):
+        size = max(1, int(span // slot_seconds))
+        self.buckets = buckets
+        self.slot_seconds = slot_seconds
+        self._slot_ids = [-1] * size
+        # 每个时间片：[各桶计数..., +Inf 桶计数, 最大值]
+        self._states = [[0.0] * (len(buckets) + 2) for _ in range(size)]
+
+    def observe(self, value: float, now: Optional[float] = None) -> None:
+        slot = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        index = slot % len(self._states)
+        state = self._states[index]
+        if self._slot_ids[index] != slot:
+            self._slot_ids[index] = slot
+            for i in range(len(state)):
+                state[i] = 0.0
+        state[bisect_left(self.buckets, value)] += 1
+        if value > state[-1]:
+            state[-1] = value
+
+    def _merge(self, window: float, now: Optional[float]) -> list[float]:
+        current = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        oldest = current - max(1, int(window // self.slot_seconds)) + 1
+        merged = [0.0] * (len(self.buckets) + 2)
+        for slot, state in zip(self._slot_ids, self._states):
+            if oldest <= slot <= current:
+                for i in range(len(merged) - 1):
+                    merged[i] += state[i]
+                merged[-1] = max(merged[-1], state[-1])
+        return merged
+
+    def count(self, window: float, now: Optional[float] = None) -> int:
+        return int(sum(self._merge(window, now)[:-1]))
+
+    def quantile(self, q: float, window: float, now: Optional[float] = None) -> Optional[float]:
+        """在命中的桶内线性插值估算分位数；落在 +Inf 桶时返回窗口内最大值。"""
+        merged = self._merge(window, now)
+        total = sum(merged[:-1])
+        if not total:
+            return None
+        target = q * total
+        cumulative = 0.0
+        for i, bound in enumerate(self.buckets):
+            count = merged[i]
+            if count and cumulative + count >= target:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = min(bound, merged[-1])
+                return lower + (max(upper, lower) - lower) * (target - cumulative) / count
+            cumulative += count
+        return merged[-1]
+
+
+class Counter:
+    """单调递增计数器。"""
+
+    type_name = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        rolling: bool = False,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._windows: Optional[dict[tuple, RollingCounter]] = {} if rolling else None
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+        if self._windows is not None:
+            window = self._windows.get(labels)
+            if window is None:
+                window = self._windows[labels] = RollingCounter()
+            window.inc(amount)
+
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0)
+
+    def window_sum(self, window: float, *labels: Any) -> float:
+        """最近 window 秒内指定标签的增量，未声明 rolling 时返回 0。"""
+        rolling = self._windows.get(labels) if self._windows is not None else None
+        return rolling.sum(window) if rolling is not None else 0.0
+
+    def window_total(self, window: float) -> float:
+        """最近 window 秒内所有标签的增量之和。"""
+        if self._windows is None:
+            return 0.0
+        return sum(rolling.sum(window) for rolling in self._windows.values())
+
+    def collect(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """固定桶直方图，按标签分别统计。"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        rolling: bool = False,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各桶计数..., 总和, 总数]
+        self._values: dict[tuple, list[float]] = {}
+        # 滚动窗口不区分标签
+        self.window: Optional[RollingHistogram] = RollingHistogram(self.buckets) if rolling else None
+
+    def observe(self, value: float, *labels: Any) -> None:
+        state = self._values.get(labels)
+        if state is None:
+            state = [0] * (len(self.buckets) + 2)
+            self._values[labels] = state
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+        if self.window is not None:
+            self.window.observe(value)
+
+    def collect(self) -> Iterable[str]:
+        bucket_names = self.labelnames + ("le",)
+        for labels, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(bucket_names, labels + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(bucket_names, labels + ('+Inf',))} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}"
+
+
+class CallbackMetric:
+    """采集时才调用回调取值，适合队列深度、已有统计字典等现成数据。"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Any],
+        labelnames: tuple[str, ...] = (),
+        type_name: str = "gauge",
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = labelnames
+        self.type_name = type_name
+
+    def collect(self) -> Iterable[str]:
+        value = self.callback()
+        # 回调可以返回单个数值，或 {标签值元组: 数值}
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, sample in items:
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(sample)}"
+
+
+class MetricsRegistry:
+    """指标注册表，同名指标重复注册时返回已有实例。"""
+
+    def __init__(self):
+        self._metrics: dict[str, Any] = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        rolling: bool = False,
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, rolling))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        rolling: bool = False,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets, rolling))
+
+    def register_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Any],
+        labelnames: tuple[str, ...] = (),
+        type_name: str = "gauge",
+    ) -> None:
+        """注册（或替换）采集回调。"""
+        self._metrics[name] = CallbackMetric(name, documentation, callback, labelnames, type_name)
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式。"""
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.collect())
+            except Exception as exc:
+                logger.warning("metrics_collect_failed", metric=metric.name, error=str(exc))
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(samples)
+
+        text = "\n".join(lines) + "\n"
+        if prometheus_client is not None:
+            text += prometheus_client.generate_latest().decode("utf-8")
+        return text
+
+
+registry = MetricsRegistry()
+
+# 上游 pansou
+SEARCH_REQUESTS = registry.counter(
+    "pansou_search_requests_total", "PansouClient 搜索调用次数", rolling=True
+)
+UPSTREAM_LATENCY = registry.histogram(
+    "pansou_upstream_request_seconds", "pansou 上游搜索请求耗时", ("status",), rolling=True
+)
+UPSTREAM_ERRORS = registry.counter(
+    "pansou_upstream_errors_total", "pansou 上游搜索失败次数", ("status",), rolling=True
+)
+RESULT_CACHE = registry.counter(
+    "pansou_result_cache_total", "PansouClient 结果缓存事件", ("event",), rolling=True
+)
+INFLIGHT_JOINS = registry.counter(
+    "pansou_inflight_joins_total", "加入进行中上游请求的搜索次数", rolling=True
+)
+
+# Telegram
+TELEGRAM_API_LATENCY = registry.histogram(
+    "telegram_api_request_seconds", "Telegram Bot API 调用耗时", ("method",)
+)
+
+# 事件循环
+EVENT_LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds", "事件循环调度延迟", buckets=LOOP_LAG_BUCKETS, rolling=True
+)
+
+
+def process_rss_bytes() -> Optional[int]:
+    """当前进程常驻内存；非 Linux 平台退化为峰值常驻内存。"""
+    try:
+        with open(f"/proc/{os.getpid()}/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (AttributeError, ValueError):
+        return None
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def metrics_handler(_: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """在当前事件循环里启动只提供 /metrics 的小型 HTTP 服务，返回 runner 供关闭。"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logger.info("metrics_server_started", host=host, port=port)
+    return runner
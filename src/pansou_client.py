@@ -14,9 +14,16 @@ import httpx
 from structlog import get_logger
 
 from config import settings
+from shared_cache import SharedResultCache
+from metrics import INFLIGHT_JOINS, RESULT_CACHE, SEARCH_REQUESTS, UPSTREAM_ERRORS, UPSTREAM_LATENCY, registry
+from timing import current_request_id, stage
 
 logger = get_logger()
 
+# 跨进程单飞：等待其他 worker 结果的轮询间隔，以及在搜索超时之外额外等待的秒数
+SHARED_POLL_INTERVAL = 0.05
+SHARED_WAIT_GRACE = 5.0
+
 CLOUD_TYPE_NAMES = {
     "baidu": "百度网盘",
     "aliyun": "阿里云盘",
@@ -104,8 +111,10 @@ class PansouClient:
         self.result_cache_size = 128
         self.health_cache_ttl = 10
         self.service_info_cache_ttl = 30
-        self._result_cache: OrderedDict[str, tuple[float, Dict[str, Any]]] = OrderedDict()
+        # 缓存键 -> (time.monotonic 过期时间, 结果, 版本)；版本为墙钟过期时间，多 worker 间一致
+        self._result_cache: OrderedDict[str, tuple[float, Dict[str, Any], float]] = OrderedDict()
         self._inflight_searches: Dict[str, asyncio.Task] = {}
+        self._shared_cache: Optional[SharedResultCache] = None
         self._health_cache_value: Optional[bool] = None
         self._health_cache_expires_at = 0.0
         self._health_check_task: Optional[asyncio.Task] = None
@@ -338,28 +347,158 @@ class PansouClient:
         )
         return repr(key)
 
-    def _get_cached_result(self, cache_key: str) -> Optional[Dict[str, Any]]:
-        """获取缓存结果。"""
+    def search_cache_key(
+        self,
+        keyword: str,
+        channels: Optional[List[str]] = None,
+        plugins: Optional[List[str]] = None,
+        cloud_types: Optional[List[str]] = None,
+        source_type: Optional[str] = None,
+        filter_config: Optional[dict] = None,
+        limit: int = 10,
+    ) -> str:
+        """返回与 search() 一致的普通（非强制刷新）搜索缓存键。"""
+        return self._make_search_cache_key(
+            keyword=keyword,
+            channels=channels,
+            plugins=plugins,
+            cloud_types=cloud_types,
+            source_type=source_type,
+            filter_config=filter_config,
+            limit=limit,
+            force_refresh=False,
+        )
+
+    async def get_cached_by_key(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """按缓存键读取未过期的结果，不发起上游请求，也不计入缓存命中率；本进程未命中时再查共享缓存。"""
+        result = self._get_cached_result(cache_key)
+        if result is None and self._shared_cache is not None:
+            result = await self._load_shared_result(cache_key)
+        return result
+
+    def enable_shared_cache(self, path: str) -> None:
+        """启用跨进程共享缓存，多 worker 模式下每个 worker 在 fork 后调用。"""
+        self._shared_cache = SharedResultCache(path)
+        logger.info("shared_cache_enabled", path=path)
+
+    async def _load_shared_result(self, cache_key: str, record_metrics: bool = False) -> Optional[Dict[str, Any]]:
+        """从共享缓存读取结果并按共享过期时间写入本地缓存，保证各 worker 的缓存版本一致；只有 search 路径计入命中率。"""
+        shared = await self._shared_cache.get(cache_key)
+        if shared is None:
+            return None
+        result, wall_expires_at = shared
+        if record_metrics:
+            RESULT_CACHE.inc("shared_hit")
+        self._store_cached_result(cache_key, result, wall_expires_at)
+        return result
+
+    @staticmethod
+    def _to_monotonic(wall_time: float) -> float:
+        return time.monotonic() + (wall_time - time.time())
+
+    async def _execute_shared_search(
+        self,
+        cache_key: str,
+        force_refresh: bool,
+        **request_kwargs: Any,
+    ) -> Dict[str, Any]:
+        """跨进程单飞：拿到锁的进程请求上游并写共享缓存，其余进程轮询等待结果。"""
+        shared = self._shared_cache
+        if not force_refresh:
+            with stage("shared_cache_read"):
+                result = await self._load_shared_result(cache_key, record_metrics=True)
+            if result is not None:
+                return result
+
+        deadline = time.monotonic() + self.timeout + SHARED_WAIT_GRACE
+        while True:
+            if await shared.try_lock(cache_key, self.timeout + SHARED_WAIT_GRACE):
+                try:
+                    return await self._fetch_and_share(cache_key, **request_kwargs)
+                finally:
+                    await shared.unlock(cache_key)
+
+            with stage("shared_wait"):
+                await asyncio.sleep(SHARED_POLL_INTERVAL)
+                result = await self._load_shared_result(cache_key, record_metrics=True)
+            if result is not None:
+                INFLIGHT_JOINS.inc()
+                return result
+            if time.monotonic() >= deadline:
+                # 持锁进程迟迟没有结果，自行请求上游并写回共享缓存，其余等待者随后即可读到
+                logger.warning("shared_search_wait_timeout", keyword=request_kwargs.get("keyword"))
+                return await self._fetch_and_share(cache_key, **request_kwargs)
+
+    async def _fetch_and_share(self, cache_key: str, **request_kwargs: Any) -> Dict[str, Any]:
+        """请求上游，成功的结果写入共享缓存和本地缓存。"""
+        result = await self._execute_search_request(**request_kwargs)
+        if "error" not in result:
+            with stage("shared_cache_write"):
+                wall_expires_at = await self._shared_cache.set(cache_key, result, self.result_cache_ttl)
+            self._store_cached_result(cache_key, result, wall_expires_at)
+        return result
+
+    async def _run_search(self, cache_key: str, force_refresh: bool, **request_kwargs: Any) -> Dict[str, Any]:
+        """上游请求任务：结果写入本地缓存，与调用方是否还在等待无关。"""
+        if self._shared_cache is not None:
+            return await self._execute_shared_search(cache_key, force_refresh, **request_kwargs)
+
+        result = await self._execute_search_request(**request_kwargs)
+        if "error" not in result:
+            self._store_cached_result(cache_key, result)
+        return result
+
+    def cache_expires_at(self, cache_key: str) -> Optional[float]:
+        """返回结果缓存条目的过期时间（time.monotonic 时钟），未缓存时返回 None。"""
+        cached = self._result_cache.get(cache_key)
+        return cached[0] if cached else None
+
+    @property
+    def inflight_count(self) -> int:
+        """本进程正在进行的上游搜索数（相同搜索合并后只计一次）。"""
+        return len(self._inflight_searches)
+
+    def cache_version(self, cache_key: str) -> Optional[float]:
+        """返回结果缓存条目的版本，未缓存时返回 None；同一份结果在各 worker 中版本相同，重新搜索后改变。"""
+        cached = self._result_cache.get(cache_key)
+        return cached[2] if cached else None
+
+    def _get_cached_result(self, cache_key: str, record_metrics: bool = False) -> Optional[Dict[str, Any]]:
+        """获取缓存结果；只有 search 传入 record_metrics=True 计入缓存命中率，游标翻页等查找不计。"""
         cached = self._result_cache.get(cache_key)
         if not cached:
+            if record_metrics:
+                RESULT_CACHE.inc("miss")
             return None
 
-        expires_at, result = cached
+        expires_at, result, _ = cached
         now = time.monotonic()
         if now >= expires_at:
             self._result_cache.pop(cache_key, None)
+            if record_metrics:
+                RESULT_CACHE.inc("expired")
             return None
 
         self._result_cache.move_to_end(cache_key)
+        if record_metrics:
+            RESULT_CACHE.inc("hit")
         return result
 
-    def _store_cached_result(self, cache_key: str, result: Dict[str, Any]) -> None:
-        """写入缓存结果。"""
-        self._result_cache[cache_key] = (time.monotonic() + self.result_cache_ttl, result)
+    def _store_cached_result(
+        self,
+        cache_key: str,
+        result: Dict[str, Any],
+        wall_expires_at: Optional[float] = None,
+    ) -> None:
+        """写入缓存结果；wall_expires_at 为墙钟过期时间（同时作为版本），默认按 result_cache_ttl 计算。"""
+        if wall_expires_at is None:
+            wall_expires_at = time.time() + self.result_cache_ttl
+        self._result_cache[cache_key] = (self._to_monotonic(wall_expires_at), result, wall_expires_at)
         self._result_cache.move_to_end(cache_key)
 
         while len(self._result_cache) > self.result_cache_size:
             self._result_cache.popitem(last=False)
+            RESULT_CACHE.inc("eviction")
 
     async def _execute_search_request(
         self,
@@ -371,42 +510,71 @@ class PansouClient:
     ) -> Dict[str, Any]:
         """执行真实搜索请求。"""
         for attempt in range(max_retries):
+            started = time.perf_counter()
             try:
                 client = await self._get_client()
-                response = await client.post(url, json=payload, timeout=self.timeout)
+                with stage("upstream_http"):
+                    response = await client.post(url, json=payload, timeout=self.timeout)
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, response.status_code)
                 response.raise_for_status()
-                data = response.json()
-                result = self._normalize_search_result(data)
+                with stage("json_decode"):
+                    data = response.json()
+                with stage("normalize"):
+                    result = self._normalize_search_result(data)
                 if "error" in result:
                     return result
 
                 if filter_config and result.get("merged_by_type"):
-                    result["merged_by_type"] = self._apply_filter(
-                        result["merged_by_type"],
-                        filter_config
-                    )
-                    result["total"] = sum(
-                        len(links) for links in result["merged_by_type"].values()
-                    )
+                    with stage("filter"):
+                        result["merged_by_type"] = self._apply_filter(
+                            result["merged_by_type"],
+                            filter_config
+                        )
+                        result["total"] = sum(
+                            len(links) for links in result["merged_by_type"].values()
+                        )
 
                 return result
 
             except (httpx.ConnectError, httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+                status = "timeout" if isinstance(e, httpx.TimeoutException) else "network"
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, status)
+                UPSTREAM_ERRORS.inc(status)
                 if attempt < max_retries - 1:
                     wait_time = min(0.5 * (2 ** attempt), 5.0)
-                    logger.warning("search_retry", keyword=keyword, attempt=attempt + 1, wait=wait_time, error=str(e))
-                    await asyncio.sleep(wait_time)
+                    logger.warning(
+                        "search_retry",
+                        keyword=keyword,
+                        attempt=attempt + 1,
+                        wait=wait_time,
+                        error=str(e),
+                        request_id=current_request_id(),
+                    )
+                    with stage("retry_backoff"):
+                        await asyncio.sleep(wait_time)
                     continue
 
-                logger.error("search_failed_after_retries", keyword=keyword, error=str(e))
+                logger.error(
+                    "search_failed_after_retries",
+                    keyword=keyword,
+                    error=str(e),
+                    request_id=current_request_id(),
+                )
                 if isinstance(e, httpx.TimeoutException):
                     return {"error": "搜索超时，请稍后重试"}
                 return {"error": "网络连接失败，请稍后重试"}
             except httpx.HTTPStatusError as e:
-                logger.error("search_http_error", status=e.response.status_code, detail=str(e))
+                UPSTREAM_ERRORS.inc(e.response.status_code)
+                logger.error(
+                    "search_http_error",
+                    status=e.response.status_code,
+                    detail=str(e),
+                    request_id=current_request_id(),
+                )
                 return {"error": f"搜索服务错误: HTTP {e.response.status_code}"}
             except Exception as e:
-                logger.error("search_exception", error=str(e))
+                UPSTREAM_ERRORS.inc("exception")
+                logger.error("search_exception", error=str(e), request_id=current_request_id())
                 return {"error": f"搜索出错: {str(e)}"}
 
     async def search(
@@ -424,6 +592,7 @@ class PansouClient:
         """
         搜索网盘资源（指数退避重试）
         """
+        SEARCH_REQUESTS.inc()
         url = f"{self.base_url}/api/search"
         
         payload = {
@@ -456,7 +625,8 @@ class PansouClient:
         )
 
         if not force_refresh:
-            cached_result = self._get_cached_result(cache_key)
+            with stage("cache_lookup"):
+                cached_result = self._get_cached_result(cache_key, record_metrics=True)
             if cached_result is not None:
                 logger.debug("search_cache_hit", keyword=keyword)
                 return cached_result
@@ -464,10 +634,15 @@ class PansouClient:
         inflight_task = self._inflight_searches.get(cache_key)
         if inflight_task:
             logger.debug("search_join_inflight", keyword=keyword)
-            return await inflight_task
+            INFLIGHT_JOINS.inc()
+            # shield：单个调用方被取消（如内联查询被新输入取代）时不影响共享的上游请求
+            with stage("inflight_wait"):
+                return await asyncio.shield(inflight_task)
 
         task = asyncio.create_task(
-            self._execute_search_request(
+            self._run_search(
+                cache_key,
+                force_refresh,
                 url=url,
                 payload=payload,
                 keyword=keyword,
@@ -476,14 +651,22 @@ class PansouClient:
             )
         )
         self._inflight_searches[cache_key] = task
-
-        try:
-            result = await task
-            if "error" not in result:
-                self._store_cached_result(cache_key, result)
-            return result
-        finally:
+        task.add_done_callback(lambda done: self._finish_search(cache_key, done))
+        # 上游任务创建时复制了当前上下文，其内部各阶段会记到同一个计时器
+        with stage("fetch"):
+            return await asyncio.shield(task)
+
+    def _finish_search(self, cache_key: str, task: asyncio.Task) -> None:
+        """上游请求结束后移除 in-flight 记录。"""
+        if self._inflight_searches.get(cache_key) is task:
             self._inflight_searches.pop(cache_key, None)
+        if not task.cancelled():
+            # 取走异常，避免所有调用方都已取消时出现未读取异常的告警
+            task.exception()
+
+    async def get_cached_search(self, keyword: str, **options: Any) -> Optional[Dict[str, Any]]:
+        """只查本进程和共享结果缓存，不发起上游请求，也不计入缓存命中率；options 同 search_cache_key，未命中返回 None。"""
+        return await self.get_cached_by_key(self.search_cache_key(keyword, **options))
     
     def _apply_filter(
         self, 
@@ -531,6 +714,8 @@ class PansouClient:
     def clear_runtime_cache(self) -> None:
         """清理搜索和健康检查缓存。"""
         self._result_cache.clear()
+        if self._shared_cache is not None:
+            self._shared_cache.clear()
         self._health_cache_value = None
         self._health_cache_expires_at = 0.0
         self._service_info_cache_value = None
@@ -674,6 +859,34 @@ class PansouClient:
         buttons.sort(key=lambda x: x["count"], reverse=True)
         return buttons
     
+    def iter_links_by_count(self, results: Dict[str, Any]):
+        """按网盘类型结果数降序逐条产出 (cloud_type, link)，与分类按钮顺序一致。"""
+        merged_by_type = results.get("merged_by_type", {})
+        for button in self.get_type_buttons(results):
+            for link in merged_by_type.get(button["type"], []):
+                yield button["type"], link
+
+    def format_link_message(self, link: Dict[str, Any], keyword: str, cloud_type: str) -> str:
+        """格式化单条资源消息（内联模式发送到会话中的内容）。"""
+        type_name = CLOUD_TYPE_NAMES.get(cloud_type, cloud_type)
+        icon = CLOUD_TYPE_ICONS.get(cloud_type, "📁")
+        note = link.get("note", "")
+        clean_note = self._escape_html(note) if note else "无标题"
+        lines = [
+            f"{icon} <b>{clean_note}</b>",
+            f"📁 {self._escape_html(type_name)} · 🔍 {self._escape_html(keyword)}",
+        ]
+        clean_link = self._format_link_html(link.get("url", ""))
+        if clean_link:
+            lines.append(f"🔗 {clean_link}")
+        password = link.get("password", "")
+        if password:
+            lines.append(f"🔑 密码: <code>{self._escape_html(password)}</code>")
+        source = link.get("source", "")
+        if source:
+            lines.append(f"📌 来源: {self._escape_html(source)}")
+        return "\n".join(lines)
+
     def format_overview(self, results: Dict[str, Any], keyword: str) -> str:
         """
         格式化搜索结果概览
@@ -832,3 +1045,9 @@ class PansouClient:
 
 # 全局客户端实例
 pansou_client = PansouClient()
+
+registry.register_callback(
+    "pansou_inflight_searches",
+    "正在进行的上游搜索数",
+    lambda: pansou_client.inflight_count,
+)
@@ -0,0 +1,166 @@
+"""
+事件循环采样分析
+
+在后台线程里按固定间隔读取事件循环线程的调用栈（sys._current_frames），
+不需要重启进程，也不给被采样的代码加钩子，开销只有采样线程本身。
+结果可以输出累计耗时最高的函数，或输出 flamegraph.pl / speedscope 可用的 collapsed stack 文本。
+同一进程同一时间只允许一次采样。
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import Optional
+
+from structlog import get_logger
+
+logger = get_logger()
+
+DEFAULT_PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 60
+DEFAULT_INTERVAL = 0.01
+MAX_STACK_DEPTH = 128
+
+_running = False
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def is_idle_frame(frame: FrameType) -> bool:
+    """事件循环阻塞在 selector 上等待 IO 时视为空闲。"""
+    code = frame.f_code
+    return code.co_name in ("select", "poll", "control") and code.co_filename.endswith("selectors.py")
+
+
+def _is_loop_internal(label: str) -> bool:
+    return " (base_events.py:" in label or " (events.py:" in label
+
+
+@dataclass
+class ProfileResult:
+    """一次采样的结果；stacks 中的调用栈按从外到内排列。"""
+
+    seconds: float
+    interval: float
+    samples: int = 0
+    idle_samples: int = 0
+    stacks: Counter = field(default_factory=Counter)
+
+    @property
+    def busy_samples(self) -> int:
+        return self.samples - self.idle_samples
+
+    def top_functions(self, limit: int = 15) -> list[tuple[str, int, int]]:
+        """按累计（含子调用）采样数排序的 (函数, 累计, 自身) 列表；只统计事件循环回调以内的帧。"""
+        cumulative: Counter = Counter()
+        own: Counter = Counter()
+        for stack, count in self.stacks.items():
+            start = 0
+            for index, label in enumerate(stack):
+                if _is_loop_internal(label):
+                    start = index + 1
+            frames = stack[start:] or stack[-1:]
+            own[frames[-1]] += count
+            for label in set(frames):
+                cumulative[label] += count
+        return [(label, count, own[label]) for label, count in cumulative.most_common(limit)]
+
+    def collapsed(self) -> str:
+        """collapsed stack 格式：每行 `外层;...;内层 采样数`，包含空闲样本。"""
+        lines = [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+        if self.idle_samples:
+            lines.append(f"<idle> {self.idle_samples}")
+        return "\n".join(lines) + "\n"
+
+    def format_text(self, limit: int = 15) -> str:
+        lines = [
+            f"采样 {self.seconds:.1f}s，间隔 {self.interval * 1000:.0f}ms，"
+            f"共 {self.samples} 个样本，忙碌 {self.busy_samples / self.samples:.0%}" if self.samples
+            else f"采样 {self.seconds:.1f}s，没有采到样本",
+        ]
+        if self.busy_samples:
+            lines.append(f"{'累计':>6} {'自身':>6}  函数")
+            for label, cumulative, own in self.top_functions(limit):
+                lines.append(
+                    f"{cumulative / self.busy_samples:>6.1%} {own / self.busy_samples:>6.1%}  {label}"
+                )
+        return "\n".join(lines)
+
+
+def _sample(target_thread: int, result: ProfileResult, stop: threading.Event) -> None:
+    while not stop.wait(result.interval):
+        frame = sys._current_frames().get(target_thread)
+        if frame is None:
+            continue
+        result.samples += 1
+        if is_idle_frame(frame):
+            result.idle_samples += 1
+            continue
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        stack.reverse()
+        result.stacks[tuple(stack)] += 1
+
+
+def is_running() -> bool:
+    return _running
+
+
+async def profile_event_loop(seconds: float, interval: float = DEFAULT_INTERVAL) -> ProfileResult:
+    """对当前事件循环采样 seconds 秒；已有采样进行中时抛出 RuntimeError。"""
+    global _running
+    if _running:
+        raise RuntimeError("已有采样在进行中")
+    seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+    _running = True
+    result = ProfileResult(seconds=seconds, interval=interval)
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=_sample,
+        args=(threading.get_ident(), result, stop),
+        name="event-loop-profiler",
+        daemon=True,
+    )
+    started = time.monotonic()
+    logger.info("profile_started", seconds=seconds, interval=interval)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        # stop.wait 会被立即唤醒，最多等待正在进行的一次采样
+        sampler.join(timeout=1)
+        _running = False
+    result.seconds = time.monotonic() - started
+    logger.info(
+        "profile_finished",
+        seconds=round(result.seconds, 2),
+        samples=result.samples,
+        idle_samples=result.idle_samples,
+    )
+    return result
+
+
+def parse_profile_seconds(value: Optional[str]) -> Optional[float]:
+    """解析采样时长，缺省为 DEFAULT_PROFILE_SECONDS；非法或超出 1~MAX_PROFILE_SECONDS 时返回 None。"""
+    if value is None or value == "":
+        return float(DEFAULT_PROFILE_SECONDS)
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        return None
+    return seconds
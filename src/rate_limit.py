@@ -0,0 +1,318 @@
+"""
+搜索限流模块
+
+基于 GCRA（通用信元速率算法）实现，每个 key 只保存一个浮点数（理论到达时间），
+可以支撑数十万 key；同时提供用户、群组、全局三级预算，供 Bot 和 HTTP API 共用。
+"""
+from __future__ import annotations
+
+import math
+import time
+from datetime import datetime, timezone
+from typing import Hashable, Optional
+
+from structlog import get_logger
+
+from config import ApiTokenConfig, settings
+from metrics import RollingCounter, registry
+from shared_cache import SharedTokenUsage
+
+logger = get_logger()
+
+# 每累计多少次检查做一次过期 key 清理
+SWEEP_INTERVAL = 4096
+
+
+class GCRALimiter:
+    """单级 GCRA 限流器：每个 key 只保存一个理论到达时间。"""
+
+    def __init__(self, limit: int, window_seconds: float = 60, burst: Optional[int] = None):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.burst = burst or limit
+        self.emission_interval = window_seconds / limit
+        self.tolerance = self.emission_interval * (self.burst - 1)
+        self._tat: dict[Hashable, float] = {}
+        self._checks = 0
+
+    def peek(self, key: Hashable, now: float) -> tuple[bool, float, float]:
+        """计算一次请求是否放行，返回 (是否放行, 新理论到达时间, 需等待秒数)，不修改状态。"""
+        return self.evaluate(self._tat.get(key), now)
+
+    def evaluate(self, tat: Optional[float], now: float) -> tuple[bool, float, float]:
+        """与 peek 相同，但理论到达时间由调用方给出，供状态保存在共享存储中时使用。"""
+        tat = now if tat is None else max(tat, now)
+        allow_at = tat - self.tolerance
+        if now < allow_at:
+            return False, tat, allow_at - now
+        return True, tat + self.emission_interval, 0.0
+
+    def commit(self, key: Hashable, new_tat: float, now: float) -> None:
+        """记录一次已放行的请求。"""
+        self._tat[key] = new_tat
+        self._checks += 1
+        if self._checks >= SWEEP_INTERVAL:
+            self._checks = 0
+            self._sweep(now)
+
+    def check(self, key: Hashable, now: Optional[float] = None) -> tuple[bool, int]:
+        """检查并消耗一次配额。"""
+        now = time.monotonic() if now is None else now
+        allowed, new_tat, wait = self.peek(key, now)
+        if not allowed:
+            return False, max(1, math.ceil(wait))
+        self.commit(key, new_tat, now)
+        return True, 0
+
+    def remaining(self, key: Hashable, now: float) -> int:
+        """当前还能立即放行的请求数。"""
+        return self.remaining_for(self._tat.get(key), now)
+
+    def remaining_for(self, tat: Optional[float], now: float) -> int:
+        tat = now if tat is None else max(tat, now)
+        return max(0, math.floor((now - (tat - self.tolerance)) / self.emission_interval) + 1)
+
+    def reset_after(self, key: Hashable, now: float) -> int:
+        """距离配额完全恢复的秒数。"""
+        return self.reset_after_for(self._tat.get(key), now)
+
+    def reset_after_for(self, tat: Optional[float], now: float) -> int:
+        return max(0, math.ceil((now if tat is None else tat) - now))
+
+    def _sweep(self, now: float) -> None:
+        """移除理论到达时间已过去的 key；它们与全新 key 等价，移除不会重置任何人的配额。"""
+        expired = [key for key, tat in self._tat.items() if tat <= now]
+        for key in expired:
+            del self._tat[key]
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def clear(self) -> int:
+        count = len(self._tat)
+        self._tat.clear()
+        return count
+
+
+class SearchRateLimiter:
+    """用户 / 群组 / 全局三级搜索限流，任意一级超限即拒绝，且被拒绝的请求不消耗其他级配额。"""
+
+    GLOBAL_KEY = "global"
+
+    def __init__(
+        self,
+        user_limit: int,
+        chat_limit: int,
+        global_limit: int,
+        window_seconds: float = 60,
+        inline_user_limit: Optional[int] = None,
+    ):
+        self.user = GCRALimiter(user_limit, window_seconds)
+        # 内联查询使用独立的用户级预算，边输入边搜索不会占用 /search 的配额
+        self.inline_user = GCRALimiter(inline_user_limit or user_limit, window_seconds)
+        self.chat = GCRALimiter(chat_limit, window_seconds)
+        self.global_ = GCRALimiter(global_limit, window_seconds)
+        self.rejections = {"user": 0, "inline": 0, "chat": 0, "global": 0}
+        self.recent_rejections = RollingCounter()
+
+    def check(
+        self,
+        user_key: Optional[Hashable],
+        chat_key: Optional[Hashable] = None,
+        inline: bool = False,
+    ) -> tuple[bool, int]:
+        """检查一次搜索是否放行，返回 (是否放行, 建议等待秒数)；user_key 为 None 时只检查群组和全局。
+
+        inline 为 True 时用户级改用内联查询预算，全局级仍与普通搜索共用。
+        """
+        now = time.monotonic()
+        levels = []
+        if user_key is not None:
+            if inline:
+                levels.append(("inline", self.inline_user, user_key))
+            else:
+                levels.append(("user", self.user, user_key))
+        if chat_key is not None:
+            levels.append(("chat", self.chat, chat_key))
+        levels.append(("global", self.global_, self.GLOBAL_KEY))
+
+        pending = []
+        for name, limiter, key in levels:
+            allowed, new_tat, wait = limiter.peek(key, now)
+            if not allowed:
+                self.rejections[name] += 1
+                self.recent_rejections.inc()
+                return False, max(1, math.ceil(wait))
+            pending.append((limiter, key, new_tat))
+
+        for limiter, key, new_tat in pending:
+            limiter.commit(key, new_tat, now)
+        return True, 0
+
+    def tracked_keys(self) -> int:
+        return len(self.user) + len(self.inline_user) + len(self.chat) + len(self.global_)
+
+    def clear(self) -> int:
+        """清空限流记录，返回清理的 key 数量。"""
+        count = self.user.clear() + self.inline_user.clear() + self.chat.clear()
+        self.global_.clear()
+        return count
+
+
+class ApiTokenLimiter:
+    """HTTP API 按令牌限流：每分钟速率、并发上限和每日配额，每次请求 O(1)。
+
+    默认状态保存在本进程内存中；多 worker 模式下调用 enable_shared_state 后改存共享 SQLite，
+    所有 worker 共用同一份配额，每日计数也不会因滚动重启而清零。
+    """
+
+    def __init__(self):
+        self._rate: dict[str, GCRALimiter] = {}
+        self._active: dict[str, int] = {}
+        self._daily: dict[str, tuple[str, int]] = {}
+        self._shared: Optional[SharedTokenUsage] = None
+        # 在共享存储中登记过并发占用、尚未释放的请求数
+        self._shared_active: dict[str, int] = {}
+        self.rejections = {"rate": 0, "concurrency": 0, "daily": 0}
+
+    def enable_shared_state(self, path: str) -> None:
+        """改用多进程共享的计数，多 worker 模式下每个 worker 在 fork 后调用。"""
+        self._shared = SharedTokenUsage(path)
+        logger.info("api_token_shared_state_enabled", path=path)
+
+    def _get_rate_limiter(self, token: ApiTokenConfig) -> GCRALimiter:
+        limiter = self._rate.get(token.name)
+        if limiter is None or limiter.limit != token.rate_per_minute:
+            limiter = GCRALimiter(token.rate_per_minute, 60)
+            self._rate[token.name] = limiter
+        return limiter
+
+    def _evaluate(
+        self,
+        token: ApiTokenConfig,
+        limiter: GCRALimiter,
+        tat: Optional[float],
+        day: str,
+        used_today: int,
+        active: int,
+        now: float,
+        utc_now: datetime,
+    ) -> tuple[tuple[Optional[str], int, dict[str, str]], Optional[tuple[float, str, int]]]:
+        """根据给定计数判断一次请求，返回 ((拒绝原因, 建议等待秒数, 限流响应头), 放行后的新计数)，不修改任何状态。"""
+        today = utc_now.strftime("%Y-%m-%d")
+        if day != today:
+            used_today = 0
+
+        headers = {
+            "X-RateLimit-Limit": str(token.rate_per_minute),
+            "X-RateLimit-Remaining": str(limiter.remaining_for(tat, now)),
+            "X-RateLimit-Reset": str(limiter.reset_after_for(tat, now)),
+        }
+        if token.daily_quota:
+            headers["X-RateLimit-Daily-Limit"] = str(token.daily_quota)
+            headers["X-RateLimit-Daily-Remaining"] = str(max(0, token.daily_quota - used_today))
+
+        if active >= token.max_concurrent:
+            return ("concurrency", 1, headers), None
+
+        if token.daily_quota and used_today >= token.daily_quota:
+            seconds_to_midnight = 86400 - (utc_now.hour * 3600 + utc_now.minute * 60 + utc_now.second)
+            return ("daily", seconds_to_midnight, headers), None
+
+        allowed, new_tat, wait = limiter.evaluate(tat, now)
+        if not allowed:
+            return ("rate", max(1, math.ceil(wait)), headers), None
+
+        used_today += 1
+        headers["X-RateLimit-Remaining"] = str(limiter.remaining_for(new_tat, now))
+        headers["X-RateLimit-Reset"] = str(limiter.reset_after_for(new_tat, now))
+        if token.daily_quota:
+            headers["X-RateLimit-Daily-Remaining"] = str(max(0, token.daily_quota - used_today))
+        return (None, 0, headers), (new_tat, today, used_today)
+
+    async def acquire(self, token: ApiTokenConfig) -> tuple[bool, int, dict[str, str]]:
+        """尝试占用一次请求配额，返回 (是否放行, 建议等待秒数, 限流响应头)。"""
+        limiter = self._get_rate_limiter(token)
+        shared = None
+        if self._shared is not None:
+            # 共享模式使用墙钟时间，各进程的理论到达时间才可比较
+            shared = await self._shared.acquire(
+                token.name,
+                lambda tat, day, used, active: self._evaluate(
+                    token, limiter, tat, day, used, active, time.time(), datetime.now(timezone.utc)
+                ),
+            )
+
+        if shared is not None:
+            (reason, retry_after, headers), allowed = shared
+            if allowed:
+                self._shared_active[token.name] = self._shared_active.get(token.name, 0) + 1
+        else:
+            # 未启用共享存储，或共享层不可用时退化为本进程计数
+            now = time.monotonic()
+            day, used_today = self._daily.get(token.name, ("", 0))
+            (reason, retry_after, headers), state = self._evaluate(
+                token,
+                limiter,
+                limiter._tat.get(token.name),
+                day,
+                used_today,
+                self._active.get(token.name, 0),
+                now,
+                datetime.now(timezone.utc),
+            )
+            if state is not None:
+                new_tat, today, used_today = state
+                limiter.commit(token.name, new_tat, now)
+                self._daily[token.name] = (today, used_today)
+
+        if reason is not None:
+            self.rejections[reason] += 1
+            return False, retry_after, headers
+        self._active[token.name] = self._active.get(token.name, 0) + 1
+        return True, 0, headers
+
+    def release(self, token: ApiTokenConfig) -> None:
+        """请求结束后释放并发占用；共享计数的释放提交到执行器后立即返回。"""
+        active = self._active.get(token.name, 0) - 1
+        if active > 0:
+            self._active[token.name] = active
+        else:
+            self._active.pop(token.name, None)
+
+        shared_active = self._shared_active.get(token.name, 0)
+        if shared_active > 0:
+            if shared_active > 1:
+                self._shared_active[token.name] = shared_active - 1
+            else:
+                del self._shared_active[token.name]
+            self._shared.release(token.name)
+
+    def active_requests(self) -> dict[str, int]:
+        """本进程进行中的请求数。"""
+        return dict(self._active)
+
+
+# 全局共享实例，Bot 与 HTTP API 共用
+search_rate_limiter = SearchRateLimiter(
+    user_limit=settings.rate_limit_per_minute,
+    chat_limit=settings.chat_rate_limit_per_minute,
+    global_limit=settings.global_rate_limit_per_minute,
+    inline_user_limit=settings.inline_rate_limit_per_minute,
+)
+api_token_limiter = ApiTokenLimiter()
+
+registry.register_callback(
+    "search_rate_limit_rejections_total",
+    "搜索限流拒绝次数",
+    lambda: dict(search_rate_limiter.rejections),
+    ("level",),
+    type_name="counter",
+)
+registry.register_callback(
+    "http_api_token_rejections_total",
+    "HTTP API 令牌配额拒绝次数",
+    lambda: dict(api_token_limiter.rejections),
+    ("reason",),
+    type_name="counter",
+)
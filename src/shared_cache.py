@@ -0,0 +1,261 @@
+"""
+跨进程共享结果缓存
+
+多 worker 模式下各进程通过同一个 SQLite（WAL 模式）文件共享搜索结果，
+并用带过期时间的锁行实现跨进程单飞：同一关键词同时只有一个进程请求上游，
+其余进程轮询等待结果写入；HTTP API 令牌的速率、并发和每日配额计数也存放在同一文件中。
+所有 SQLite 调用都在每个进程专用的单线程执行器中完成，连接也只在该线程里打开，
+其他 worker 持有写锁时的 busy_timeout 等待不会阻塞事件循环。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, Callable, Optional
+
+from structlog import get_logger
+
+logger = get_logger()
+
+# 每写入多少次结果顺带清理一次过期行
+PURGE_INTERVAL = 256
+
+
+class _SharedSqliteStore:
+    """共享 SQLite 存储的基类：每个进程一个单线程执行器和一条连接，owner 为当前进程号。"""
+
+    SCHEMA: tuple[str, ...] = ()
+    THREAD_NAME = "shared-sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 1.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.owner = f"{os.getpid()}"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # fork 之后父进程的执行器线程和连接都不可用，各进程重新创建
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.THREAD_NAME)
+            self._executor_pid = pid
+            self._conn = None
+            self.owner = f"{pid}"
+        return self._executor
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        """只在执行器线程中调用。"""
+        if self._conn is None:
+            self._conn = self._open()
+        return self._conn
+
+    def close(self) -> None:
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.submit(self._close_connection).result()
+            self._executor.shutdown()
+        self._executor = None
+        self._conn = None
+
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class SharedResultCache(_SharedSqliteStore):
+    """基于 SQLite 的跨进程结果缓存与单飞锁，过期时间使用墙钟时间；对外方法均为协程。"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS results ("
+        "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, payload TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS locks ("
+        "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)",
+    )
+    THREAD_NAME = "shared-cache"
+
+    def __init__(self, path: str, busy_timeout: float = 1.0):
+        super().__init__(path, busy_timeout)
+        self._writes = 0
+
+    async def get(self, key: str) -> Optional[tuple[dict[str, Any], float]]:
+        """读取未过期的结果，返回 (结果, 墙钟过期时间)。"""
+        return await self._run(self._get, key)
+
+    def _get(self, key: str) -> Optional[tuple[dict[str, Any], float]]:
+        try:
+            row = self._connect().execute(
+                "SELECT payload, expires_at FROM results WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("shared_cache_read_failed", error=str(exc))
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    async def set(self, key: str, result: dict[str, Any], ttl: float) -> float:
+        """写入结果，返回墙钟过期时间。"""
+        expires_at = time.time() + ttl
+        # 序列化在调用方完成，执行器线程只做 SQLite 写入
+        payload = json.dumps(result, ensure_ascii=False)
+        await self._run(self._set, key, payload, expires_at)
+        return expires_at
+
+    def _set(self, key: str, payload: str, expires_at: float) -> None:
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, expires_at, payload) VALUES (?, ?, ?)",
+                (key, expires_at, payload),
+            )
+            self._writes += 1
+            if self._writes >= PURGE_INTERVAL:
+                self._writes = 0
+                self.purge_expired()
+        except sqlite3.Error as exc:
+            logger.warning("shared_cache_write_failed", error=str(exc))
+
+    async def try_lock(self, key: str, lock_seconds: float) -> bool:
+        """尝试成为该 key 的上游请求方；锁过期后可被其他进程接管。"""
+        return await self._run(self._try_lock, key, lock_seconds)
+
+    def _try_lock(self, key: str, lock_seconds: float) -> bool:
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM locks WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO locks (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner, now + lock_seconds),
+            )
+        except sqlite3.Error as exc:
+            # 共享层不可用时退化为各进程自己请求上游
+            logger.warning("shared_cache_lock_failed", error=str(exc))
+            return True
+        return cursor.rowcount == 1
+
+    async def unlock(self, key: str) -> None:
+        await self._run(self._unlock, key)
+
+    def _unlock(self, key: str) -> None:
+        try:
+            self._connect().execute(
+                "DELETE FROM locks WHERE key = ? AND owner = ?",
+                (key, self.owner),
+            )
+        except sqlite3.Error as exc:
+            logger.warning("shared_cache_unlock_failed", error=str(exc))
+
+    def purge_expired(self) -> int:
+        """清理过期结果和锁，返回删除的结果条数；只在执行器线程中调用。"""
+        now = time.time()
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,)).rowcount
+        conn.execute("DELETE FROM locks WHERE expires_at <= ?", (now,))
+        return removed
+
+    def clear(self) -> Future:
+        """提交清空操作后立即返回，不等待写入完成。"""
+        return self._get_executor().submit(self._clear)
+
+    def _clear(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM results")
+        conn.execute("DELETE FROM locks")
+
+
+# 在事务内根据 (理论到达时间, 计数日期, 当日已用次数, 所有进程的进行中请求数) 做出决定，
+# 返回 (结果, 放行时要写回的 (理论到达时间, 日期, 已用次数)，拒绝时为 None)
+TokenDecision = Callable[[Optional[float], str, int, int], tuple[Any, Optional[tuple[float, str, int]]]]
+
+
+class SharedTokenUsage(_SharedSqliteStore):
+    """多 worker 共享的 HTTP API 令牌计数：速率与每日配额按令牌一行，并发按 (令牌, 进程) 一行。"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS token_usage ("
+        "name TEXT PRIMARY KEY, tat REAL, day TEXT NOT NULL, used INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS token_active ("
+        "name TEXT NOT NULL, owner TEXT NOT NULL, active INTEGER NOT NULL, PRIMARY KEY (name, owner))",
+    )
+    THREAD_NAME = "shared-tokens"
+
+    async def acquire(self, name: str, decide: TokenDecision) -> Optional[tuple[Any, bool]]:
+        """在写事务中读取计数、调用 decide 并写回，返回 (decide 的结果, 是否放行)；共享层不可用时返回 None。"""
+        return await self._run(self._acquire, name, decide)
+
+    def _acquire(self, name: str, decide: TokenDecision) -> Optional[tuple[Any, bool]]:
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tat, day, used FROM token_usage WHERE name = ?", (name,)).fetchone()
+                active = conn.execute(
+                    "SELECT COALESCE(SUM(active), 0) FROM token_active WHERE name = ?", (name,)
+                ).fetchone()[0]
+                tat, day, used = row if row is not None else (None, "", 0)
+                result, state = decide(tat, day, used, active)
+                if state is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO token_usage (name, tat, day, used) VALUES (?, ?, ?, ?)",
+                        (name, *state),
+                    )
+                    conn.execute(
+                        "INSERT INTO token_active (name, owner, active) VALUES (?, ?, 1) "
+                        "ON CONFLICT (name, owner) DO UPDATE SET active = active + 1",
+                        (name, self.owner),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as exc:
+            logger.warning("shared_token_usage_failed", error=str(exc))
+            return None
+        return result, state is not None
+
+    def release(self, name: str) -> Future:
+        """提交释放一次并发占用后立即返回，不等待写入完成。"""
+        return self._get_executor().submit(self._release, name)
+
+    def _release(self, name: str) -> None:
+        try:
+            self._connect().execute(
+                "UPDATE token_active SET active = active - 1 WHERE name = ? AND owner = ? AND active > 0",
+                (name, self.owner),
+            )
+        except sqlite3.Error as exc:
+            logger.warning("shared_token_release_failed", error=str(exc))
+
+    def clear_active(self, owner: Optional[str] = None) -> None:
+        """清除某个进程（默认全部进程）遗留的并发占用；同步执行，供没有事件循环的主进程在回收 worker 时调用。"""
+        try:
+            with closing(self._open()) as conn:
+                if owner is None:
+                    conn.execute("DELETE FROM token_active")
+                else:
+                    conn.execute("DELETE FROM token_active WHERE owner = ?", (owner,))
+        except sqlite3.Error as exc:
+            logger.warning("shared_token_clear_failed", error=str(exc))
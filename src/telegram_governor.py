@@ -0,0 +1,358 @@
+"""
+Telegram 出站调用流控
+
+包装 PTB 的请求对象，在真正调用 Bot API 之前统一排队：
+- 全局令牌桶（默认约 30 次/秒）
+- 按会话令牌桶（群组默认约 20 次/分钟，私聊约 1 次/秒）
+- 按优先级调度：结果编辑优先于消息删除
+- 自动处理 429 RetryAfter 并重试
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Optional
+
+from structlog import get_logger
+from telegram.request import BaseRequest, RequestData
+
+from metrics import TELEGRAM_API_LATENCY
+
+logger = get_logger()
+
+# 数值越小优先级越高
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EDIT = 1
+PRIORITY_SEND = 2
+PRIORITY_DELETE = 9
+
+# 只对这些 Bot API 方法做流控（Bot 会调用的发送 / 编辑 / 删除类方法）；
+# getUpdates、getMe、setMyCommands 等启动或轮询调用直接放行
+METHOD_PRIORITIES = {
+    "answerCallbackQuery": PRIORITY_INTERACTIVE,
+    "answerInlineQuery": PRIORITY_INTERACTIVE,
+    "editMessageText": PRIORITY_EDIT,
+    "editMessageReplyMarkup": PRIORITY_EDIT,
+    "sendMessage": PRIORITY_SEND,
+    # /profile 等管理员命令回复的文件
+    "sendDocument": PRIORITY_SEND,
+    "deleteMessage": PRIORITY_DELETE,
+    "deleteMessages": PRIORITY_DELETE,
+}
+
+# 回调/内联应答不计入会话配额，只占用全局配额
+CHAT_EXEMPT_METHODS = {"answerCallbackQuery", "answerInlineQuery"}
+
+MAX_RETRY_AFTER_ATTEMPTS = 3
+
+
+class TokenBucket:
+    """简单令牌桶，按单调时钟补充令牌。"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """返回距离下一个可用令牌的秒数，0 表示立即可用。"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """把令牌压成负数，实现 RetryAfter 期间的整体暂停。"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class TelegramFloodGovernor(BaseRequest):
+    """带全局/会话配额和优先级队列的 Bot API 请求包装器。"""
+
+    def __init__(
+        self,
+        inner: BaseRequest,
+        global_rate: float = 30,
+        group_rate_per_minute: float = 20,
+        private_rate: float = 1,
+        private_burst: float = 3,
+        max_chat_buckets: int = 4096,
+    ):
+        self._inner = inner
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._group_rate = group_rate_per_minute / 60
+        self._group_burst = group_rate_per_minute
+        self._private_rate = private_rate
+        self._private_burst = private_burst
+        self._max_chat_buckets = max_chat_buckets
+        self._chat_buckets: dict[Any, TokenBucket] = {}
+        # 每个会话一个按 (优先级, 序号) 排序的子队列；chat_id 为 None 的调用共用一个子队列
+        self._chat_queues: dict[Any, list[tuple[int, int, float, asyncio.Future]]] = {}
+        # 队首可以立即发送的会话，按队首的 (优先级, 序号) 排序；队首变化后旧条目作废
+        self._ready: list[tuple[int, int, Any]] = []
+        # 被会话配额卡住的会话，按可发送时间排序
+        self._blocked: list[tuple[float, int, Any]] = []
+        self._blocked_chats: set[Any] = set()
+        self._pending = 0
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {
+            "dispatched": 0,
+            "retry_after": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self._inner.initialize()
+
+    async def shutdown(self) -> None:
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+        self._dispatcher = None
+        for queue in self._chat_queues.values():
+            for *_, future in queue:
+                if not future.done():
+                    future.cancel()
+        self._chat_queues.clear()
+        self._ready.clear()
+        self._blocked.clear()
+        self._blocked_chats.clear()
+        self._pending = 0
+        await self._inner.shutdown()
+
+    @property
+    def queue_depth(self) -> int:
+        """当前排队中的调用数量。"""
+        return self._pending
+
+    def get_stats(self) -> dict[str, Any]:
+        """返回队列深度与等待时间统计。"""
+        dispatched = self._stats["dispatched"]
+        return {
+            "queue_depth": self.queue_depth,
+            "dispatched": dispatched,
+            "retry_after": self._stats["retry_after"],
+            "wait_avg": self._stats["wait_total"] / dispatched if dispatched else 0.0,
+            "wait_max": self._stats["wait_max"],
+            "chat_buckets": len(self._chat_buckets),
+        }
+
+    def _get_chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._max_chat_buckets:
+                self._evict_idle_buckets()
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            if is_group:
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._private_rate, self._private_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _evict_idle_buckets(self) -> None:
+        """回收已经补满的会话桶，补满说明它与新建桶等价。"""
+        now = time.monotonic()
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle(now)]
+        for chat_id in idle:
+            self._chat_buckets.pop(chat_id, None)
+
+    def _ensure_dispatcher(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def _acquire(self, priority: int, chat_id: Any) -> None:
+        """排队等待全局和会话配额。"""
+        future = asyncio.get_running_loop().create_future()
+        sequence = next(self._sequence)
+        entry = (priority, sequence, time.monotonic(), future)
+        queue = self._chat_queues.setdefault(chat_id, [])
+        heapq.heappush(queue, entry)
+        self._pending += 1
+        # 新条目成为队首时需要按新的优先级重新排入就绪堆；被卡住的会话等解除后再排
+        if queue[0] is entry and chat_id not in self._blocked_chats:
+            heapq.heappush(self._ready, (priority, sequence, chat_id))
+        self._ensure_dispatcher()
+        self._wakeup.set()
+        await future
+
+    def _schedule_head(self, chat_id: Any) -> None:
+        queue = self._chat_queues.get(chat_id)
+        if not queue:
+            self._chat_queues.pop(chat_id, None)
+            return
+        priority, sequence, *_ = queue[0]
+        heapq.heappush(self._ready, (priority, sequence, chat_id))
+
+    def _release_blocked(self, now: float) -> None:
+        while self._blocked and self._blocked[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._blocked)
+            self._blocked_chats.discard(chat_id)
+            self._schedule_head(chat_id)
+
+    def _pop_ready(self, now: float) -> Optional[tuple[Any, tuple[int, int, float, asyncio.Future]]]:
+        """取出优先级最高且会话配额允许的调用；每次只处理涉及的会话，与队列总长度无关。"""
+        while self._ready:
+            priority, sequence, chat_id = heapq.heappop(self._ready)
+            queue = self._chat_queues.get(chat_id)
+            if not queue or queue[0][:2] != (priority, sequence):
+                continue
+
+            if queue[0][3].done():
+                heapq.heappop(queue)
+                self._pending -= 1
+                self._schedule_head(chat_id)
+                continue
+
+            if chat_id is not None:
+                chat_wait = self._get_chat_bucket(chat_id).wait_time(now)
+                if chat_wait > 0:
+                    self._blocked_chats.add(chat_id)
+                    heapq.heappush(self._blocked, (now + chat_wait, sequence, chat_id))
+                    continue
+
+            entry = heapq.heappop(queue)
+            self._pending -= 1
+            self._schedule_head(chat_id)
+            return chat_id, entry
+        return None
+
+    async def _dispatch_loop(self) -> None:
+        """按优先级放行排队调用；被会话配额卡住的调用不阻塞其他会话。"""
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            global_wait = self._global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            self._release_blocked(now)
+            ready = self._pop_ready(now)
+            if ready is None:
+                self._wakeup.clear()
+                timeout = max(0.0, self._blocked[0][0] - now) if self._blocked else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            chat_id, (_, _, enqueued_at, future) = ready
+            self._global_bucket.consume(now)
+            if chat_id is not None:
+                self._get_chat_bucket(chat_id).consume(now)
+
+            waited = now - enqueued_at
+            self._stats["dispatched"] += 1
+            self._stats["wait_total"] += waited
+            self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+            future.set_result(None)
+
+    def _apply_retry_after(self, chat_id: Any, retry_after: float) -> None:
+        """按 Telegram 返回的 retry_after 暂停对应会话（或全局）配额。"""
+        now = time.monotonic()
+        self._stats["retry_after"] += 1
+        if chat_id is not None:
+            self._get_chat_bucket(chat_id).pause(now, retry_after)
+        else:
+            self._global_bucket.pause(now, retry_after)
+
+    @staticmethod
+    def _extract_retry_after(payload: bytes) -> Optional[float]:
+        try:
+            data = BaseRequest.parse_json_payload(payload)
+        except Exception:
+            return None
+        parameters = data.get("parameters") or {}
+        retry_after = parameters.get("retry_after")
+        return float(retry_after) if retry_after else None
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        priority = METHOD_PRIORITIES.get(api_method)
+
+        async def _send() -> tuple[int, bytes]:
+            started = time.perf_counter()
+            result = await self._inner.do_request(
+                url=url,
+                method=method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+            # getUpdates 是长轮询，耗时没有参考意义
+            if api_method != "getUpdates":
+                TELEGRAM_API_LATENCY.observe(time.perf_counter() - started, api_method)
+            return result
+
+        if priority is None:
+            return await _send()
+
+        chat_id = None
+        if request_data is not None and api_method not in CHAT_EXEMPT_METHODS:
+            chat_id = request_data.parameters.get("chat_id")
+
+        for attempt in range(MAX_RETRY_AFTER_ATTEMPTS):
+            await self._acquire(priority, chat_id)
+            code, payload = await _send()
+            if code != 429:
+                return code, payload
+
+            retry_after = self._extract_retry_after(payload)
+            if retry_after is None or attempt == MAX_RETRY_AFTER_ATTEMPTS - 1:
+                return code, payload
+
+            logger.warning(
+                "telegram_retry_after",
+                method=api_method,
+                chat_id=chat_id,
+                retry_after=retry_after,
+                attempt=attempt + 1,
+            )
+            self._apply_retry_after(chat_id, retry_after)
+
+        return code, payload
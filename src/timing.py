@@ -0,0 +1,102 @@
+"""
+搜索链路分阶段计时
+
+每个搜索请求创建一个 StageTimer，通过 contextvars 在 Bot / HTTP API 与
+PansouClient 之间传递（包括 PansouClient 创建的上游请求任务）。
+各阶段耗时写入 search_stage_seconds 直方图，请求结束时作为结构化字段写入日志。
+"""
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from metrics import registry
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SEARCH_STAGE_LATENCY = registry.histogram(
+    "search_stage_seconds",
+    "搜索链路各阶段耗时",
+    ("pipeline", "stage"),
+    buckets=STAGE_BUCKETS,
+)
+
+# 没有活动计时器时（如内联查询、批量搜索）PansouClient 阶段归到这个 pipeline
+UNTRACKED_PIPELINE = "other"
+
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("search_stage_timer", default=None)
+
+
+def new_request_id() -> str:
+    return os.urandom(6).hex()
+
+
+class StageTimer:
+    """记录一次请求各阶段耗时；同名阶段多次出现时累加。"""
+
+    __slots__ = ("pipeline", "request_id", "stages", "started_at")
+
+    def __init__(self, pipeline: str, request_id: Optional[str] = None):
+        self.pipeline = pipeline
+        self.request_id = request_id or new_request_id()
+        self.stages: dict[str, float] = {}
+        self.started_at = time.perf_counter()
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        SEARCH_STAGE_LATENCY.observe(seconds, self.pipeline, name)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @contextmanager
+    def active(self) -> Iterator["StageTimer"]:
+        """在代码块内设为当前上下文的计时器，退出时恢复之前的计时器。"""
+        token = _current_timer.set(self)
+        try:
+            yield self
+        finally:
+            _current_timer.reset(token)
+
+    def log_fields(self) -> dict[str, Any]:
+        """日志字段：request_id、总耗时和各阶段毫秒数（stage_<name>_ms）。"""
+        fields: dict[str, Any] = {
+            "request_id": self.request_id,
+            "total_ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+        }
+        for name, seconds in self.stages.items():
+            fields[f"stage_{name}_ms"] = round(seconds * 1000, 1)
+        return fields
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current_timer.get()
+
+
+def current_request_id() -> Optional[str]:
+    timer = _current_timer.get()
+    return timer.request_id if timer is not None else None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """记录到当前上下文的计时器；没有计时器时只写直方图。"""
+    timer = _current_timer.get()
+    if timer is not None:
+        with timer.stage(name):
+            yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SEARCH_STAGE_LATENCY.observe(time.perf_counter() - started, UNTRACKED_PIPELINE, name)
@@ -2,14 +2,24 @@
 用户设置管理模块
 支持每用户的搜索偏好设置
 """
+import asyncio
 import json
 import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, asdict
 from structlog import get_logger
 
+from config import settings as app_settings
+from metrics import registry
+
 logger = get_logger()
 
+SETTINGS_FLUSH_LATENCY = registry.histogram("user_settings_flush_seconds", "用户设置批量写入耗时")
+
 # 旧版默认网盘类型，历史用户如果保留这一组值，说明并未主动自定义筛选。
 LEGACY_DEFAULT_CLOUD_TYPES = [
     "baidu", "aliyun", "quark", "tianyi", "uc", "mobile",
@@ -135,13 +145,220 @@ class UserSettings:
         return "\n".join(lines)
 
 
+class DefaultUserSettings(UserSettings):
+    """所有未自定义用户共享的只读默认设置，从不落盘；修改前需通过 get_settings_for_update 取得副本"""
+    
+    def __post_init__(self):
+        super().__post_init__()
+        for name in ("cloud_types", "filter_include", "filter_exclude", "channels", "plugins"):
+            object.__setattr__(self, name, tuple(getattr(self, name)))
+        object.__setattr__(self, "_frozen", True)
+    
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("默认设置为只读，请通过 get_settings_for_update 获取可修改的副本")
+        super().__setattr__(name, value)
+
+
+DEFAULT_USER_SETTINGS = DefaultUserSettings(user_id=0)
+
+
+class SettingsBackend:
+    """用户设置存储后端接口"""
+    
+    def load(self, user_id: int) -> Optional[dict]:
+        """读取单个用户设置，不存在时返回 None"""
+        raise NotImplementedError
+    
+    def save_many(self, items: List[dict]) -> None:
+        """批量写入用户设置"""
+        raise NotImplementedError
+    
+    def delete_many(self, user_ids: List[int]) -> None:
+        """批量删除用户设置，不存在的用户忽略"""
+        raise NotImplementedError
+    
+    def close(self) -> None:
+        pass
+
+
+class JsonSettingsBackend(SettingsBackend):
+    """每个用户一个 user_{id}.json 文件"""
+    
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+    
+    def _get_settings_file(self, user_id: int) -> str:
+        """获取用户设置文件路径"""
+        return os.path.join(self.data_dir, f"user_{user_id}.json")
+    
+    def load(self, user_id: int) -> Optional[dict]:
+        settings_file = self._get_settings_file(user_id)
+        if not os.path.exists(settings_file):
+            return None
+        with open(settings_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def save_many(self, items: List[dict]) -> None:
+        for data in items:
+            with open(self._get_settings_file(data["user_id"]), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+    
+    def delete_many(self, user_ids: List[int]) -> None:
+        for user_id in user_ids:
+            try:
+                os.remove(self._get_settings_file(user_id))
+            except FileNotFoundError:
+                pass
+
+
+class SqliteSettingsBackend(SettingsBackend):
+    """SQLite（WAL）存储，按 user_id 主键查询，批量写入在一个事务内完成
+
+    连接在第一次读写时才打开。写入在线程池中进行并由写锁串行化；
+    读取使用每个线程自己的连接，借助 WAL 读写互不阻塞，不经过写锁。
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._write_lock = threading.Lock()
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._local = threading.local()
+        self._read_conns: List[sqlite3.Connection] = []
+    
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 只在创建它的线程中使用；关闭时可能在其他线程，因此不做线程检查
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_settings ("
+            "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return conn
+    
+    def _writer(self) -> sqlite3.Connection:
+        """只在持有写锁时调用"""
+        if self._write_conn is None:
+            self._write_conn = self._open()
+        return self._write_conn
+    
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+            self._read_conns.append(conn)
+        return conn
+    
+    def load(self, user_id: int) -> Optional[dict]:
+        row = self._reader().execute(
+            "SELECT data FROM user_settings WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_many(self, items: List[dict]) -> None:
+        now = time.time()
+        rows = [
+            (data["user_id"], json.dumps(data, ensure_ascii=False, separators=(",", ":")), now)
+            for data in items
+        ]
+        with self._write_lock:
+            conn = self._writer()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_settings (user_id, data, updated_at) VALUES (?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def delete_many(self, user_ids: List[int]) -> None:
+        with self._write_lock:
+            self._writer().executemany(
+                "DELETE FROM user_settings WHERE user_id = ?", [(user_id,) for user_id in user_ids]
+            )
+    
+    def import_json_dir(self, data_dir: str) -> int:
+        """一次性导入旧版 user_{id}.json 文件，已导入过则跳过；原文件保留不删除"""
+        with self._write_lock:
+            migrated = self._writer().execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+        if migrated:
+            return 0
+        
+        json_backend = JsonSettingsBackend(data_dir)
+        items = []
+        for name in os.listdir(data_dir) if os.path.isdir(data_dir) else []:
+            if not (name.startswith("user_") and name.endswith(".json")):
+                continue
+            try:
+                user_id = int(name[len("user_"):-len(".json")])
+                data = json_backend.load(user_id)
+            except (ValueError, OSError, json.JSONDecodeError) as e:
+                logger.warning("settings_migration_skipped", file=name, error=str(e))
+                continue
+            if data:
+                data["user_id"] = user_id
+                items.append(data)
+        
+        if items:
+            self.save_many(items)
+        with self._write_lock:
+            self._writer().execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (str(len(items)),),
+            )
+        logger.info("settings_migrated_from_json", count=len(items))
+        return len(items)
+    
+    def close(self) -> None:
+        with self._write_lock:
+            if self._write_conn is not None:
+                self._write_conn.close()
+                self._write_conn = None
+        for conn in self._read_conns:
+            conn.close()
+        self._read_conns.clear()
+        self._local = threading.local()
+
+
 class SettingsManager:
     """设置管理器"""
     
-    def __init__(self, data_dir: str = "./data"):
+    def __init__(
+        self,
+        data_dir: str = "./data",
+        backend: str = "json",
+        db_path: Optional[str] = None,
+        flush_delay: float = 0.5,
+        negative_cache_size: int = 100000,
+        cache_size: int = 10000,
+    ):
         self.data_dir = data_dir
-        self.settings_cache: Dict[int, UserSettings] = {}
+        # LRU：最近使用的放在末尾，超过 cache_size 时淘汰最久未用的
+        self.settings_cache: OrderedDict[int, UserSettings] = OrderedDict()
+        self.cache_size = cache_size
+        # 已确认没有保存过设置的用户，避免重复查询存储
+        self._missing_users: OrderedDict[int, None] = OrderedDict()
+        self.negative_cache_size = negative_cache_size
+        self.flush_delay = flush_delay
+        # 脏集合：user_id -> 待写入的设置对象（None 表示重置后待删除），同一用户多次修改只在刷盘时序列化一次；
+        # 条目在写入成功后才移除，写入期间被 LRU 淘汰的用户仍能从这里读到最新设置
+        self._dirty: Dict[int, Optional[UserSettings]] = {}
+        # user_id -> 修改次数，用于判断写入期间是否又有新修改
+        self._dirty_versions: Dict[int, int] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {"hit": 0, "miss": 0, "eviction": 0, "flushes": 0, "flushed_items": 0}
         self._ensure_data_dir()
+        self.backend = self._create_backend(backend, db_path)
     
     def _ensure_data_dir(self):
         """确保数据目录存在"""
@@ -149,50 +366,148 @@ class SettingsManager:
             os.makedirs(self.data_dir)
             logger.info("created_data_dir", path=self.data_dir)
     
-    def _get_settings_file(self, user_id: int) -> str:
-        """获取用户设置文件路径"""
-        return os.path.join(self.data_dir, f"user_{user_id}.json")
+    def _create_backend(self, backend: str, db_path: Optional[str]) -> SettingsBackend:
+        if backend == "sqlite":
+            return SqliteSettingsBackend(db_path or os.path.join(self.data_dir, "user_settings.sqlite3"))
+        return JsonSettingsBackend(self.data_dir)
+    
+    def migrate_from_json(self) -> int:
+        """SQLite 后端导入旧版 JSON 设置文件（只执行一次），返回导入条数；由 Bot 启动流程显式调用"""
+        if not isinstance(self.backend, SqliteSettingsBackend):
+            return 0
+        return self.backend.import_json_dir(self.data_dir)
+    
+    def _cache_put(self, settings: UserSettings):
+        self.settings_cache[settings.user_id] = settings
+        self.settings_cache.move_to_end(settings.user_id)
+        while len(self.settings_cache) > self.cache_size:
+            # 被淘汰的脏数据仍保留在脏集合里，刷盘前不会丢失
+            self.settings_cache.popitem(last=False)
+            self.stats["eviction"] += 1
     
     def get_settings(self, user_id: int) -> UserSettings:
-        """获取用户设置（优先从缓存）"""
-        if user_id in self.settings_cache:
-            return self.settings_cache[user_id]
+        """获取用户设置（优先从缓存）；没有自定义过的用户返回共享的只读默认设置"""
+        settings = self.settings_cache.get(user_id)
+        if settings is not None:
+            self.settings_cache.move_to_end(user_id)
+            self.stats["hit"] += 1
+            return settings
+        if user_id in self._missing_users:
+            self.stats["hit"] += 1
+            return DEFAULT_USER_SETTINGS
         
-        # 尝试从文件加载
-        settings_file = self._get_settings_file(user_id)
-        if os.path.exists(settings_file):
-            try:
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    settings = UserSettings.from_dict(data)
-                    if settings.cloud_types == LEGACY_DEFAULT_CLOUD_TYPES:
-                        settings.cloud_types = DEFAULT_CLOUD_TYPES.copy()
-                        self.save_settings(settings)
-                    self.settings_cache[user_id] = settings
-                    return settings
-            except Exception as e:
-                logger.error("load_settings_failed", user_id=user_id, error=str(e))
+        if user_id in self._dirty:
+            settings = self._dirty[user_id]
+            self.stats["hit"] += 1
+            if settings is None:
+                return DEFAULT_USER_SETTINGS
+            self._cache_put(settings)
+            return settings
         
-        # 创建默认设置
-        settings = UserSettings(user_id=user_id)
-        self.settings_cache[user_id] = settings
-        self.save_settings(settings)
+        # 从存储加载
+        self.stats["miss"] += 1
+        try:
+            data = self.backend.load(user_id)
+            if data is not None:
+                settings = UserSettings.from_dict(data)
+                self._cache_put(settings)
+                if settings.cloud_types == LEGACY_DEFAULT_CLOUD_TYPES:
+                    settings.cloud_types = DEFAULT_CLOUD_TYPES.copy()
+                    self.save_settings(settings)
+                return settings
+            self._remember_missing(user_id)
+        except Exception as e:
+            logger.error("load_settings_failed", user_id=user_id, error=str(e))
+        
+        return DEFAULT_USER_SETTINGS
+    
+    def get_settings_for_update(self, user_id: int) -> UserSettings:
+        """获取可修改的用户设置：默认设置在第一次修改时复制一份（写时复制）"""
+        settings = self.get_settings(user_id)
+        if settings is DEFAULT_USER_SETTINGS:
+            settings = UserSettings(user_id=user_id)
         return settings
     
+    def _remember_missing(self, user_id: int):
+        self._missing_users[user_id] = None
+        if len(self._missing_users) > self.negative_cache_size:
+            self._missing_users.popitem(last=False)
+    
     def save_settings(self, settings: UserSettings):
-        """保存用户设置"""
+        """保存用户设置：先更新缓存并标记为脏，写入在事件循环外批量完成"""
+        if isinstance(settings, DefaultUserSettings):
+            raise ValueError("共享默认设置不能直接保存，请通过 get_settings_for_update 获取副本")
+        self._missing_users.pop(settings.user_id, None)
+        self._cache_put(settings)
+        self._mark_dirty(settings.user_id, settings)
+    
+    def _mark_dirty(self, user_id: int, settings: Optional[UserSettings]):
+        """登记一次修改（settings 为 None 表示删除）并安排批量写入"""
+        self._dirty[user_id] = settings
+        self._dirty_versions[user_id] = self._dirty_versions.get(user_id, 0) + 1
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有事件循环（脚本、启动阶段）时直接同步写入
+            self.flush()
+            return
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._delayed_flush())
+    
+    async def _delayed_flush(self):
+        """等待一个批量窗口，把期间所有修改合并成一次写入"""
+        await asyncio.sleep(self.flush_delay)
+        await self.aflush()
+    
+    def _snapshot_dirty(self) -> tuple[List[dict], List[int], Dict[int, int]]:
+        """序列化当前所有脏数据，返回 (待写入的数据, 待删除的用户, 各用户的修改次数)；脏集合保持不变"""
+        items = [settings.to_dict() for settings in self._dirty.values() if settings is not None]
+        deleted = [user_id for user_id, settings in self._dirty.items() if settings is None]
+        versions = {user_id: self._dirty_versions[user_id] for user_id in self._dirty}
+        return items, deleted, versions
+    
+    def _mark_clean(self, versions: Dict[int, int]):
+        """写入成功后移除已写入的条目；写入期间又被修改的用户保留，等待下一次写入"""
+        for user_id, version in versions.items():
+            if self._dirty_versions.get(user_id) == version:
+                del self._dirty[user_id]
+                del self._dirty_versions[user_id]
+    
+    def _write_batch(self, items: List[dict], deleted: List[int]) -> bool:
+        started = time.perf_counter()
         try:
-            settings_file = self._get_settings_file(settings.user_id)
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings.to_dict(), f, ensure_ascii=False, indent=2)
-            self.settings_cache[settings.user_id] = settings
-            logger.info("settings_saved", user_id=settings.user_id)
+            if items:
+                self.backend.save_many(items)
+            if deleted:
+                self.backend.delete_many(deleted)
         except Exception as e:
-            logger.error("save_settings_failed", user_id=settings.user_id, error=str(e))
+            logger.error("save_settings_failed", count=len(items), deleted=len(deleted), error=str(e))
+            return False
+        SETTINGS_FLUSH_LATENCY.observe(time.perf_counter() - started)
+        self.stats["flushes"] += 1
+        self.stats["flushed_items"] += len(items) + len(deleted)
+        logger.info("settings_saved", count=len(items), deleted=len(deleted))
+        return True
+    
+    async def aflush(self):
+        """在线程池中写入所有脏数据；序列化在事件循环线程完成，避免与修改并发。写入失败时条目留在脏集合，下次保存时重试"""
+        items, deleted, versions = self._snapshot_dirty()
+        if not versions:
+            return
+        if await asyncio.get_running_loop().run_in_executor(None, self._write_batch, items, deleted):
+            self._mark_clean(versions)
+    
+    def flush(self):
+        """同步写入所有脏数据"""
+        items, deleted, versions = self._snapshot_dirty()
+        if versions and self._write_batch(items, deleted):
+            self._mark_clean(versions)
     
     def update_settings(self, user_id: int, **kwargs) -> UserSettings:
         """更新用户设置"""
-        settings = self.get_settings(user_id)
+        settings = self.get_settings_for_update(user_id)
         
         for key, value in kwargs.items():
             if hasattr(settings, key):
@@ -202,18 +517,56 @@ class SettingsManager:
         return settings
     
     def reset_settings(self, user_id: int) -> UserSettings:
-        """重置用户设置为默认"""
-        settings = UserSettings(user_id=user_id)
-        self.save_settings(settings)
-        self.settings_cache[user_id] = settings
-        return settings
+        """重置用户设置为默认：删除已保存的记录，之后重新共用只读默认设置"""
+        self.settings_cache.pop(user_id, None)
+        self._remember_missing(user_id)
+        self._mark_dirty(user_id, None)
+        return DEFAULT_USER_SETTINGS
 
     def clear_cache(self) -> int:
-        """清理内存中的设置缓存。"""
+        """清理内存中的设置缓存（不影响尚未写入的修改）。"""
         count = len(self.settings_cache)
         self.settings_cache.clear()
+        self._missing_users.clear()
         return count
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存与刷盘统计"""
+        lookups = self.stats["hit"] + self.stats["miss"]
+        return {
+            "cache_entries": len(self.settings_cache),
+            "cache_capacity": self.cache_size,
+            "negative_entries": len(self._missing_users),
+            "dirty": len(self._dirty),
+            "hit_ratio": round(self.stats["hit"] / lookups, 4) if lookups else 0.0,
+            **self.stats,
+        }
 
 
 # 全局设置管理器实例
-settings_manager = SettingsManager()
+settings_manager = SettingsManager(
+    data_dir=app_settings.data_dir,
+    backend=app_settings.settings_backend,
+    db_path=app_settings.settings_db_path,
+    flush_delay=app_settings.settings_flush_delay,
+    negative_cache_size=app_settings.settings_negative_cache_size,
+    cache_size=app_settings.settings_cache_size,
+)
+
+registry.register_callback(
+    "user_settings_cache_total",
+    "用户设置缓存事件",
+    lambda: {key: settings_manager.stats[key] for key in ("hit", "miss", "eviction")},
+    ("event",),
+    type_name="counter",
+)
+registry.register_callback(
+    "user_settings_cache_entries",
+    "用户设置缓存条目数",
+    lambda: len(settings_manager.settings_cache),
+)
+registry.register_callback(
+    "user_settings_dirty",
+    "等待写入的用户设置数",
+    lambda: len(settings_manager._dirty),
+)
@@ -0,0 +1,10 @@
+"""测试公共配置：与 scripts/smoke_test.py 一样把 src 加入导入路径并提供最小环境变量。"""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+os.environ.setdefault("TG_BOT_TOKEN", "UNIT_TEST_TOKEN_PLACEHOLDER")
+os.environ.setdefault("HTTP_API_TOKEN", "unit-test-token")
@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from rate_limit import SearchRateLimiter
+from user_settings import DEFAULT_USER_SETTINGS, UserSettings
+
+CHAT_ID = -100123
+RESULTS = {
+    "total": 1,
+    "merged_by_type": {"quark": [{"url": "https://pan.quark.cn/s/1", "note": "三体", "password": "", "source": "tg"}]},
+}
+
+
+class FakeChat:
+    """记录 Bot 在群组里发送和编辑的消息。"""
+
+    def __init__(self):
+        self.placeholders = []
+        self.edits = []
+        self.replies = []
+
+    def update(self, user_id):
+        chat = self
+
+        async def reply_text(text, **kwargs):
+            message_id = len(chat.placeholders) + 1
+            chat.placeholders.append(user_id)
+
+            async def edit_text(text, **kwargs):
+                chat.edits.append((message_id, text))
+
+            return SimpleNamespace(message_id=message_id, edit_text=edit_text)
+
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id),
+            effective_chat=SimpleNamespace(id=CHAT_ID),
+            message=SimpleNamespace(reply_text=reply_text),
+        )
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    fake_chat = FakeChat()
+
+    async def reply_with_auto_delete(update, text, **kwargs):
+        fake_chat.replies.append((update.effective_user.id, kwargs.get("reply_to_message_id")))
+
+    monkeypatch.setattr(bot, "reply_with_auto_delete", reply_with_auto_delete)
+    monkeypatch.setattr(bot, "schedule_message_deletion", lambda *args, **kwargs: None)
+    monkeypatch.setattr(bot, "search_rate_limiter", SearchRateLimiter(1000, 1000, 1000))
+    monkeypatch.setattr(bot.settings, "coalesce_chat_ids", str(CHAT_ID))
+    bot.coalesced_searches.clear()
+    bot.search_cache.clear()
+    yield fake_chat
+    bot.coalesced_searches.clear()
+    bot.search_cache.clear()
+
+
+def _slow_search(monkeypatch, results):
+    release = asyncio.Event()
+    calls = []
+
+    async def search(**kwargs):
+        calls.append(kwargs["keyword"])
+        await release.wait()
+        return results
+
+    monkeypatch.setattr(bot.pansou_client, "search", search)
+    return release, calls
+
+
+def test_searches_arriving_while_first_runs_are_merged(chat, monkeypatch):
+    async def scenario():
+        release, calls = _slow_search(monkeypatch, RESULTS)
+        first = asyncio.create_task(bot.perform_search(chat.update(1), None, "三体"))
+        await asyncio.sleep(0.01)
+        joiners = [asyncio.create_task(bot.perform_search(chat.update(uid), None, "三体")) for uid in (2, 3)]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(first, *joiners)
+        return calls
+
+    calls = asyncio.run(scenario())
+    assert calls == ["三体"]
+    # 只有首个搜索发送了占位消息，后来者回复指向首个结果
+    assert chat.placeholders == [1]
+    assert chat.replies == [(2, 1), (3, 1)]
+
+
+def test_failed_first_search_lets_waiters_search_normally(chat, monkeypatch):
+    async def scenario():
+        release, calls = _slow_search(monkeypatch, {"total": 0, "merged_by_type": {}})
+        first = asyncio.create_task(bot.perform_search(chat.update(1), None, "三体"))
+        await asyncio.sleep(0.01)
+        joiner = asyncio.create_task(bot.perform_search(chat.update(2), None, "三体"))
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(first, joiner)
+        return calls
+
+    calls = asyncio.run(scenario())
+    assert calls == ["三体", "三体"]
+    assert chat.placeholders == [1, 2]
+    assert chat.replies == []
+    assert len(bot.coalesced_searches) == 0
+
+
+def test_coalesce_key_ignores_container_types():
+    stored = UserSettings(user_id=1, cloud_types=[], plugins=[])
+    default_options = bot._resolve_search_options(DEFAULT_USER_SETTINGS)
+    stored_options = bot._resolve_search_options(stored)
+    assert bot._build_coalesce_key(CHAT_ID, "三体", default_options) == bot._build_coalesce_key(
+        CHAT_ID, "三体", stored_options
+    )
+    reordered = bot._resolve_search_options(UserSettings(user_id=1, filter_exclude=["b", "a"]))
+    sorted_filter = bot._resolve_search_options(UserSettings(user_id=2, filter_exclude=["a", "b"]))
+    assert bot._build_coalesce_key(CHAT_ID, "三体", reordered) == bot._build_coalesce_key(
+        CHAT_ID, "三体", sorted_filter
+    )
@@ -0,0 +1,283 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import bot
+import http_api
+from metrics import RESULT_CACHE, registry
+from pansou_client import pansou_client
+from rate_limit import SearchRateLimiter
+
+RESULTS = {
+    "total": 3,
+    "merged_by_type": {
+        "quark": [
+            {"url": "https://pan.quark.cn/s/1", "note": "三体 1", "password": "", "source": "tg"},
+            {"url": "https://pan.quark.cn/s/2", "note": "三体 2", "password": "", "source": "tg"},
+        ],
+        "baidu": [{"url": "https://pan.baidu.com/s/3", "note": "三体 3", "password": "abcd", "source": "tg"}],
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    monkeypatch.setattr(http_api, "search_rate_limiter", SearchRateLimiter(1000, 1000, 1000))
+    http_api.response_cache.clear()
+    pansou_client._result_cache.clear()
+    yield
+    http_api.response_cache.clear()
+    pansou_client._result_cache.clear()
+
+
+def _run(scenario):
+    app = web.Application()
+    app.router.add_get("/api/pansou/search", http_api.search_handler)
+    app.router.add_get("/api/pansou/search/stream", http_api.stream_search_handler)
+
+    async def main():
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client)
+
+    return asyncio.run(main())
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = [line for line in block.split("\n") if not line.startswith(":")]
+        if lines:
+            events.append(lines[0].removeprefix("event: "))
+    return events
+
+
+def test_stream_sends_events_in_order(monkeypatch):
+    async def fake_search(**kwargs):
+        return RESULTS
+
+    monkeypatch.setattr(pansou_client, "search", fake_search)
+
+    async def scenario(client):
+        response = await client.get("/api/pansou/search/stream", params={"kw": "三体", "limit": "10"})
+        return response.status, await response.text()
+
+    status, text = _run(scenario)
+    assert status == 200
+    assert _parse_sse(text) == ["accepted", "summary", "items", "items", "done"]
+
+
+def test_stream_sends_accepted_before_search_finishes(monkeypatch):
+    release = asyncio.Event()
+
+    async def slow_search(**kwargs):
+        await release.wait()
+        return RESULTS
+
+    monkeypatch.setattr(pansou_client, "search", slow_search)
+
+    async def scenario(client):
+        response = await client.get("/api/pansou/search/stream", params={"kw": "三体"})
+        first = await asyncio.wait_for(response.content.readuntil(b"\n\n"), timeout=2)
+        release.set()
+        await response.read()
+        return first
+
+    assert _run(scenario).startswith(b"event: accepted")
+
+
+def test_stream_reports_search_exception_as_error_event(monkeypatch):
+    async def broken_search(**kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(pansou_client, "search", broken_search)
+
+    async def scenario(client):
+        response = await client.get("/api/pansou/search/stream", params={"kw": "三体"})
+        return response.status, await response.text()
+
+    status, text = _run(scenario)
+    assert status == 200
+    assert _parse_sse(text) == ["accepted", "error"]
+    assert "boom" in text
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """让真实的 PansouClient.search 走缓存逻辑，只替换上游请求。"""
+    calls = []
+
+    async def fake_request(**kwargs):
+        calls.append(kwargs["keyword"])
+        return RESULTS
+
+    monkeypatch.setattr(pansou_client, "_execute_search_request", fake_request)
+    return calls
+
+
+def test_cursor_round_trip_keeps_exact_version():
+    cursor = {"k": "key", "v": 1760000000.123456789, "q": "三体", "o": 2, "n": 2, "t": None}
+    assert http_api._decode_cursor(http_api._encode_cursor(cursor)) == cursor
+    assert http_api._decode_cursor("not-a-cursor") is None
+
+
+def test_cursor_pages_through_cached_results(upstream):
+    async def scenario(client):
+        first = await (await client.get("/api/pansou/search", params={"kw": "三体", "limit": "2"})).json()
+        second = await (await client.get("/api/pansou/search", params={"cursor": first["next_cursor"]})).json()
+        return first, second
+
+    first, second = _run(scenario)
+    assert [item["url"] for item in first["items"]] == ["https://pan.quark.cn/s/1", "https://pan.quark.cn/s/2"]
+    assert second["offset"] == 2
+    assert [item["url"] for item in second["items"]] == ["https://pan.baidu.com/s/3"]
+    assert second["next_cursor"] is None
+    assert upstream == ["三体"]
+
+
+def test_cursor_expires_with_result_cache(upstream):
+    async def scenario(client):
+        first = await (await client.get("/api/pansou/search", params={"kw": "三体", "limit": "1"})).json()
+        pansou_client._result_cache.clear()
+        response = await client.get("/api/pansou/search", params={"cursor": first["next_cursor"]})
+        return response.status, await response.json()
+
+    status, payload = _run(scenario)
+    assert status == 410
+    assert payload["code"] == "cursor_expired"
+
+
+def test_cursor_rejects_refreshed_results(upstream):
+    async def scenario(client):
+        first = await (await client.get("/api/pansou/search", params={"kw": "三体", "limit": "1"})).json()
+        cache_key = http_api._decode_cursor(first["next_cursor"])["k"]
+        # 同一缓存键被新结果替换（哪怕只晚几毫秒）后，旧游标不能继续翻页
+        version = pansou_client.cache_version(cache_key)
+        pansou_client._store_cached_result(cache_key, RESULTS, version + 0.001)
+        response = await client.get("/api/pansou/search", params={"cursor": first["next_cursor"]})
+        return response.status
+
+    assert _run(scenario) == 410
+
+
+def test_invalid_cursor_is_bad_request():
+    async def scenario(client):
+        response = await client.get("/api/pansou/search", params={"cursor": "bad"})
+        return response.status
+
+    assert _run(scenario) == 400
+
+
+def test_etag_and_conditional_requests(upstream):
+    async def scenario(client):
+        first = await client.get("/api/pansou/search", params={"kw": "三体"})
+        etag = first.headers["ETag"]
+        again = await client.get("/api/pansou/search", params={"kw": "三体"}, headers={"If-None-Match": etag})
+        other = await client.get("/api/pansou/search", params={"kw": "三体"}, headers={"If-None-Match": '"other"'})
+        return first, etag, again.status, other.status
+
+    first, etag, again_status, other_status = _run(scenario)
+    assert first.status == 200
+    assert first.headers["Cache-Control"].startswith("max-age=")
+    assert again_status == 304
+    assert other_status == 200
+    assert upstream == ["三体"]
+
+
+def test_gzip_variant_has_its_own_etag(upstream, monkeypatch):
+    monkeypatch.setattr(http_api.settings, "http_api_compress_min_bytes", 0)
+
+    async def scenario(client):
+        plain = await client.get("/api/pansou/search", params={"kw": "三体"}, headers={"Accept-Encoding": "identity"})
+        gzipped = await client.get("/api/pansou/search", params={"kw": "三体"}, headers={"Accept-Encoding": "gzip"})
+        plain_body = await plain.json()
+        gzipped_body = await gzipped.json()
+        revalidate = {}
+        for name, etag in (("gzip", gzipped.headers["ETag"]), ("identity", plain.headers["ETag"])):
+            response = await client.get(
+                "/api/pansou/search",
+                params={"kw": "三体"},
+                headers={"Accept-Encoding": "gzip", "If-None-Match": etag},
+            )
+            revalidate[name] = response.status
+        return plain, gzipped, plain_body, gzipped_body, revalidate
+
+    plain, gzipped, plain_body, gzipped_body, revalidate = _run(scenario)
+    assert "Content-Encoding" not in plain.headers
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["Vary"] == "Accept-Encoding"
+    assert gzipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+    assert plain_body == gzipped_body
+    assert revalidate == {"gzip": 304, "identity": 304}
+
+
+def test_only_searches_count_towards_result_cache_hit_rate(upstream):
+    def snapshot():
+        return {event: RESULT_CACHE.value(event) for event in ("hit", "miss", "expired")}
+
+    async def scenario(client):
+        first = await (await client.get("/api/pansou/search", params={"kw": "三体", "limit": "1"})).json()
+        after_search = snapshot()
+        # 游标翻页和不存在的缓存键都不应影响命中率
+        await client.get("/api/pansou/search", params={"cursor": first["next_cursor"]})
+        await pansou_client.get_cached_by_key("missing")
+        await pansou_client.get_cached_search("不存在")
+        return after_search, snapshot()
+
+    before = snapshot()
+    after_search, after_lookups = _run(scenario)
+    assert after_search["miss"] == before["miss"] + 1
+    assert after_lookups == after_search
+
+
+def test_inflight_count_tracks_running_upstream_searches(monkeypatch):
+    release = asyncio.Event()
+
+    async def slow_request(**kwargs):
+        await release.wait()
+        return RESULTS
+
+    monkeypatch.setattr(pansou_client, "_execute_search_request", slow_request)
+
+    async def scenario():
+        searches = [asyncio.create_task(pansou_client.search("三体")) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        during = pansou_client.inflight_count, registry.render()
+        release.set()
+        await asyncio.gather(*searches)
+        return during, pansou_client.inflight_count
+
+    (count, rendered), after = asyncio.run(scenario())
+    assert count == 1
+    assert "pansou_inflight_searches 1" in rendered
+    assert after == 0
+
+
+def test_bot_refresh_clears_rendered_responses(upstream, monkeypatch):
+    async def edit_text(text, **kwargs):
+        pass
+
+    async def reply_text(text, **kwargs):
+        return SimpleNamespace(edit_text=edit_text)
+
+    async def healthy(force_refresh=False):
+        return True
+
+    monkeypatch.setattr(bot, "check_admin_permission", lambda update: True)
+    monkeypatch.setattr(bot, "auto_delete_message", lambda message: None)
+    monkeypatch.setattr(pansou_client, "health_check", healthy)
+    update = SimpleNamespace(message=SimpleNamespace(reply_text=reply_text), effective_user=SimpleNamespace(id=1))
+
+    async def scenario(client):
+        first = await client.get("/api/pansou/search", params={"kw": "三体"})
+        await bot.refresh_command(update, None)
+        again = await client.get(
+            "/api/pansou/search", params={"kw": "三体"}, headers={"If-None-Match": first.headers["ETag"]}
+        )
+        return again.status
+
+    # 刷新后重新请求上游；内容未变时 ETag 相同，仍可返回 304
+    assert _run(scenario) == 304
+    assert upstream == ["三体", "三体"]
@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+
+import rate_limit
+from config import ApiTokenConfig
+from rate_limit import ApiTokenLimiter, GCRALimiter, SearchRateLimiter
+
+
+def test_gcra_allows_burst_then_spaces_requests():
+    limiter = GCRALimiter(limit=3, window_seconds=60)
+    now = 1000.0
+    assert [limiter.check("u", now)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = limiter.check("u", now)
+    assert not allowed
+    assert retry_after == 20
+
+    # 每 20 秒恢复一次配额
+    assert not limiter.check("u", now + 19.9)[0]
+    assert limiter.check("u", now + 20)[0]
+    assert not limiter.check("u", now + 20)[0]
+
+
+def test_gcra_rejection_does_not_consume_quota():
+    limiter = GCRALimiter(limit=2, window_seconds=10)
+    now = 0.0
+    limiter.check("u", now)
+    limiter.check("u", now)
+    for _ in range(5):
+        assert not limiter.check("u", now + 1)[0]
+    assert limiter.check("u", now + 5)[0]
+
+
+def test_gcra_remaining_and_reset_after():
+    limiter = GCRALimiter(limit=4, window_seconds=60)
+    now = 500.0
+    assert limiter.remaining("u", now) == 4
+    limiter.check("u", now)
+    limiter.check("u", now)
+    assert limiter.remaining("u", now) == 2
+    assert limiter.reset_after("u", now) == 30
+    assert limiter.remaining("u", now + 30) == 4
+
+
+def test_gcra_explicit_burst():
+    limiter = GCRALimiter(limit=60, window_seconds=60, burst=2)
+    now = 0.0
+    assert limiter.check("u", now)[0]
+    assert limiter.check("u", now)[0]
+    assert not limiter.check("u", now)[0]
+    assert limiter.check("u", now + 1)[0]
+
+
+def test_gcra_keys_are_independent():
+    limiter = GCRALimiter(limit=1, window_seconds=60)
+    assert limiter.check("a", 0.0)[0]
+    assert not limiter.check("a", 0.0)[0]
+    assert limiter.check("b", 0.0)[0]
+
+
+def test_gcra_sweep_drops_only_expired_keys(monkeypatch):
+    monkeypatch.setattr(rate_limit, "SWEEP_INTERVAL", 3)
+    limiter = GCRALimiter(limit=1, window_seconds=10)
+    limiter.check("old", 0.0)
+    limiter.check("recent", 5.0)
+    # 第三次提交触发清理：old 的理论到达时间 10 已过，recent 的 15 未过
+    limiter.check("new", 12.0)
+    assert len(limiter) == 2
+    assert not limiter.check("recent", 12.0)[0]
+
+
+def test_search_limiter_rejects_on_any_level_without_charging_others():
+    limiter = SearchRateLimiter(user_limit=1, chat_limit=10, global_limit=10)
+    assert limiter.check("u1", "c1") == (True, 0)
+    chat_tat = limiter.chat._tat["c1"]
+    global_tat = limiter.global_._tat[SearchRateLimiter.GLOBAL_KEY]
+
+    allowed, retry_after = limiter.check("u1", "c1")
+    assert not allowed and retry_after > 0
+    assert limiter.rejections == {"user": 1, "inline": 0, "chat": 0, "global": 0}
+    # 被用户级拒绝的请求没有消耗群组和全局配额
+    assert limiter.chat._tat["c1"] == chat_tat
+    assert limiter.global_._tat[SearchRateLimiter.GLOBAL_KEY] == global_tat
+    assert limiter.check("u2", "c1")[0]
+
+
+def test_search_limiter_chat_and_global_levels():
+    limiter = SearchRateLimiter(user_limit=10, chat_limit=1, global_limit=2)
+    assert limiter.check("u1", "c1")[0]
+    assert not limiter.check("u2", "c1")[0]
+    assert limiter.rejections["chat"] == 1
+    assert limiter.check("u3", None)[0]
+    assert not limiter.check("u4", None)[0]
+    assert limiter.rejections["global"] == 1
+    assert limiter.recent_rejections.sum(60) == 2
+
+
+def test_inline_queries_use_their_own_user_budget():
+    limiter = SearchRateLimiter(user_limit=1, chat_limit=10, global_limit=3, inline_user_limit=1)
+    assert limiter.check("u1", inline=True)[0]
+    assert not limiter.check("u1", inline=True)[0]
+    assert limiter.rejections["inline"] == 1
+    # 内联查询用完自己的预算后，普通搜索仍可用
+    assert limiter.check("u1")[0]
+    # 全局预算两者共用
+    assert limiter.check("u2", inline=True)[0]
+    assert not limiter.check("u3")[0]
+    assert limiter.rejections["global"] == 1
+
+
+def _token(**overrides):
+    return ApiTokenConfig(**{"name": "partner", "token": "secret", **overrides})
+
+
+def test_api_token_daily_quota_resets_on_new_day():
+    async def scenario():
+        limiter = ApiTokenLimiter()
+        token = _token(daily_quota=2, rate_per_minute=100)
+        results = []
+        for _ in range(3):
+            allowed, retry_after, headers = await limiter.acquire(token)
+            results.append(allowed)
+            if allowed:
+                limiter.release(token)
+        exhausted_headers = headers
+        # 计数属于前一天时视为全新的一天
+        day, used = limiter._daily[token.name]
+        limiter._daily[token.name] = ("2000-01-01", used)
+        allowed, _, headers = await limiter.acquire(token)
+        return results, retry_after, exhausted_headers, allowed, headers
+
+    results, retry_after, exhausted_headers, allowed, headers = asyncio.run(scenario())
+    assert results == [True, True, False]
+    assert 0 < retry_after <= 86400
+    assert exhausted_headers["X-RateLimit-Daily-Remaining"] == "0"
+    assert allowed
+    assert headers["X-RateLimit-Daily-Remaining"] == "1"
+
+
+def test_api_token_concurrency_and_rate_limits():
+    async def scenario():
+        limiter = ApiTokenLimiter()
+        token = _token(max_concurrent=1, rate_per_minute=2)
+        first = await limiter.acquire(token)
+        busy = await limiter.acquire(token)
+        limiter.release(token)
+        second = await limiter.acquire(token)
+        limiter.release(token)
+        limited = await limiter.acquire(token)
+        return first, busy, second, limited, dict(limiter.rejections), limiter.active_requests()
+
+    first, busy, second, limited, rejections, active = asyncio.run(scenario())
+    assert first[0] and second[0]
+    assert busy[:2] == (False, 1)
+    assert not limited[0] and limited[1] >= 1
+    assert rejections == {"rate": 1, "concurrency": 1, "daily": 0}
+    assert active == {}
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / "shared.sqlite3")
+
+
+def _worker(path, owner):
+    """模拟一个 worker 进程的限流器。"""
+    limiter = ApiTokenLimiter()
+    limiter.enable_shared_state(path)
+    limiter._shared._get_executor()
+    limiter._shared.owner = owner
+    return limiter
+
+
+def test_shared_state_applies_quota_across_workers(shared_path):
+    async def scenario():
+        token = _token(daily_quota=3, rate_per_minute=100, max_concurrent=1)
+        first, second = _worker(shared_path, "w1"), _worker(shared_path, "w2")
+        results = [(await first.acquire(token))[0]]
+        # 另一个 worker 也看到了进行中的请求
+        results.append((await second.acquire(token))[0])
+        first.release(token)
+        await asyncio.sleep(0.05)
+        results.append((await second.acquire(token))[0])
+        second.release(token)
+        first._shared.close()
+        second._shared.close()
+
+        # 滚动重启后的新 worker 接着使用当天已用的次数
+        restarted = _worker(shared_path, "w3")
+        allowed, _, headers = await restarted.acquire(token)
+        restarted.release(token)
+        results.append(allowed)
+        results.append((await restarted.acquire(token))[0])
+        restarted._shared.close()
+        return results, headers
+
+    results, headers = asyncio.run(scenario())
+    assert results == [True, False, True, True, False]
+    assert headers["X-RateLimit-Daily-Remaining"] == "0"
+
+
+def test_clear_active_frees_slots_of_dead_worker(shared_path):
+    async def scenario():
+        token = _token(max_concurrent=1)
+        crashed = _worker(shared_path, "w1")
+        assert (await crashed.acquire(token))[0]
+        crashed._shared.close()
+
+        survivor = _worker(shared_path, "w2")
+        blocked = (await survivor.acquire(token))[0]
+        survivor._shared.clear_active("w1")
+        allowed = (await survivor.acquire(token))[0]
+        survivor._shared.close()
+        return blocked, allowed
+
+    assert asyncio.run(scenario()) == (False, True)
@@ -0,0 +1,115 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import pansou_client as pansou_client_module
+from pansou_client import pansou_client
+from shared_cache import SharedResultCache
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "shared.sqlite3")
+
+
+def test_set_get_and_expiry(cache_path):
+    async def scenario():
+        cache = SharedResultCache(cache_path)
+        expires_at = await cache.set("k", {"total": 1}, ttl=30)
+        hit = await cache.get("k")
+        await cache.set("old", {"total": 2}, ttl=-1)
+        expired = await cache.get("old")
+        cache.close()
+        return expires_at, hit, expired
+
+    expires_at, hit, expired = asyncio.run(scenario())
+    assert hit == ({"total": 1}, expires_at)
+    assert expired is None
+
+
+def test_lock_is_exclusive_until_unlocked_or_expired(cache_path):
+    async def scenario():
+        first = SharedResultCache(cache_path)
+        second = SharedResultCache(cache_path)
+        results = [await first.try_lock("k", 30)]
+        second._get_executor()
+        second.owner = "other-worker"
+        results.append(await second.try_lock("k", 30))
+        await first.unlock("k")
+        results.append(await second.try_lock("k", 0.05))
+        await asyncio.sleep(0.1)
+        # 锁过期后可被接管
+        results.append(await first.try_lock("k", 30))
+        first.close()
+        second.close()
+        return results
+
+    assert asyncio.run(scenario()) == [True, False, True, True]
+
+
+def test_sqlite_contention_does_not_block_event_loop(cache_path):
+    async def scenario():
+        cache = SharedResultCache(cache_path, busy_timeout=0.5)
+        await cache.set("warm", {}, ttl=30)
+
+        blocker = sqlite3.connect(cache_path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        # 写锁被占用：写入在执行器里等满 busy_timeout 后失败，事件循环期间照常运行
+        await cache.set("k", {"total": 1}, ttl=30)
+        waited = time.monotonic() - started
+        ticker_task.cancel()
+        blocker.execute("ROLLBACK")
+        blocker.close()
+        cache.close()
+        return waited, ticks
+
+    waited, ticks = asyncio.run(scenario())
+    assert waited >= 0.4
+    assert ticks >= 20
+
+
+def test_wait_timeout_fallback_writes_result_back(cache_path, monkeypatch):
+    calls = []
+
+    async def fake_request(**kwargs):
+        calls.append(kwargs["keyword"])
+        return {"total": 1, "merged_by_type": {"quark": [{"url": "u"}]}}
+
+    monkeypatch.setattr(pansou_client, "_execute_search_request", fake_request)
+    monkeypatch.setattr(pansou_client, "timeout", 0.1)
+    monkeypatch.setattr(pansou_client_module, "SHARED_WAIT_GRACE", 0.1)
+
+    async def scenario():
+        holder = SharedResultCache(cache_path)
+        holder._get_executor()
+        holder.owner = "stuck-worker"
+        await holder.try_lock("key", 30)
+
+        pansou_client._shared_cache = SharedResultCache(cache_path)
+        try:
+            result = await pansou_client._execute_shared_search(
+                "key", False, keyword="三体"
+            )
+            shared = await holder.get("key")
+        finally:
+            pansou_client._shared_cache.close()
+            pansou_client._shared_cache = None
+            pansou_client._result_cache.clear()
+            holder.close()
+        return result, shared
+
+    result, shared = asyncio.run(scenario())
+    assert calls == ["三体"]
+    assert shared is not None and shared[0] == result
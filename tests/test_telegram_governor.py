@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+
+from telegram.request import BaseRequest
+
+from telegram_governor import TelegramFloodGovernor, TokenBucket
+
+
+class FakeRequest(BaseRequest):
+    """记录调用顺序；responses 中的 (状态码, 内容) 依次返回，用完后返回 200。"""
+
+    def __init__(self, responses=None):
+        self.calls = []
+        self.responses = list(responses or [])
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        chat_id = request_data.parameters.get("chat_id") if request_data else None
+        self.calls.append((url.rsplit("/", 1)[-1], chat_id, time.monotonic()))
+        if self.responses:
+            return self.responses.pop(0)
+        return 200, b'{"ok": true, "result": true}'
+
+
+class FakeRequestData:
+    def __init__(self, **parameters):
+        self.parameters = parameters
+
+
+def _call(governor, method, chat_id):
+    return governor.do_request(
+        f"https://api.telegram.org/botTOKEN/{method}",
+        "POST",
+        request_data=FakeRequestData(chat_id=chat_id),
+    )
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated_at
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.5) == 0.0
+    assert not bucket.is_idle(now + 0.5)
+    assert bucket.is_idle(now + 1.0)
+
+
+def test_token_bucket_pause_holds_tokens_for_retry_after():
+    bucket = TokenBucket(rate=1, capacity=3)
+    now = bucket.updated_at
+    bucket.pause(now, 5)
+    assert bucket.wait_time(now) == 5.0
+    assert bucket.wait_time(now + 4) == 1.0
+    assert bucket.wait_time(now + 5) == 0.0
+
+
+def test_dispatches_by_priority():
+    async def scenario():
+        inner = FakeRequest()
+        governor = TelegramFloodGovernor(inner, global_rate=1000, private_rate=1000, private_burst=1000)
+        await asyncio.gather(
+            _call(governor, "deleteMessage", 1),
+            _call(governor, "sendMessage", 2),
+            _call(governor, "editMessageText", 3),
+            _call(governor, "deleteMessage", 4),
+            _call(governor, "answerCallbackQuery", 5),
+        )
+        await governor.shutdown()
+        return [method for method, *_ in inner.calls]
+
+    order = asyncio.run(scenario())
+    assert order == ["answerCallbackQuery", "editMessageText", "sendMessage", "deleteMessage", "deleteMessage"]
+
+
+def test_blocked_chat_does_not_block_other_chats():
+    async def scenario():
+        inner = FakeRequest()
+        governor = TelegramFloodGovernor(inner, global_rate=1000, private_rate=5, private_burst=1)
+        await asyncio.gather(
+            _call(governor, "editMessageText", 1),
+            _call(governor, "editMessageText", 1),
+            _call(governor, "sendMessage", 2),
+        )
+        await governor.shutdown()
+        return inner.calls
+
+    calls = asyncio.run(scenario())
+    assert [chat_id for _, chat_id, _ in calls] == [1, 2, 1]
+    # 会话 1 的第二次调用要等约 1/5 秒的令牌
+    assert calls[2][2] - calls[0][2] >= 0.15
+
+
+def test_same_chat_keeps_priority_then_fifo_order():
+    async def scenario():
+        inner = FakeRequest()
+        governor = TelegramFloodGovernor(inner, global_rate=1000, group_rate_per_minute=6000)
+        sends = [
+            _call(governor, "deleteMessage", -100),
+            _call(governor, "sendMessage", -100),
+            _call(governor, "editMessageText", -100),
+            _call(governor, "sendMessage", -100),
+        ]
+        await asyncio.gather(*sends)
+        await governor.shutdown()
+        return [method for method, *_ in inner.calls]
+
+    assert asyncio.run(scenario()) == ["editMessageText", "sendMessage", "sendMessage", "deleteMessage"]
+
+
+def test_retry_after_pauses_chat_and_retries():
+    retry = json.dumps({"ok": False, "error_code": 429, "parameters": {"retry_after": 0.3}}).encode()
+
+    async def scenario():
+        inner = FakeRequest(responses=[(429, retry)])
+        governor = TelegramFloodGovernor(inner, global_rate=1000, private_rate=1, private_burst=3)
+        code, _ = await _call(governor, "sendMessage", 7)
+        stats = governor.get_stats()
+        await governor.shutdown()
+        return code, inner.calls, stats
+
+    code, calls, stats = asyncio.run(scenario())
+    assert code == 200
+    assert len(calls) == 2
+    assert calls[1][2] - calls[0][2] >= 0.25
+    assert stats["retry_after"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_cancelled_waiter_is_dropped_from_queue():
+    async def scenario():
+        inner = FakeRequest()
+        governor = TelegramFloodGovernor(inner, global_rate=1000, private_rate=2, private_burst=1)
+        first = asyncio.create_task(_call(governor, "sendMessage", 9))
+        await first
+        waiting = asyncio.create_task(_call(governor, "sendMessage", 9))
+        await asyncio.sleep(0.05)
+        assert governor.queue_depth == 1
+        waiting.cancel()
+        await _call(governor, "sendMessage", 9)
+        depth = governor.queue_depth
+        await governor.shutdown()
+        return inner.calls, depth
+
+    calls, depth = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert depth == 0
+
+
+def test_document_uploads_are_governed_with_send_priority():
+    async def scenario():
+        inner = FakeRequest()
+        governor = TelegramFloodGovernor(inner, global_rate=1000, group_rate_per_minute=6000)
+        await asyncio.gather(
+            _call(governor, "deleteMessage", -100),
+            _call(governor, "sendDocument", -100),
+            _call(governor, "editMessageText", -100),
+        )
+        await governor.shutdown()
+        return [method for method, *_ in inner.calls]
+
+    assert asyncio.run(scenario()) == ["editMessageText", "sendDocument", "deleteMessage"]
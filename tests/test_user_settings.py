@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+from user_settings import DEFAULT_USER_SETTINGS, SettingsBackend, SettingsManager, SqliteSettingsBackend
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return str(tmp_path)
+
+
+def _manager(data_dir, **kwargs):
+    return SettingsManager(data_dir=data_dir, backend="sqlite", flush_delay=0, **kwargs)
+
+
+def test_sqlite_backend_does_not_touch_disk_until_used(data_dir):
+    manager = _manager(data_dir)
+    assert not os.path.exists(os.path.join(data_dir, "user_settings.sqlite3"))
+    manager.backend.close()
+
+
+def test_migrate_from_json_runs_once(data_dir):
+    with open(os.path.join(data_dir, "user_42.json"), "w", encoding="utf-8") as f:
+        json.dump({"user_id": 42, "result_limit": 25}, f)
+
+    manager = _manager(data_dir)
+    assert manager.migrate_from_json() == 1
+    assert manager.get_settings(42).result_limit == 25
+    # 已导入过则跳过，即使 JSON 文件还在
+    assert manager.migrate_from_json() == 0
+    manager.backend.close()
+
+
+def test_json_backend_needs_no_migration(data_dir):
+    manager = SettingsManager(data_dir=data_dir, backend="json")
+    assert manager.migrate_from_json() == 0
+
+
+def test_sqlite_reads_do_not_wait_for_write_lock(data_dir):
+    backend = SqliteSettingsBackend(os.path.join(data_dir, "settings.sqlite3"))
+    backend.save_many([{"user_id": 1, "result_limit": 5}])
+
+    loaded = []
+    with backend._write_lock:
+        reader = threading.Thread(target=lambda: loaded.append(backend.load(1)))
+        reader.start()
+        reader.join(timeout=2)
+    assert loaded == [{"user_id": 1, "result_limit": 5}]
+    backend.close()
+
+
+class MemoryBackend(SettingsBackend):
+    """内存后端：gate 未打开时写入会阻塞，fail 为 True 时写入抛异常。"""
+
+    def __init__(self):
+        self.rows = {}
+        self.gate = threading.Event()
+        self.gate.set()
+        self.writing = threading.Event()
+        self.fail = False
+
+    def load(self, user_id):
+        return self.rows.get(user_id)
+
+    def save_many(self, items):
+        self.writing.set()
+        self.gate.wait(timeout=5)
+        if self.fail:
+            raise OSError("disk full")
+        for data in items:
+            self.rows[data["user_id"]] = data
+
+    def delete_many(self, user_ids):
+        for user_id in user_ids:
+            self.rows.pop(user_id, None)
+
+
+@pytest.fixture
+def memory_manager(data_dir):
+    manager = SettingsManager(data_dir=data_dir, backend="json", flush_delay=60, cache_size=2)
+    manager.backend = MemoryBackend()
+    return manager
+
+
+def test_lru_evicts_least_recently_used(memory_manager):
+    manager = memory_manager
+    manager.update_settings(1, result_limit=11)
+    manager.update_settings(2, result_limit=12)
+    manager.get_settings(1)
+    manager.update_settings(3, result_limit=13)
+    assert list(manager.settings_cache) == [1, 3]
+    assert manager.stats["eviction"] == 1
+    # 被淘汰的用户从存储重新加载
+    assert manager.get_settings(2).result_limit == 12
+    assert manager.get_settings(4) is DEFAULT_USER_SETTINGS
+
+
+def test_evicted_user_is_served_from_dirty_set_while_write_is_in_flight(memory_manager):
+    manager = memory_manager
+    backend = manager.backend
+
+    async def scenario():
+        manager.update_settings(1, result_limit=11)
+        backend.rows[1] = {"user_id": 1, "result_limit": 5}
+        backend.gate.clear()
+        flush = asyncio.create_task(manager.aflush())
+        await asyncio.get_running_loop().run_in_executor(None, backend.writing.wait)
+        # 写入尚未提交时用户 1 被挤出 LRU，仍应读到待写入的新设置而不是存储中的旧值
+        manager.update_settings(2, result_limit=12)
+        manager.update_settings(3, result_limit=13)
+        assert 1 not in manager.settings_cache
+        during = manager.get_settings(1).result_limit
+        backend.gate.set()
+        await flush
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+        return during
+
+    assert asyncio.run(scenario()) == 11
+    assert backend.rows[1]["result_limit"] == 11
+    # 只有写入时已在快照中的条目被清理
+    assert set(manager._dirty) == {2, 3}
+
+
+def test_failed_write_keeps_changes_dirty(memory_manager):
+    manager = memory_manager
+    backend = manager.backend
+    backend.fail = True
+
+    async def scenario():
+        manager.update_settings(1, result_limit=11)
+        await manager.aflush()
+        assert set(manager._dirty) == {1}
+        backend.fail = False
+        await manager.aflush()
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    asyncio.run(scenario())
+    assert manager._dirty == {}
+    assert backend.rows[1]["result_limit"] == 11
+
+
+def test_change_during_write_is_flushed_again(memory_manager):
+    manager = memory_manager
+    backend = manager.backend
+
+    async def scenario():
+        settings = manager.update_settings(1, result_limit=11)
+        backend.gate.clear()
+        flush = asyncio.create_task(manager.aflush())
+        await asyncio.get_running_loop().run_in_executor(None, backend.writing.wait)
+        # 同一个对象在写入期间被再次修改，这次写入的快照已过时
+        settings.result_limit = 21
+        manager.save_settings(settings)
+        backend.gate.set()
+        await flush
+        assert set(manager._dirty) == {1}
+        await manager.aflush()
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    asyncio.run(scenario())
+    assert manager._dirty == {}
+    assert backend.rows[1]["result_limit"] == 21
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_reset_deletes_stored_settings(data_dir, backend):
+    manager = SettingsManager(data_dir=data_dir, backend=backend)
+    manager.update_settings(7, result_limit=30)
+    assert manager.backend.load(7) is not None
+
+    manager.reset_settings(7)
+    # 重置后重新共用默认设置，存储中不再保留任何记录
+    assert manager.backend.load(7) is None
+    assert 7 not in manager.settings_cache
+    assert manager.get_settings(7) is DEFAULT_USER_SETTINGS
+    assert manager.get_stats()["dirty"] == 0
+    manager.backend.close()
+
+
+def test_pending_reset_wins_over_stored_row(memory_manager):
+    manager = memory_manager
+    manager.negative_cache_size = 1
+    backend = manager.backend
+    backend.rows[1] = {"user_id": 1, "result_limit": 30}
+
+    async def scenario():
+        assert manager.get_settings(1).result_limit == 30
+        manager.reset_settings(1)
+        # 负缓存被挤掉后，删除尚未写入时仍返回默认设置而不是存储中的旧记录
+        manager.get_settings(2)
+        during = manager.get_settings(1)
+        await manager.aflush()
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+        return during
+
+    assert asyncio.run(scenario()) is DEFAULT_USER_SETTINGS
+    assert 1 not in backend.rows